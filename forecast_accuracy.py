@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""Prints how far off the archived Tomorrow.io forecasts were, per lead time"""
+
+import argparse
+import time
+
+from tabulate import tabulate
+
+from home_automation import forecast_accuracy, utilities
+from home_automation.columnar import ColumnStore
+
+
+def main(argv=None):
+    """Parses the command line and prints the accuracy report"""
+    parser = argparse.ArgumentParser(description="Forecast accuracy per lead time")
+    parser.add_argument("--days", type=int, default=365, help="How far back to look")
+    parser.add_argument("--device", default="Outdoor", help="The outdoor module")
+    args = parser.parse_args(argv)
+
+    report = forecast_accuracy.report(
+        ColumnStore.from_settings(utilities.SETTINGS),
+        start=time.time() - args.days * 86400,
+        device=args.device,
+    )
+    print(tabulate(report, headers="keys", floatfmt=".2f"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+"""Command line entry point, see home_automation.jobs"""
+
+import sys
+
+from home_automation.jobs import main
+
+# Guarded, spawned worker processes import this module as __mp_main__
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,556 @@
+"""Pluggable sensor collectors, scheduled and written together
+
+Each source of readings is a :class:`Collector` that only knows how to fetch
+its readings. Which collectors run, how often, and the devices they map are
+declared in the JSON file named by ``collectors_file``::
+
+    [
+        {"kind": "netatmo", "name": "netatmo", "interval": 60},
+        {
+            "kind": "indigo",
+            "name": "indigo",
+            "interval": 300,
+            "devices": [
+                {
+                    "name": "Computer Room Temperature",
+                    "metric": "temp",
+                    "device": "computer_room"
+                }
+            ]
+        }
+    ]
+
+Without one, :data:`DEFAULT_CONFIG` collects what log_netatmo.py and
+log_indigo_metrics.py do. Every run starts the collectors that are due
+together on a shared thread pool and writes all of their readings in one
+batch. Each collector has a fixed slot within its interval, derived from its
+name, so collectors with the same interval don't all poll at the same moment.
+A new source is a Collector subclass decorated with :func:`register`, no new
+Job is needed. netatmo.run and indigo_metrics.run run the default collectors
+through the same pipeline.
+"""
+
+import json
+import os
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
+
+import requests
+import statsd
+from influxdb import InfluxDBClient
+
+from home_automation import (
+    derived,
+    exposition,
+    indigo_metrics,
+    netatmo,
+    profiling,
+    read_api,
+    state,
+    utilities,
+)
+from home_automation.ringbuffer import RingBufferStore
+
+# Collector kind -> its class, see register
+COLLECTOR_TYPES = {}
+
+
+def register(cls):
+    """Class decorator that makes a Collector available to the config by kind"""
+    COLLECTOR_TYPES[cls.kind] = cls
+    return cls
+
+
+class Collector:
+    """A source of sensor readings
+
+    Subclasses set ``kind`` and implement collect. Readings are dicts with
+    the device, sensor and measurement, and optionally the epoch time they
+    were taken and whether they changed since they were last written.
+
+    Parameters
+    ----------
+    name : str
+        Unique name of the collector, the readings are published under it.
+    interval : float
+        Seconds between runs.
+    """
+
+    kind = None
+
+    # How changed readings reach the metrics server, influxdb or statsd
+    transport = "influxdb"
+
+    def __init__(self, name: str, interval: float = 300):
+        """Set up the collector"""
+        self.name = name
+        self.interval = interval
+
+    def due(self, settings: utilities.Settings, now: float) -> bool:
+        """Lets a collector skip a scheduled run, e.g. when no data is new"""
+        return True
+
+    def collect(self, settings: utilities.Settings, session=None) -> list:
+        """Fetches the current readings
+
+        Parameters
+        ----------
+        settings : Settings
+            Where the credentials and URLs come from
+        session : requests.Session, optional
+            Session to send the requests on
+
+        Returns
+        -------
+        list
+            A dict per reading
+        """
+        raise NotImplementedError
+
+    def written(self, readings: list, settings: utilities.Settings, session=None):
+        """Called once the readings are written, for follow ups of the source"""
+
+
+@register
+class NetatmoCollector(Collector):
+    """The dashboard readings of the Netatmo station in the Settings
+
+    Readings are stamped with their upload, and only uploads that weren't
+    written before count as changed. The dew point, heat index and the like
+    are derived from the changed readings, see :mod:`home_automation.derived`.
+    The station is only polled once its next upload is due, see
+    netatmo.UploadTracker.
+    """
+
+    kind = "netatmo"
+
+    def __init__(self, name: str = "netatmo", interval: float = 60):
+        """Set up the collector, the upload tracker is read on first use"""
+        super().__init__(name, interval)
+        self._uploads = None
+
+    def uploads(self, settings: utilities.Settings) -> netatmo.UploadTracker:
+        """The upload tracker of the station"""
+        if self._uploads is None:
+            self._uploads = netatmo.UploadTracker.from_settings(settings)
+        return self._uploads
+
+    def due(self, settings: utilities.Settings, now: float) -> bool:
+        """True once the station's next upload should have arrived"""
+        if self.uploads(settings).due(now):
+            return True
+        print("No new Netatmo upload expected yet, not polling")
+        return False
+
+    def collect(self, settings: utilities.Settings, session=None) -> list:
+        """Reads the station's dashboard and derives the extra series"""
+        now = time.time()
+        access_token = netatmo.get_access_token(settings, session=session)
+        data = netatmo.get_stations_data(
+            access_token, settings.netatmo_device_id, session=session
+        )
+        metrics = netatmo.dashboard_metrics(data)
+        fresh = self.uploads(settings).record(metrics, now)
+        print(f"{len(fresh)} of {len(metrics)} readings are new")
+        # Dew point, heat index and the like, written as series of their own
+        extra = derived.derive_metrics(
+            fresh, now, RingBufferStore.from_settings(settings)
+        )
+        fresh_ids = {id(m) for m in fresh}
+        return [dict(m, changed=id(m) in fresh_ids) for m in metrics] + [
+            dict(m, changed=True) for m in extra
+        ]
+
+    def written(self, readings: list, settings: utilities.Settings, session=None):
+        """Archives the new readings, copies them to Indigo and saves the uploads"""
+        fresh = [reading for reading in readings if reading["changed"]]
+        netatmo.archive_metrics(fresh, time.time(), settings)
+        for reading in fresh:
+            variable = netatmo.INDIGO_VARIABLES.get(
+                (reading["device"], reading["sensor"])
+            )
+            if variable is not None:
+                utilities.update_indigo_variable(
+                    variable, reading["measurement"], session=session
+                )
+        self.uploads(settings).save()
+
+
+@register
+class IndigoCollector(Collector):
+    """The states of Indigo devices, mapped to a metric and device
+
+    Devices are only read again when Indigo says they changed, see
+    indigo_metrics.DeviceListCache. Changed readings are sent to statsd as
+    gauges, as Indigo readings always have been.
+
+    Parameters
+    ----------
+    name : str
+        Unique name of the collector.
+    interval : float
+        Seconds between runs.
+    devices : list, optional
+        Dicts with the Indigo device name, and the metric and device it is
+        logged as, defaults to indigo_metrics.INDIGO_DEVICES
+    """
+
+    kind = "indigo"
+    transport = "statsd"
+
+    def __init__(
+        self,
+        name: str = "indigo",
+        interval: float = 300,
+        devices: Optional[list] = None,
+    ):
+        """Set up the collector, the mirror is read on first use"""
+        super().__init__(name, interval)
+        self.devices = devices if devices is not None else indigo_metrics.INDIGO_DEVICES
+        self._mirror = None
+
+    def collect(self, settings: utilities.Settings, session=None) -> list:
+        """Reads the devices that changed, and reports every mapped device"""
+        cache = indigo_metrics.DeviceListCache.from_settings(settings)
+        self._mirror = indigo_metrics.mirror_from_settings(settings)
+        urls = indigo_metrics.device_urls(
+            [device["name"] for device in self.devices], settings, session, cache
+        )
+        # Only the devices that changed are read again, when Indigo vouched for
+        # the versions in this run, otherwise the mirror falls back to max_age
+        versions = cache.versions()
+        read = self._mirror.sync(
+            [
+                {"name": name, "restURL": url, "lastChanged": versions.get(name)}
+                for name, url in urls.items()
+            ],
+            lambda device: indigo_metrics.getIndigoDevice(
+                device["restURL"], settings, session
+            )["displayRawState"],
+        )
+        print(f"Read {read} of {len(urls)} Indigo devices")
+        changes = self._mirror.diff(f"collector:{self.name}")
+        return [
+            {
+                "device": device["device"],
+                "sensor": device["metric"],
+                "measurement": self._mirror.get(device["name"]),
+                "changed": device["name"] in changes,
+            }
+            for device in self.devices
+            if device["name"] in urls
+        ]
+
+    def written(self, readings: list, settings: utilities.Settings, session=None):
+        """Archives the readings and saves the mirror, and with it which
+        changes were written
+        """
+        indigo_metrics.archive_readings(readings, time.time(), settings)
+        if self._mirror is not None:
+            self._mirror.save()
+
+
+# What log_netatmo.py and log_indigo_metrics.py collect
+DEFAULT_CONFIG = [
+    {"kind": "netatmo", "name": "netatmo", "interval": 60},
+    {"kind": "indigo", "name": "indigo", "interval": 300},
+]
+
+
+def load_collectors(config: list) -> list:
+    """Creates the collectors a config declares
+
+    Parameters
+    ----------
+    config : list
+        A dict per collector with its kind, and its name, interval and
+        options
+
+    Returns
+    -------
+    list
+        The collectors
+
+    Raises
+    ------
+    ValueError
+        If a kind isn't registered, or two collectors have the same name.
+    """
+    collectors = []
+    for entry in config:
+        options = dict(entry)
+        kind = options.pop("kind")
+        if kind not in COLLECTOR_TYPES:
+            raise ValueError(f"Unknown collector kind {kind}")
+        collectors.append(COLLECTOR_TYPES[kind](**options))
+    names = [collector.name for collector in collectors]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate collector names: {', '.join(duplicates)}")
+    return collectors
+
+
+def collectors_from_settings(settings: utilities.Settings) -> list:
+    """The collectors declared in collectors_file, or the default ones"""
+    if not settings.collectors_file:
+        return load_collectors(DEFAULT_CONFIG)
+    with open(settings.collectors_file, encoding="utf-8") as config_file:
+        return load_collectors(json.load(config_file))
+
+
+class Schedule:
+    """When each collector last ran, and so when it runs next
+
+    A collector runs in a fixed slot of its interval, offset by a hash of its
+    name, so collectors with the same interval are spread over it. A
+    collector that never ran is due at once.
+
+    Parameters
+    ----------
+    path : str, optional
+        JSON file the last runs are kept in, None keeps them in memory only.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """Set up the schedule, the file is only read on first use"""
+        self.path = path
+        self._last_runs = None
+
+    @classmethod
+    def from_settings(cls, settings: utilities.Settings) -> "Schedule":
+        """The schedule configured by Settings, kept under state_dir"""
+        return cls(os.path.join(settings.state_dir, "collectors.json"))
+
+    @property
+    def last_runs(self) -> dict:
+        """Collector name -> epoch time of its last run"""
+        if self._last_runs is None:
+            self._last_runs = state.load_json(self.path, {}) if self.path else {}
+        return self._last_runs
+
+    def next_run(self, collector: Collector) -> float:
+        """Epoch time the collector is next due"""
+        last = self.last_runs.get(collector.name)
+        if last is None:
+            return 0.0
+        interval = max(collector.interval, 1)
+        offset = zlib.crc32(collector.name.encode("utf-8")) % interval
+        return ((last - offset) // interval + 1) * interval + offset
+
+    def due(self, collectors: list, now: float) -> list:
+        """The collectors whose slot has come"""
+        return [c for c in collectors if now >= self.next_run(c)]
+
+    def ran(self, collector: Collector, now: float):
+        """Records a run"""
+        self.last_runs[collector.name] = now
+
+    def save(self):
+        """Persists the last runs"""
+        if self.path:
+            state.save_json(self.path, self.last_runs)
+
+
+def write_readings(
+    readings: list, timestamp: int, settings: Optional[utilities.Settings] = None
+):
+    """Writes the readings of every collector in one batch
+
+    Changed readings go to InfluxDB, or statsd for collectors with that
+    transport, and the ring buffers, every reading to the exposition
+    endpoint and the read API.
+
+    Parameters
+    ----------
+    readings : list
+        Readings with the source, product and transport they came from
+    timestamp : int
+        Epoch milliseconds of the run, for readings without their own time
+    settings : Settings, optional
+        Defaults to utilities.SETTINGS
+    """
+    settings = settings or utilities.SETTINGS
+    changed = []
+    for reading in readings:
+        try:
+            value = float(reading["measurement"])
+        except (TypeError, ValueError):
+            continue  # e.g. an on or off state
+        if reading.get("changed", True):
+            taken = reading.get("time")
+            changed.append((reading, value, taken * 1000 if taken else timestamp))
+
+    lines = [c for c in changed if c[0].get("transport") != "statsd"]
+    gauges = [c for c in changed if c[0].get("transport") == "statsd"]
+    if settings.metrics_push and lines:
+        print("Logging to InfluxDB")
+        influx = InfluxDBClient(
+            host=settings.metrics_server,
+            port=8086,
+            database="metrics",
+            timeout=settings.http_read_timeout,
+        )
+        # Stamped with the upload, so a reading is one point however often
+        # it is polled
+        influx.write_points(
+            [
+                netatmo.line_protocol(
+                    r["sensor"],
+                    r["device"],
+                    value,
+                    int(taken),
+                    {"product": r["product"]},
+                )
+                for r, value, taken in lines
+            ],
+            time_precision="ms",
+            batch_size=10000,
+            protocol="line",
+        )
+    if settings.metrics_push and gauges:
+        statsd_connection = statsd.StatsClient(settings.metrics_server, 8125)
+        for reading, value, _ in gauges:
+            measure = f"{reading['sensor']},device={reading['device']}"
+            statsd_connection.gauge(measure, value)
+            print(measure, ": ", value)
+
+    ring_buffers = RingBufferStore.from_settings(settings)
+    for reading, value, taken in changed:
+        ring_buffers.append(reading["device"], reading["sensor"], taken / 1000, value)
+
+    published = {}
+    for reading in readings:
+        exposition.REGISTRY.set(
+            f"{reading['product']}_{reading['sensor']}",
+            reading["measurement"],
+            {"device": reading["device"]},
+        )
+        devices = published.setdefault(reading["source"], {})
+        devices.setdefault(reading["device"], {})[reading["sensor"]] = reading[
+            "measurement"
+        ]
+    for source, devices in published.items():
+        read_api.SNAPSHOT.merge("readings", source, devices)
+
+
+def run_collectors(
+    collectors: list,
+    settings: Optional[utilities.Settings] = None,
+    session: Optional[requests.Session] = None,
+    schedule: Optional[Schedule] = None,
+    workers: Optional[int] = None,
+    now: Optional[float] = None,
+    force: bool = False,
+) -> dict:
+    """Runs the collectors that are due and writes their readings together
+
+    Parameters
+    ----------
+    collectors : list
+        The configured collectors
+    settings : Settings, optional
+        Defaults to utilities.SETTINGS
+    session : requests.Session, optional
+        Session to send the requests on
+    schedule : Schedule, optional
+        When they last ran, without one every collector runs
+    workers : int, optional
+        Collectors run at the same time, defaults to collector_workers
+    now : float, optional
+        The current time, defaults to time.time()
+    force : bool
+        Run every collector, even those that aren't due
+
+    Returns
+    -------
+    dict
+        Collector name -> the exception of each collector that failed
+
+    Raises
+    ------
+    RuntimeError
+        If every collector that ran failed.
+    """
+    settings = settings or utilities.SETTINGS
+    now = time.time() if now is None else now
+    due = collectors
+    if not force:
+        due = schedule.due(due, now) if schedule is not None else due
+        due = [collector for collector in due if collector.due(settings, now)]
+    if not due:
+        print("No collectors are due")
+        return {}
+
+    readings = {}
+    errors = {}
+    with profiling.phase("fetch"):
+        with ThreadPoolExecutor(
+            max_workers=min(workers or settings.collector_workers, len(due)),
+            thread_name_prefix="collector",
+        ) as executor:
+            futures = {
+                executor.submit(collector.collect, settings, session): collector
+                for collector in due
+            }
+            for future in as_completed(futures):
+                collector = futures[future]
+                try:
+                    readings[collector.name] = [
+                        dict(
+                            r,
+                            source=collector.name,
+                            product=collector.kind,
+                            transport=collector.transport,
+                        )
+                        for r in future.result()
+                    ]
+                except (Exception, SystemExit) as error:  # Others carry on
+                    print(f"Collector {collector.name} failed: {error!r}")
+                    errors[collector.name] = error
+    if len(errors) == len(due):
+        failed = RuntimeError(f"Every collector failed: {', '.join(errors)}")
+        raise failed from next(iter(errors.values()))
+
+    with profiling.phase("write"):
+        write_readings(
+            [r for collector in due for r in readings.get(collector.name, [])],
+            int(now * 1000),
+            settings,
+        )
+        for collector in due:
+            if collector.name in readings:
+                collector.written(readings[collector.name], settings, session)
+                if schedule is not None:
+                    schedule.ran(collector, now)
+        if schedule is not None:
+            schedule.save()
+    return errors
+
+
+def run(
+    settings: Optional[utilities.Settings] = None,
+    session: Optional[requests.Session] = None,
+) -> dict:
+    """Runs the configured collectors that are due
+
+    Parameters
+    ----------
+    settings : Settings, optional
+        Defaults to utilities.SETTINGS
+    session : requests.Session, optional
+        Session to send the requests on, so jobs can share connection pools
+
+    Returns
+    -------
+    dict
+        Collector name -> the exception of each collector that failed
+    """
+    settings = settings or utilities.SETTINGS
+    return run_collectors(
+        collectors_from_settings(settings),
+        settings,
+        session,
+        Schedule.from_settings(settings),
+    )
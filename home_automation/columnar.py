@@ -0,0 +1,349 @@
+"""An append-only columnar store of forecasts and sensor readings
+
+Each table is partitioned by UTC day, and every append adds a part to the
+day's partition with one NumPy ``.npy`` file per column::
+
+    directory/netatmo/2024-01-15/part-<ns>-<pid>/time.npy
+                                                /device.npy
+                                                /value.npy
+
+Parts are written to a temporary directory and renamed into place, so
+readers never see a partial append and several jobs can append at once.
+Reads only open the columns asked for, memory mapped, and skip every day
+outside the requested time range, which keeps years of history quick to
+query without the metrics server.
+
+Once a table gets its first rows for a later day, the parts of the earlier
+days are compacted into one part per day, so a day of frequent appends isn't
+read as hundreds of parts. A compacted part lists the parts it replaces in
+``replaces.txt`` and is renamed into place like any other, so readers skip
+the replaced parts from that moment, before they are deleted.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+TIME = "time"  # Epoch seconds, UTC, every table has it
+
+# In a compacted part, the names of the parts it replaces
+REPLACES = "replaces.txt"
+
+# Seconds replaced parts are kept, for reads that listed them before
+REPLACED_GRACE = 600
+
+# Seconds after which a compaction lock is assumed to be left by a crash
+STALE_LOCK = 3600
+
+
+def _as_column(values) -> np.ndarray:
+    """Converts values to an array that can be saved and memory mapped"""
+    array = np.asarray(values)
+    if array.dtype == object:
+        array = array.astype(str)
+    return array
+
+
+def _day(timestamp: float) -> str:
+    """The UTC day partition of an epoch time"""
+    return str(np.datetime64(int(timestamp), "s").astype("datetime64[D]"))
+
+
+class ColumnStore:
+    """A directory of append-only, day partitioned tables
+
+    Parameters
+    ----------
+    directory : str
+        Where the tables are kept.
+    """
+
+    def __init__(self, directory: str):
+        """Set up the store, tables are created on first append"""
+        self.directory = directory
+
+    @classmethod
+    def from_settings(cls, settings) -> "ColumnStore":
+        """The store configured by Settings, kept under state_dir"""
+        return cls(os.path.join(settings.state_dir, "columns"))
+
+    def append(self, table: str, columns: dict) -> int:
+        """Adds rows to a table
+
+        Parameters
+        ----------
+        table : str
+            The table name, e.g. netatmo
+        columns : dict
+            Column name -> values, all the same length, including a time
+            column of epoch seconds
+
+        Returns
+        -------
+        int
+            The number of rows written
+        """
+        arrays = {name: _as_column(values) for name, values in columns.items()}
+        if TIME not in arrays:
+            raise ValueError(f"{table} rows need a {TIME} column")
+        lengths = {len(array) for array in arrays.values()}
+        if len(lengths) != 1:
+            raise ValueError(f"{table} columns have different lengths: {lengths}")
+        times = arrays[TIME].astype("float64")
+        if len(times) == 0:
+            return 0
+
+        days = times.astype("int64").astype("datetime64[s]").astype("datetime64[D]")
+        new_days = []
+        for day in np.unique(days):
+            selected = days == day
+            partition = os.path.join(self.directory, table, str(day))
+            if not os.path.isdir(partition):
+                new_days.append(str(day))
+            os.makedirs(partition, exist_ok=True)
+            staging = tempfile.mkdtemp(dir=partition, prefix=".staging-")
+            for name, array in arrays.items():
+                np.save(os.path.join(staging, f"{name}.npy"), array[selected])
+            os.rename(
+                staging,
+                os.path.join(partition, f"part-{time.time_ns()}-{os.getpid()}"),
+            )
+        if new_days:
+            # The earlier days are closed, merge their parts so reads stay quick
+            self.compact(table, before=max(new_days))
+        return len(times)
+
+    @staticmethod
+    def _replaced(day_path: str) -> dict:
+        """The names of a day partition's replaced parts -> the part that
+        replaced them
+        """
+        replaced = {}
+        for name in sorted(os.listdir(day_path)):  # The latest replacement wins
+            path = os.path.join(day_path, name, REPLACES)
+            if name.startswith("part-") and os.path.exists(path):
+                with open(path, encoding="utf-8") as replaces:
+                    replaced.update(dict.fromkeys(replaces.read().split(), name))
+        return replaced
+
+    def _parts(self, day_path: str) -> list:
+        """The names of a day partition's parts, without replaced ones, oldest
+        first
+        """
+        replaced = self._replaced(day_path)
+        return sorted(
+            name
+            for name in os.listdir(day_path)
+            if name.startswith("part-") and name not in replaced
+        )
+
+    def compact(self, table: str, before: Optional[str] = None) -> int:
+        """Merges the parts of each day partition into one
+
+        Parts with the same columns are merged, in the order they were
+        appended. A day another process is compacting is skipped. The parts
+        merged away are deleted REPLACED_GRACE seconds later, by the next
+        compaction.
+
+        Parameters
+        ----------
+        table : str
+            The table name
+        before : str, optional
+            Only days before this one, e.g. 2024-01-15, are compacted, defaults
+            to the current UTC day
+
+        Returns
+        -------
+        int
+            The number of parts merged away
+        """
+        root = os.path.join(self.directory, table)
+        if not os.path.isdir(root):
+            return 0
+        before = before or _day(time.time())
+        merged = 0
+        for day in sorted(os.listdir(root)):
+            day_path = os.path.join(root, day)
+            if day >= before or not os.path.isdir(day_path):
+                continue
+            lock = os.path.join(day_path, ".compacting")
+            try:
+                os.mkdir(lock)
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(lock) < STALE_LOCK:
+                        continue
+                except FileNotFoundError:
+                    continue  # Just finished
+
+            try:
+                merged += self._compact_day(day_path)
+            finally:
+                os.rmdir(lock)
+        return merged
+
+    def _compact_day(self, day_path: str) -> int:
+        """Merges the parts of one day partition, the caller holds its lock"""
+        replaced = self._replaced(day_path)
+        live = self._parts(day_path)
+        groups = {}
+        for name in live:
+            columns = tuple(
+                sorted(
+                    column[:-4]
+                    for column in os.listdir(os.path.join(day_path, name))
+                    if column.endswith(".npy")
+                )
+            )
+            groups.setdefault(columns, []).append(name)
+
+        merged = 0
+        for columns, names in groups.items():
+            if len(names) < 2:
+                continue
+            staging = tempfile.mkdtemp(dir=day_path, prefix=".staging-")
+            for column in columns:
+                np.save(
+                    os.path.join(staging, f"{column}.npy"),
+                    np.concatenate(
+                        [
+                            np.load(os.path.join(day_path, name, f"{column}.npy"))
+                            for name in names
+                        ]
+                    ),
+                )
+            # And what they replaced, so those stay hidden once they are deleted
+            hidden = names + [old for old, by in replaced.items() if by in names]
+            with open(os.path.join(staging, REPLACES), "w", encoding="utf-8") as out:
+                out.write("\n".join(hidden))
+            # Sorts right after the first part it replaces, keeping the order
+            first = names[0].split("+")[0]
+            os.rename(staging, os.path.join(day_path, f"{first}+{time.time_ns()}"))
+            merged += len(names) - 1
+
+        # Replaced parts are deleted by a later compaction, once reads that
+        # listed them before they were replaced have finished
+        for name, replacement in self._replaced(day_path).items():
+            if not os.path.exists(os.path.join(day_path, name)):
+                continue
+            try:
+                replaced_at = os.path.getmtime(os.path.join(day_path, replacement))
+            except FileNotFoundError:
+                continue  # Itself replaced and deleted, the next one lists it
+            if time.time() - replaced_at >= REPLACED_GRACE:
+                shutil.rmtree(os.path.join(day_path, name), ignore_errors=True)
+        return merged
+
+    def partitions(
+        self, table: str, start: Optional[float] = None, end: Optional[float] = None
+    ) -> list:
+        """The parts of a table that may hold rows in a time range, oldest first
+
+        Parameters
+        ----------
+        table : str
+            The table name
+        start : float, optional
+            Epoch seconds, inclusive
+        end : float, optional
+            Epoch seconds, exclusive
+
+        Returns
+        -------
+        list
+            Paths of the part directories
+        """
+        root = os.path.join(self.directory, table)
+        if not os.path.isdir(root):
+            return []
+        first = _day(start) if start is not None else None
+        last = _day(end) if end is not None else None
+        parts = []
+        for day in sorted(os.listdir(root)):
+            if (first and day < first) or (last and day > last):
+                continue  # Pruned, the whole day is outside the range
+            day_path = os.path.join(root, day)
+            parts.extend(os.path.join(day_path, part) for part in self._parts(day_path))
+        return parts
+
+    def read(
+        self,
+        table: str,
+        columns: Optional[list] = None,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+    ) -> dict:
+        """Reads some columns of a table over a time range
+
+        Parameters
+        ----------
+        table : str
+            The table name
+        columns : list, optional
+            Columns to read, defaults to all of them
+        start : float, optional
+            Epoch seconds, inclusive
+        end : float, optional
+            Epoch seconds, exclusive
+
+        Returns
+        -------
+        dict
+            Column name -> array, in the order the rows were appended. A
+            column missing from older parts is NaN there.
+        """
+        parts = self.partitions(table, start, end)
+        if columns is None:
+            columns = []
+            for part in parts:
+                for name in sorted(os.listdir(part)):
+                    if name.endswith(".npy") and name[:-4] not in columns:
+                        columns.append(name[:-4])
+
+        pieces = {}
+        for part in parts:
+            times = np.load(os.path.join(part, f"{TIME}.npy"), mmap_mode="r")
+            selected = np.ones(len(times), dtype=bool)
+            if start is not None:
+                selected &= times >= start
+            if end is not None:
+                selected &= times < end
+            if not selected.any():
+                continue
+            for name in columns:
+                path = os.path.join(part, f"{name}.npy")
+                if os.path.exists(path):
+                    values = np.load(path, mmap_mode="r")[selected]
+                else:
+                    values = np.full(int(selected.sum()), np.nan)
+                pieces.setdefault(name, []).append(values)
+        return {
+            name: np.concatenate(pieces[name]) if name in pieces else np.array([])
+            for name in columns
+        }
+
+    def read_frame(
+        self,
+        table: str,
+        columns: Optional[list] = None,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+    ) -> pd.DataFrame:
+        """Reads a table into a DataFrame indexed by UTC time
+
+        See read for the parameters. The time column is always read.
+        """
+        if columns is not None and TIME not in columns:
+            columns = [TIME] + list(columns)
+        data = self.read(table, columns, start, end)
+        if TIME not in data or len(data[TIME]) == 0:
+            return pd.DataFrame(columns=[c for c in (columns or []) if c != TIME])
+        frame = pd.DataFrame(data)
+        frame.index = pd.to_datetime(frame.pop(TIME), unit="s", utc=True)
+        return frame.sort_index(kind="stable")
@@ -0,0 +1,341 @@
+"""Metrics derived from batches of Netatmo readings
+
+Netatmo reports temperature, humidity, pressure, wind and rain. This stage
+takes a batch of readings, the handful of current ones or a backfill page of
+thousands, as a frame of time, device, sensor and value columns and derives
+more series from it with column operations rather than one reading at a time:
+
+- unit conversions, the pressure in inches of mercury, the wind in mph and
+  the rain in inches
+- the dew point and heat index of every device with temperature and humidity
+- the wind chill, from the outdoor temperature and the wind gauge
+- the pressure trend, the change in pressure over the last three hours
+
+Temperatures are expected in fahrenheit, as dashboard_metrics and backfill
+convert them.
+"""
+
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = ["time", "device", "sensor", "value"]
+
+# Sensor -> the converted sensor and the factor from Netatmo's units
+CONVERSIONS = {
+    "Pressure": ("Pressure_inHg", 1 / 33.8639),  # mbar
+    "WindStrength": ("WindStrength_mph", 1 / 1.609344),  # km/h
+    "GustStrength": ("GustStrength_mph", 1 / 1.609344),
+    "Rain": ("Rain_in", 1 / 25.4),  # mm
+    "sum_rain_24": ("sum_rain_24_in", 1 / 25.4),
+}
+
+# The pressure trend is the change over this many seconds
+TREND_SECONDS = 3 * 3600
+
+# Seconds apart two readings can be and still be paired, modules upload about
+# every 5 minutes but not at the same moment
+MATCH_TOLERANCE = 900
+
+
+def dew_point(temperature, humidity):
+    """Dew point using the Magnus formula, works on scalars or arrays
+
+    Parameters
+    ----------
+    temperature : array_like
+        Air temperature in celsius
+    humidity : array_like
+        Relative humidity in percent
+
+    Returns
+    -------
+    numpy.ndarray
+        The dew point in celsius
+    """
+    b, c = 17.62, 243.12
+    temperature = np.asarray(temperature, dtype=float)
+    humidity = np.asarray(humidity, dtype=float)
+    gamma = np.log(humidity / 100.0) + b * temperature / (c + temperature)
+    return c * gamma / (b - gamma)
+
+
+def heat_index(temperature, humidity):
+    """The National Weather Service heat index, works on scalars or arrays
+
+    Parameters
+    ----------
+    temperature : array_like
+        Air temperature in fahrenheit
+    humidity : array_like
+        Relative humidity in percent
+
+    Returns
+    -------
+    numpy.ndarray
+        The heat index in fahrenheit
+    """
+    t = np.asarray(temperature, dtype=float)
+    rh = np.asarray(humidity, dtype=float)
+    simple = 0.5 * (t + 61.0 + (t - 68.0) * 1.2 + rh * 0.094)
+    full = (
+        -42.379
+        + 2.04901523 * t
+        + 10.14333127 * rh
+        - 0.22475541 * t * rh
+        - 0.00683783 * t**2
+        - 0.05481717 * rh**2
+        + 0.00122874 * t**2 * rh
+        + 0.00085282 * t * rh**2
+        - 0.00000199 * t**2 * rh**2
+    )
+    dry = (rh < 13) & (t >= 80) & (t <= 112)
+    full = full - np.where(
+        dry, (13 - rh) / 4 * np.sqrt(np.clip((17 - np.abs(t - 95)) / 17, 0, None)), 0
+    )
+    humid = (rh > 85) & (t >= 80) & (t <= 87)
+    full = full + np.where(humid, (rh - 85) / 10 * (87 - t) / 5, 0)
+    return np.where((simple + t) / 2 >= 80, full, simple)
+
+
+def wind_chill(temperature, speed):
+    """The National Weather Service wind chill, works on scalars or arrays
+
+    Parameters
+    ----------
+    temperature : array_like
+        Air temperature in fahrenheit
+    speed : array_like
+        Wind speed in mph
+
+    Returns
+    -------
+    numpy.ndarray
+        The wind chill in fahrenheit, the temperature itself above 50F or
+        below 3 mph where the formula doesn't apply
+    """
+    t = np.asarray(temperature, dtype=float)
+    v = np.asarray(speed, dtype=float) ** 0.16
+    chill = 35.74 + 0.6215 * t - 35.75 * v + 0.4275 * t * v
+    return np.where((t <= 50) & (np.asarray(speed, dtype=float) >= 3), chill, t)
+
+
+def frame(readings: list, timestamp: float) -> pd.DataFrame:
+    """The numeric readings as a batch
+
+    Parameters
+    ----------
+    readings : list
+        Dicts with the device, sensor, measurement and optionally the time
+        they were taken, e.g. from netatmo.dashboard_metrics
+    timestamp : float
+        Epoch seconds for readings without their own time
+
+    Returns
+    -------
+    pandas.DataFrame
+        With the COLUMNS
+    """
+    rows = []
+    for reading in readings:
+        try:
+            value = float(reading["measurement"])
+        except (TypeError, ValueError):
+            continue
+        rows.append(
+            (
+                float(reading.get("time") or timestamp),
+                reading["device"],
+                reading["sensor"],
+                value,
+            )
+        )
+    return pd.DataFrame(rows, columns=COLUMNS).astype({"time": float, "value": float})
+
+
+def _series(index: pd.MultiIndex, sensor: str, values) -> pd.DataFrame:
+    """A derived series for a (device, time) index"""
+    return pd.DataFrame(
+        {
+            "time": index.get_level_values("time"),
+            "device": index.get_level_values("device"),
+            "sensor": sensor,
+            "value": values,
+        }
+    )
+
+
+def _pressure_trend(
+    batch: pd.DataFrame, history: Optional[pd.DataFrame]
+) -> Optional[pd.DataFrame]:
+    """The change in pressure since the last reading TREND_SECONDS or more
+    before each one, if it is within MATCH_TOLERANCE of that
+    """
+    pressure = batch[batch["sensor"] == "Pressure"]
+    if pressure.empty:
+        return None
+    past = pressure
+    if history is not None and not history.empty:
+        past = pd.concat([history[history["sensor"] == "Pressure"], pressure])
+    past = (
+        past[["time", "device", "value"]]
+        .rename(columns={"time": "then", "value": "before"})
+        .astype({"then": float})
+        .sort_values("then", kind="stable")
+    )
+    current = pressure.assign(then=pressure["time"] - TREND_SECONDS).sort_values(
+        "then", kind="stable"
+    )
+    matched = pd.merge_asof(
+        current,
+        past,
+        on="then",
+        by="device",
+        direction="backward",
+        tolerance=float(MATCH_TOLERANCE),
+    ).dropna(subset=["before"])
+    return matched.assign(
+        sensor="PressureTrend", value=matched["value"] - matched["before"]
+    )[COLUMNS]
+
+
+def derive(
+    batch: pd.DataFrame,
+    history: Optional[pd.DataFrame] = None,
+    outdoor: str = "Outdoor",
+) -> pd.DataFrame:
+    """Derives the extra series of a batch of readings
+
+    Parameters
+    ----------
+    batch : pandas.DataFrame
+        Readings with the COLUMNS, temperatures in fahrenheit
+    history : pandas.DataFrame, optional
+        Earlier readings with the COLUMNS, only used to look back for the
+        pressure trend
+    outdoor : str
+        The device whose temperature the wind chill is calculated from
+
+    Returns
+    -------
+    pandas.DataFrame
+        The derived readings with the COLUMNS, the sensor names the series
+    """
+    parts = []
+
+    converted = batch[batch["sensor"].isin(list(CONVERSIONS))]
+    if not converted.empty:
+        names = {sensor: name for sensor, (name, _) in CONVERSIONS.items()}
+        factors = {sensor: factor for sensor, (_, factor) in CONVERSIONS.items()}
+        parts.append(
+            converted.assign(
+                sensor=converted["sensor"].map(names),
+                value=converted["value"] * converted["sensor"].map(factors),
+            )
+        )
+
+    # Temperature and humidity of the same device taken at the same time
+    wide = batch.pivot_table(
+        index=["device", "time"], columns="sensor", values="value", aggfunc="last"
+    )
+    if {"Temperature", "Humidity"} <= set(wide.columns):
+        pairs = wide[["Temperature", "Humidity"]].dropna()
+        temperature = pairs["Temperature"].to_numpy()
+        humidity = pairs["Humidity"].to_numpy()
+        celsius = (temperature - 32) * 5 / 9
+        parts.append(
+            _series(pairs.index, "DewPoint", dew_point(celsius, humidity) * 9 / 5 + 32)
+        )
+        parts.append(
+            _series(pairs.index, "HeatIndex", heat_index(temperature, humidity))
+        )
+
+    # The wind gauge is its own module, pair it with the nearest outdoor reading
+    temperatures = batch[
+        (batch["device"] == outdoor) & (batch["sensor"] == "Temperature")
+    ].sort_values("time", kind="stable")
+    winds = batch[batch["sensor"] == "WindStrength"].sort_values("time", kind="stable")
+    if not temperatures.empty and not winds.empty:
+        matched = pd.merge_asof(
+            temperatures,
+            winds[["time", "value"]].rename(columns={"value": "wind"}),
+            on="time",
+            direction="nearest",
+            tolerance=float(MATCH_TOLERANCE),
+        ).dropna(subset=["wind"])
+        parts.append(
+            matched.assign(
+                sensor="WindChill",
+                value=wind_chill(
+                    matched["value"].to_numpy(), matched["wind"].to_numpy() / 1.609344
+                ),
+            )[COLUMNS]
+        )
+
+    parts.append(_pressure_trend(batch, history))
+
+    parts = [part[COLUMNS] for part in parts if part is not None and not part.empty]
+    if not parts:
+        return pd.DataFrame(columns=COLUMNS).astype({"time": float, "value": float})
+    derived = pd.concat(parts, ignore_index=True)
+    return derived[np.isfinite(derived["value"].to_numpy(dtype=float))]
+
+
+def derive_metrics(
+    metrics: list,
+    timestamp: float,
+    ring_buffers=None,
+    outdoor: str = "Outdoor",
+) -> list:
+    """Derived readings of a list of readings, in the same form
+
+    Parameters
+    ----------
+    metrics : list
+        Dicts with the device, sensor, measurement and time, e.g. from
+        netatmo.dashboard_metrics
+    timestamp : float
+        Epoch seconds for readings without their own time
+    ring_buffers : RingBufferStore, optional
+        Where the recent pressure is looked up for the trend, the batch of
+        current readings has no history of its own
+    outdoor : str
+        The device whose temperature the wind chill is calculated from
+
+    Returns
+    -------
+    list
+        A dict per derived reading with the device, sensor, measurement,
+        module, always None, and time
+    """
+    batch = frame(metrics, timestamp)
+    history = None
+    if ring_buffers is not None:
+        pieces = []
+        for device in batch.loc[batch["sensor"] == "Pressure", "device"].unique():
+            times, values = ring_buffers.buffer(device, "Pressure").window(
+                TREND_SECONDS + 2 * MATCH_TOLERANCE, timestamp
+            )
+            pieces.append(
+                pd.DataFrame(
+                    {
+                        "time": times,
+                        "device": device,
+                        "sensor": "Pressure",
+                        "value": values,
+                    }
+                )
+            )
+        history = pd.concat(pieces, ignore_index=True) if pieces else None
+    derived = derive(batch, history, outdoor)
+    return [
+        {
+            "device": device,
+            "sensor": sensor,
+            "measurement": float(value),
+            "module": None,
+            "time": float(taken),
+        }
+        for taken, device, sensor, value in derived.itertuples(index=False)
+    ]
@@ -0,0 +1,196 @@
+"""A local mirror of Indigo device states that is refreshed incrementally
+
+The mirror keeps each device's last known state with the version Indigo
+reported for it (``lastChanged``) and a revision number that increases every
+time a state changes. A run only re-reads the devices whose version differs
+from the mirrored one, or, when Indigo doesn't report versions, whose copy is
+older than ``max_age``. Collectors remember the revision they last saw and ask
+for the changes since then, so they only emit readings that changed.
+"""
+
+import time
+from typing import Any, Callable, Optional
+
+from home_automation import state
+
+
+class DeviceStateMirror:
+    """Last known state per device, persisted between runs
+
+    Parameters
+    ----------
+    path : str, optional
+        JSON file the mirror is kept in, None keeps it in memory only.
+    max_age : float
+        Seconds after which a device without a version is read again, 0
+        reads it on every sync.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_age: float = 0):
+        """Set up the mirror, the file is only read on first use"""
+        self.path = path
+        self.max_age = max_age
+        self._data = None
+
+    @property
+    def data(self) -> dict:
+        """The mirrored devices and the current revision"""
+        if self._data is None:
+            default = {"revision": 0, "devices": {}}
+            self._data = state.load_json(self.path, default) if self.path else default
+        return self._data
+
+    @property
+    def revision(self) -> int:
+        """The revision of the most recent change"""
+        return self.data["revision"]
+
+    def get(self, name: str) -> Any:
+        """The mirrored state of a device, None if it has never been read"""
+        entry = self.data["devices"].get(name)
+        return None if entry is None else entry["value"]
+
+    def needs_refresh(
+        self, name: str, version: Any = None, now: Optional[float] = None
+    ) -> bool:
+        """Decides if a device has to be read from Indigo again
+
+        Parameters
+        ----------
+        name : str
+            The device name
+        version : Any, optional
+            The version Indigo reports for it, e.g. its lastChanged time
+        now : float, optional
+            The current time, defaults to time.time()
+
+        Returns
+        -------
+        bool
+            True if the device is unknown, its version moved on, or, without
+            a version, its copy is older than max_age
+        """
+        entry = self.data["devices"].get(name)
+        if entry is None:
+            return True
+        if version is not None:
+            return version != entry["version"]
+        now = time.time() if now is None else now
+        return now - entry["checked"] >= self.max_age
+
+    def update(
+        self,
+        name: str,
+        value: Any,
+        version: Any = None,
+        now: Optional[float] = None,
+    ) -> bool:
+        """Records a state read from Indigo
+
+        Parameters
+        ----------
+        name : str
+            The device name
+        value : Any
+            Its state, anything JSON serializable
+        version : Any, optional
+            The version Indigo reports for it
+        now : float, optional
+            When it was read, defaults to time.time()
+
+        Returns
+        -------
+        bool
+            True if the state changed
+        """
+        now = time.time() if now is None else now
+        entry = self.data["devices"].get(name)
+        changed = entry is None or entry["value"] != value
+        revision = entry["revision"] if entry else 0
+        if changed:
+            self.data["revision"] += 1
+            revision = self.data["revision"]
+        self.data["devices"][name] = {
+            "value": value,
+            "version": version,
+            "checked": now,
+            "revision": revision,
+        }
+        return changed
+
+    def sync(
+        self,
+        listing: list,
+        fetch: Callable[[dict], Any],
+        now: Optional[float] = None,
+    ) -> int:
+        """Reads the devices that need it and saves the mirror
+
+        Parameters
+        ----------
+        listing : list
+            Device dicts with at least a name, and a lastChanged if Indigo
+            reports one
+        fetch : callable
+            Called with a device dict, returns its current state
+        now : float, optional
+            The current time, defaults to time.time()
+
+        Returns
+        -------
+        int
+            The number of devices read
+        """
+        read = 0
+        for device in listing:
+            version = device.get("lastChanged")
+            if self.needs_refresh(device["name"], version, now):
+                self.update(device["name"], fetch(device), version, now)
+                read += 1
+        self.save()
+        return read
+
+    def changes_since(self, revision: int) -> dict:
+        """The devices whose state changed after a revision
+
+        Parameters
+        ----------
+        revision : int
+            The revision the caller last saw, 0 for everything
+
+        Returns
+        -------
+        dict
+            Device name -> state
+        """
+        return {
+            name: entry["value"]
+            for name, entry in self.data["devices"].items()
+            if entry["revision"] > revision
+        }
+
+    def diff(self, consumer: str) -> dict:
+        """The changes a consumer hasn't seen yet, marking them as seen
+
+        The consumer's position is persisted with the mirror, so the next run
+        of the same collector carries on where this one stopped.
+
+        Parameters
+        ----------
+        consumer : str
+            Name of the collector asking
+
+        Returns
+        -------
+        dict
+            Device name -> state, for devices that changed since the last diff
+        """
+        cursors = self.data.setdefault("cursors", {})
+        changes = self.changes_since(cursors.get(consumer, 0))
+        cursors[consumer] = self.revision
+        return changes
+
+    def save(self):
+        """Persists the mirror"""
+        if self.path:
+            state.save_json(self.path, self.data)
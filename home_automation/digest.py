@@ -0,0 +1,371 @@
+"""A weekly digest of the multipliers, the rain and every sensor
+
+The digest is built from the local columnar store (see
+:mod:`home_automation.columnar`) instead of the metrics server. Each local day
+is rolled up once into the min, max, sum and count of every device and sensor,
+the rain that was forecast and fell, and the multipliers calculated. Rollups
+of finished days are cached under ``state_dir`` keyed by the time range they
+cover, so generating a digest again, or one for an overlapping week, only
+reads the days it hasn't rolled up yet. Combining the daily rollups is a
+groupby over a few rows per device, so the email takes seconds however many
+devices are logged.
+"""
+
+import os
+import time
+from email.message import EmailMessage
+from typing import Optional
+
+import markdown
+import pandas as pd
+import requests
+from tabulate import tabulate
+
+from home_automation import profiling, state, utilities
+from home_automation.columnar import ColumnStore
+from home_automation.forecast_accuracy import MM_PER_INCH
+
+# The tables with device, sensor and value columns, summarised per device
+SENSOR_TABLES = ("netatmo", "netatmo_accounts", "indigo")
+
+# Seconds after a day ends before its rollup is cached, late uploads may
+# still be archived until then
+SETTLE_SECONDS = 3600
+
+# Days a rollup is kept in the cache
+CACHE_DAYS = 90
+
+SENSOR_COLUMNS = ["table", "device", "sensor", "min", "max", "sum", "count"]
+
+
+def _number(value) -> Optional[float]:
+    """A float for the JSON cache, None for a missing value"""
+    return None if value is None or pd.isna(value) else float(value)
+
+
+class RollupCache:
+    """Daily rollups, keyed by the time range they cover
+
+    Parameters
+    ----------
+    path : str, optional
+        JSON file the rollups are kept in, None keeps them in memory only.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """Set up the cache, the file is only read on first use"""
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entry = None
+
+    @classmethod
+    def from_settings(cls, settings: utilities.Settings) -> "RollupCache":
+        """The cache configured by Settings, kept under state_dir"""
+        return cls(os.path.join(settings.state_dir, "digest_rollups.json"))
+
+    @property
+    def entry(self) -> dict:
+        """The cached rollups, by time range"""
+        if self._entry is None:
+            default = {"rollups": {}}
+            self._entry = state.load_json(self.path, default) if self.path else default
+        return self._entry
+
+    @staticmethod
+    def key(start: float, end: float) -> str:
+        """The key of a time range"""
+        return f"{int(start)}-{int(end)}"
+
+    def get(self, start: float, end: float) -> Optional[dict]:
+        """The rollup of a time range, None if it isn't cached"""
+        rollup = self.entry["rollups"].get(self.key(start, end))
+        if rollup is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return rollup
+
+    def put(self, start: float, end: float, rollup: dict):
+        """Caches the rollup of a time range"""
+        self.entry["rollups"][self.key(start, end)] = rollup
+
+    def save(self, now: Optional[float] = None):
+        """Drops the rollups older than CACHE_DAYS and persists the rest"""
+        oldest = (time.time() if now is None else now) - CACHE_DAYS * 86400
+        rollups = self.entry["rollups"]
+        for key in [key for key, rollup in rollups.items() if rollup["end"] < oldest]:
+            del rollups[key]
+        if self.path:
+            state.save_json(self.path, self.entry)
+
+
+def daily_rollup(store: ColumnStore, start: float, end: float) -> dict:
+    """Rolls up everything archived in a time range, usually a day
+
+    Parameters
+    ----------
+    store : ColumnStore
+        Where the readings, forecasts and multipliers are archived
+    start : float
+        Epoch seconds, inclusive
+    end : float
+        Epoch seconds, exclusive
+
+    Returns
+    -------
+    dict
+        The range, a row of SENSOR_COLUMNS per table, device and sensor, the
+        observed rain and the rain forecast before the range began in inches,
+        and the last multiplier with the number of runs
+    """
+    sensors = []
+    observed_rain = None
+    for table in SENSOR_TABLES:
+        readings = store.read_frame(table, ["device", "sensor", "value"], start, end)
+        if readings.empty:
+            continue
+        stats = (
+            readings.dropna(subset=["value"])
+            .groupby(["device", "sensor"])["value"]
+            .agg(["min", "max", "sum", "count"])
+        )
+        sensors.extend(
+            [table, device, sensor, float(low), float(high), float(total), int(count)]
+            for (device, sensor), low, high, total, count in stats.itertuples()
+        )
+        if table == "netatmo":
+            # sum_rain_24 only grows during the day, its maximum is the day's rain
+            rain = readings.loc[readings["sensor"] == "sum_rain_24", "value"]
+            observed_rain = _number(rain.max() / MM_PER_INCH)
+
+    forecasts = store.read_frame(
+        "forecast_daily", ["issued", "rainAccumulation"], start, end
+    )
+    ahead = forecasts[forecasts["issued"] < start] if not forecasts.empty else forecasts
+    forecast_rain = None
+    if not ahead.empty:
+        latest = ahead.sort_values("issued", kind="stable").iloc[-1]
+        forecast_rain = _number(latest["rainAccumulation"])
+
+    runs = store.read_frame("sprinkler", ["multiplier"], start, end)
+    return {
+        "start": start,
+        "end": end,
+        "sensors": sensors,
+        "observed_rain": observed_rain,
+        "forecast_rain": forecast_rain,
+        "multiplier": _number(runs["multiplier"].iloc[-1]) if len(runs) else None,
+        "runs": len(runs),
+    }
+
+
+def day_ranges(end: float, days: int = 7, timezone: str = "America/Denver") -> list:
+    """The local days before the one an epoch time falls on
+
+    Parameters
+    ----------
+    end : float
+        Epoch seconds, the day it falls on is not included
+    days : int
+        Number of days
+    timezone : str
+        Days run from midnight to midnight here
+
+    Returns
+    -------
+    list
+        (start, end) epoch seconds of each day, oldest first
+    """
+    midnight = pd.Timestamp(end, unit="s", tz="UTC").tz_convert(timezone).normalize()
+    bounds = [midnight - pd.DateOffset(days=n) for n in range(days, -1, -1)]
+    return [(a.timestamp(), b.timestamp()) for a, b in zip(bounds, bounds[1:])]
+
+
+def rollups(
+    store: ColumnStore,
+    cache: RollupCache,
+    ranges: list,
+    now: Optional[float] = None,
+) -> list:
+    """The rollup of each time range, from the cache where possible
+
+    Parameters
+    ----------
+    store : ColumnStore
+        Where the history is archived
+    cache : RollupCache
+        Rollups of finished ranges are kept here
+    ranges : list
+        (start, end) epoch seconds
+    now : float, optional
+        The current time, defaults to time.time()
+
+    Returns
+    -------
+    list
+        A rollup per range, see daily_rollup
+    """
+    now = time.time() if now is None else now
+    results = []
+    for start, end in ranges:
+        rollup = cache.get(start, end)
+        if rollup is None:
+            rollup = daily_rollup(store, start, end)
+            if end + SETTLE_SECONDS <= now:
+                cache.put(start, end, rollup)
+        results.append(rollup)
+    return results
+
+
+def weekly_digest(
+    store: ColumnStore,
+    cache: Optional[RollupCache] = None,
+    end: Optional[float] = None,
+    days: int = 7,
+    timezone: str = "America/Denver",
+) -> dict:
+    """Summarises the days before end
+
+    Parameters
+    ----------
+    store : ColumnStore
+        Where the history is archived
+    cache : RollupCache, optional
+        Daily rollups already computed, without one every day is read
+    end : float, optional
+        Epoch seconds, the digest covers the days before the one it falls
+        on, defaults to now
+    days : int
+        Number of days
+    timezone : str
+        Days run from midnight to midnight here
+
+    Returns
+    -------
+    dict
+        "days", a DataFrame of the multiplier and the forecast and observed
+        rain per day, and "sensors", a DataFrame of the min, max and mean of
+        every table, device and sensor over all the days
+    """
+    now = time.time()
+    end = now if end is None else end
+    daily = rollups(store, cache or RollupCache(), day_ranges(end, days, timezone), now)
+
+    days_frame = pd.DataFrame(
+        {
+            "multiplier": [rollup["multiplier"] for rollup in daily],
+            "runs": [rollup["runs"] for rollup in daily],
+            "forecast_rain": [rollup["forecast_rain"] for rollup in daily],
+            "observed_rain": [rollup["observed_rain"] for rollup in daily],
+        },
+        index=pd.Index(
+            [
+                pd.Timestamp(rollup["start"], unit="s", tz="UTC")
+                .tz_convert(timezone)
+                .date()
+                for rollup in daily
+            ],
+            name="day",
+        ),
+        dtype=float,
+    )
+
+    rows = pd.DataFrame(
+        [row for rollup in daily for row in rollup["sensors"]], columns=SENSOR_COLUMNS
+    )
+    sensors = rows.groupby(["table", "device", "sensor"]).agg(
+        min=("min", "min"),
+        max=("max", "max"),
+        sum=("sum", "sum"),
+        count=("count", "sum"),
+    )
+    sensors["mean"] = sensors.pop("sum") / sensors["count"]
+    return {"days": days_frame, "sensors": sensors[["min", "max", "mean", "count"]]}
+
+
+def text_report(digest: dict) -> str:
+    """The digest as plain text tables"""
+    days = tabulate(digest["days"], headers="keys", floatfmt=".2f")
+    sensors = tabulate(
+        digest["sensors"].reset_index(), headers="keys", floatfmt=".2f", showindex=False
+    )
+    return f"{days}\n\n{sensors}"
+
+
+def get_email_message(digest: dict, settings: utilities.Settings) -> EmailMessage:
+    """Returns an email message with the digest
+
+    Parameters
+    ----------
+    digest : dict
+        From weekly_digest
+    settings : Settings
+        Who the email is from and to
+
+    Returns
+    -------
+    EmailMessage
+        A python email message object ready to send
+    """
+    days = digest["days"]
+    first, last = (days.index[0], days.index[-1]) if len(days) else ("", "")
+    markdown_text = "\n\n".join(
+        [
+            f"## Weekly digest, {first} to {last}",
+            "### Multiplier and rain (inches)",
+            days.to_markdown(floatfmt=".2f"),
+            "### Sensors",
+            digest["sensors"].reset_index().to_markdown(index=False, floatfmt=".2f"),
+        ]
+    )
+    markdown_html = markdown.markdown(markdown_text, extensions=["tables"])
+
+    msg = EmailMessage()
+    msg["Subject"] = f"Weekly digest {first} to {last}"
+    msg["From"] = settings.email_from
+    msg["To"] = settings.email_to
+    msg.set_content(text_report(digest))
+    msg.add_alternative(
+        utilities.make_pretty_html(markdown_html.strip()), subtype="html"
+    )
+    return msg
+
+
+def run(
+    settings: Optional[utilities.Settings] = None,
+    session: Optional[requests.Session] = None,
+    days: int = 7,
+    send: bool = True,
+) -> dict:
+    """Builds the digest of the last days and emails it
+
+    Parameters
+    ----------
+    settings : Settings, optional
+        Defaults to utilities.SETTINGS
+    session : requests.Session, optional
+        Unused, the history is local. Accepted so the job can be run with
+        the others
+    days : int
+        Number of days
+    send : bool
+        Email the digest, otherwise it is only printed
+
+    Returns
+    -------
+    dict
+        From weekly_digest
+    """
+    settings = settings or utilities.SETTINGS
+    cache = RollupCache.from_settings(settings)
+    with profiling.phase("compute"):
+        digest = weekly_digest(ColumnStore.from_settings(settings), cache, days=days)
+    print(text_report(digest))
+    print(f"{cache.hits} daily rollups cached, {cache.misses} computed")
+
+    with profiling.phase("write"):
+        cache.save()
+        if send:
+            utilities.send_email(get_email_message(digest, settings))
+    return digest
@@ -0,0 +1,177 @@
+"""Serves the latest readings for scrapers to pull, in the Prometheus format
+
+The jobs record their latest readings in :data:`REGISTRY`, the Indigo
+devices, the Netatmo sensors, the sprinkler multiplier and how long each job
+took. An optional HTTP endpoint serves them as text exposition format::
+
+    # TYPE netatmo_temperature gauge
+    netatmo_temperature{device="Outdoor"} 71.6
+
+so a scraper can pull at its own cadence. Recording a reading only touches
+memory, and the page is rendered once per change rather than per scrape.
+"""
+
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_INVALID_NAME = re.compile(r"[^a-zA-Z0-9_:]")
+
+
+def metric_name(name: str) -> str:
+    """Turns a reading's name into a valid metric name, e.g. sum_rain_24"""
+    name = _INVALID_NAME.sub("_", name).lower()
+    return f"_{name}" if name[:1].isdigit() else name
+
+
+def _escape(value: str) -> str:
+    """Escapes a label value"""
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _key(labels: Optional[dict]) -> tuple:
+    """The labels of a sample in a hashable, sorted form"""
+    return tuple(sorted((metric_name(k), str(v)) for k, v in (labels or {}).items()))
+
+
+class GaugeRegistry:
+    """The latest value of every gauge, safe to update from several threads"""
+
+    def __init__(self):
+        """Set up an empty registry"""
+        self._lock = threading.Lock()
+        self._gauges = {}  # name -> {"help": str, "samples": {labels: value}}
+        self._version = 0
+        self._rendered = (None, b"")
+
+    @property
+    def version(self) -> int:
+        """Counts the changes, so readers can tell if anything moved"""
+        return self._version
+
+    def set(
+        self,
+        name: str,
+        value,
+        labels: Optional[dict] = None,
+        help_text: Optional[str] = None,
+    ) -> bool:
+        """Records the latest value of a gauge
+
+        Parameters
+        ----------
+        name : str
+            The gauge, made into a valid metric name
+        value : Any
+            The reading, anything float() accepts
+        labels : dict, optional
+            Label name -> value, e.g. {"device": "Outdoor"}
+        help_text : str, optional
+            What the gauge measures
+
+        Returns
+        -------
+        bool
+            True if the value changed, False if it is unchanged or not a number
+        """
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return False
+        name = metric_name(name)
+        key = _key(labels)
+        with self._lock:
+            gauge = self._gauges.setdefault(name, {"help": None, "samples": {}})
+            if help_text is not None and gauge["help"] != help_text:
+                gauge["help"] = help_text
+            elif gauge["samples"].get(key) == value:
+                return False
+            gauge["samples"][key] = value
+            self._version += 1
+        return True
+
+    def get(self, name: str, labels: Optional[dict] = None) -> Optional[float]:
+        """The latest value of a gauge, None if it was never set"""
+        key = _key(labels)
+        with self._lock:
+            gauge = self._gauges.get(metric_name(name))
+            return gauge["samples"].get(key) if gauge else None
+
+    def render(self) -> bytes:
+        """The gauges in text exposition format, cached until the next change"""
+        with self._lock:
+            version, text = self._rendered
+            if version == self._version:
+                return text
+            lines = []
+            for name in sorted(self._gauges):
+                gauge = self._gauges[name]
+                if gauge["help"]:
+                    lines.append(f"# HELP {name} {gauge['help']}")
+                lines.append(f"# TYPE {name} gauge")
+                for labels, value in sorted(gauge["samples"].items()):
+                    label_set = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+                    sample = f"{name}{{{label_set}}}" if label_set else name
+                    lines.append(f"{sample} {value!r}")
+            text = ("\n".join(lines) + "\n").encode("utf-8") if lines else b""
+            self._rendered = (self._version, text)
+            return text
+
+
+# The registry the jobs record their readings in
+REGISTRY = GaugeRegistry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Answers GET /metrics with the rendered registry"""
+
+    registry = REGISTRY
+
+    def do_GET(self):
+        """Serves the gauges, everything but /metrics is not found"""
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Scrapes are too frequent to log"""
+
+
+def start_server(
+    port: int, host: str = "", registry: Optional[GaugeRegistry] = None
+) -> ThreadingHTTPServer:
+    """Serves a registry on a background thread
+
+    Parameters
+    ----------
+    port : int
+        Port to listen on, 0 picks a free one
+    host : str
+        Address to listen on, "" for all of them
+    registry : GaugeRegistry, optional
+        Defaults to REGISTRY
+
+    Returns
+    -------
+    ThreadingHTTPServer
+        The running server, shutdown() stops it
+    """
+    handler = type(
+        "MetricsHandler", (_MetricsHandler,), {"registry": registry or REGISTRY}
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, name="exposition", daemon=True
+    ).start()
+    print(f"Serving metrics on port {server.server_address[1]}")
+    return server
@@ -0,0 +1,181 @@
+"""How good are the Tomorrow.io forecasts the sprinkler multiplier relies on?
+
+Every daily forecast is archived with the time it was issued (see
+:mod:`home_automation.columnar`), and so is every Netatmo reading. This module
+rolls the readings up into observed days, matches each forecast to the day it
+was for with a sorted as-of join, and reports the bias and error of the rain
+and temperature forecasts for each lead time. Everything is done with pandas
+column operations, so years of readings join in seconds.
+"""
+
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from home_automation.columnar import ColumnStore
+
+MM_PER_INCH = 25.4
+
+
+def observed_daily(
+    store: ColumnStore,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    device: str = "Outdoor",
+    timezone: str = "America/Denver",
+) -> pd.DataFrame:
+    """Rolls the archived Netatmo readings up into local days
+
+    Parameters
+    ----------
+    store : ColumnStore
+        Where the netatmo table is kept
+    start : float, optional
+        Epoch seconds, inclusive
+    end : float, optional
+        Epoch seconds, exclusive
+    device : str
+        The module whose temperature is the outside temperature
+    timezone : str
+        Days run from midnight to midnight here
+
+    Returns
+    -------
+    pandas.DataFrame
+        Indexed by the UTC start of each local day, with the observed rain in
+        inches and the highest temperature in fahrenheit
+    """
+    readings = store.read_frame("netatmo", ["device", "sensor", "value"], start, end)
+    columns = ["observed_rain", "observed_temperature"]
+    if readings.empty:
+        return pd.DataFrame(columns=columns, index=pd.DatetimeIndex([], tz="UTC"))
+    readings.index = readings.index.tz_convert(timezone)
+
+    # sum_rain_24 only grows during the day, its maximum is the day's rain
+    rain = readings.loc[readings["sensor"] == "sum_rain_24", "value"]
+    temperature = readings.loc[
+        (readings["sensor"] == "Temperature") & (readings["device"] == device),
+        "value",
+    ]
+    daily = pd.concat(
+        [
+            rain.resample("1D").max() / MM_PER_INCH,
+            temperature.resample("1D").max(),
+        ],
+        axis=1,
+        keys=columns,
+    )
+    daily.index = daily.index.tz_convert("UTC")
+    return daily.dropna(how="all")
+
+
+def match_forecasts(forecasts: pd.DataFrame, observed: pd.DataFrame) -> pd.DataFrame:
+    """Matches each forecast with the day it was for
+
+    Parameters
+    ----------
+    forecasts : pandas.DataFrame
+        Archived daily forecasts indexed by the time they are for, with the
+        issued, rainAccumulation and temperature columns
+    observed : pandas.DataFrame
+        From observed_daily
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per forecast with an observed day, with its lead time in
+        whole days and the forecast and observed values
+    """
+    left = forecasts.rename(
+        columns={
+            "rainAccumulation": "forecast_rain",
+            "temperature": "forecast_temperature",
+        }
+    )
+    left = left.rename_axis("time").reset_index().sort_values("time", kind="stable")
+    right = observed.rename_axis("day").reset_index().sort_values("day")
+    left["time"] = left["time"].astype(right["day"].dtype)
+
+    # A forecast day starts some hours after the local midnight it belongs to
+    matched = pd.merge_asof(
+        left,
+        right,
+        left_on="time",
+        right_on="day",
+        direction="backward",
+        tolerance=pd.Timedelta(days=1),
+    )
+    issued = pd.to_datetime(matched["issued"], unit="s", utc=True)
+    matched["lead_days"] = np.floor((matched["time"] - issued) / pd.Timedelta(days=1))
+    return matched.dropna(subset=["day"]).astype({"lead_days": int})
+
+
+def accuracy(matched: pd.DataFrame) -> pd.DataFrame:
+    """Bias and error of the forecasts per lead time
+
+    Parameters
+    ----------
+    matched : pandas.DataFrame
+        From match_forecasts
+
+    Returns
+    -------
+    pandas.DataFrame
+        Indexed by lead time in days, with the count, bias (forecast minus
+        observed), mean absolute error and root mean square error for rain
+        and temperature
+    """
+    errors = {
+        "rain": matched["forecast_rain"] - matched["observed_rain"],
+        "temperature": matched["forecast_temperature"]
+        - matched["observed_temperature"],
+    }
+    summaries = []
+    for quantity, error in errors.items():
+        error = error.astype(float)
+        summary = (
+            pd.DataFrame(
+                {"count": error, "bias": error, "mae": error.abs(), "rmse": error**2}
+            )
+            .groupby(matched["lead_days"])
+            .agg({"count": "count", "bias": "mean", "mae": "mean", "rmse": "mean"})
+        )
+        summary["rmse"] = np.sqrt(summary["rmse"])
+        summaries.append(summary.add_prefix(f"{quantity}_"))
+    return pd.concat(summaries, axis=1).rename_axis("lead_days")
+
+
+def report(
+    store: ColumnStore,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    device: str = "Outdoor",
+    timezone: str = "America/Denver",
+) -> pd.DataFrame:
+    """The forecast accuracy per lead time over a period
+
+    See observed_daily for the parameters.
+
+    Returns
+    -------
+    pandas.DataFrame
+        From accuracy, empty if nothing could be matched
+    """
+    forecasts = store.read_frame(
+        "forecast_daily", ["issued", "rainAccumulation", "temperature"], start, end
+    )
+    observed = observed_daily(store, start, end, device, timezone)
+    if forecasts.empty or observed.empty:
+        return accuracy(
+            pd.DataFrame(
+                columns=[
+                    "lead_days",
+                    "forecast_rain",
+                    "observed_rain",
+                    "forecast_temperature",
+                    "observed_temperature",
+                ]
+            )
+        )
+    return accuracy(match_forecasts(forecasts, observed))
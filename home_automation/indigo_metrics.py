@@ -0,0 +1,373 @@
+"""Logs Indigo sensor readings into the time series database"""
+
+import hashlib
+import json
+import os
+import time
+from typing import Optional
+
+import requests
+from requests.auth import HTTPDigestAuth
+
+from home_automation import (
+    columnar,
+    resilience,
+    state,
+    utilities,
+)
+from home_automation.device_mirror import DeviceStateMirror
+from home_automation.streaming_json import iter_items
+
+# The Indigo devices we log, and the metric and device they are logged as
+INDIGO_DEVICES = [
+    {"name": "Computer Room Humidity", "metric": "humidity", "device": "computer_room"},
+    {
+        "name": "Computer Room Luminance",
+        "metric": "luminance",
+        "device": "computer_room",
+    },
+    {"name": "Computer Room Temperature", "metric": "temp", "device": "computer_room"},
+    {
+        "name": "Computer Room Ultraviolet",
+        "metric": "ultraviolet",
+        "device": "computer_room",
+    },
+    {
+        "name": "Upstairs Hallway Humidity",
+        "metric": "humidity",
+        "device": "upstairs_hallway",
+    },
+    {
+        "name": "Upstairs Hallway Luminance",
+        "metric": "luminance",
+        "device": "upstairs_hallway",
+    },
+    {
+        "name": "Upstairs Hallway Temperature",
+        "metric": "temp",
+        "device": "upstairs_hallway",
+    },
+]
+
+
+# The parts of each device in devices.json that we use
+DEVICE_FIELDS = ["name", "restURL", "lastChanged"]
+
+
+class DeviceListCache:
+    """The Indigo device list and a name to restURL index, cached on disk
+
+    Within the TTL the cache is used without asking Indigo at all. After that
+    the list is revalidated with If-None-Match / If-Modified-Since, so an
+    unchanged inventory costs a 304 instead of the whole listing. When the
+    server sends neither an ETag nor a Last-Modified header the full list is
+    fetched again, and its content hash decides whether anything changed.
+
+    The lastChanged versions in the list are only current if Indigo was asked
+    for it in this run, see versions.
+
+    Parameters
+    ----------
+    path : str, optional
+        JSON file the cache is kept in, None keeps it in memory only.
+    ttl : float
+        Seconds the cached list is trusted without revalidating it.
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl: float = 3600):
+        """Set up the cache, the file is only read on first use"""
+        self.path = path
+        self.ttl = ttl
+        self.revalidated = False  # Indigo was asked for the list by this instance
+        self._entry = None
+
+    @classmethod
+    def from_settings(cls, settings: utilities.Settings) -> "DeviceListCache":
+        """The cache configured by Settings, kept under state_dir"""
+        return cls(
+            os.path.join(settings.state_dir, "indigo_devices.json"),
+            settings.indigo_devices_ttl,
+        )
+
+    @property
+    def entry(self) -> dict:
+        """The cached list, its validators and index, empty if never fetched"""
+        if self._entry is None:
+            self._entry = state.load_json(self.path, {}) if self.path else {}
+        return self._entry
+
+    def is_fresh(self, now: Optional[float] = None) -> bool:
+        """True if the cached list is within its TTL"""
+        now = time.time() if now is None else now
+        return "devices" in self.entry and now - self.entry["fetched"] < self.ttl
+
+    def store(self, devices: list, etag=None, last_modified=None, now=None) -> bool:
+        """Caches a freshly downloaded list
+
+        Parameters
+        ----------
+        devices : list
+            The decoded devices.json
+        etag : str, optional
+            The ETag header of the response
+        last_modified : str, optional
+            The Last-Modified header of the response
+        now : float, optional
+            When it was fetched, defaults to time.time()
+
+        Returns
+        -------
+        bool
+            True if the list differs from the cached one
+        """
+        digest = hashlib.sha256(
+            json.dumps(devices, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        changed = digest != self.entry.get("hash")
+        self._entry = {
+            "devices": devices,
+            "index": (
+                {d["name"]: d["restURL"] for d in devices}
+                if changed
+                else self.entry["index"]
+            ),
+            "hash": digest,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched": time.time() if now is None else now,
+        }
+        self.revalidated = True
+        self.save()
+        return changed
+
+    def touch(self, now: Optional[float] = None):
+        """Marks the cached list as revalidated"""
+        self.entry["fetched"] = time.time() if now is None else now
+        self.revalidated = True
+        self.save()
+
+    def versions(self) -> dict:
+        """Device name -> lastChanged, empty unless the list was revalidated
+
+        A list served from the cache within its TTL can be an hour old, so its
+        versions would hide every change since. Without versions the device
+        state mirror falls back to its max_age.
+        """
+        if not self.revalidated:
+            return {}
+        return {d["name"]: d.get("lastChanged") for d in self.entry.get("devices", [])}
+
+    def save(self):
+        """Persists the cache"""
+        if self.path:
+            state.save_json(self.path, self.entry)
+
+
+def _rest_url(settings: utilities.Settings, path: str) -> str:
+    """The URL of a REST API path, e.g. a device's restURL, on the Indigo server"""
+    return str(settings.indigo_url).rstrip("/") + "/" + path.lstrip("/")
+
+
+def _rest_auth(settings: utilities.Settings, headers: Optional[dict] = None) -> dict:
+    """The headers and auth of a REST API request
+
+    Digest authentication with the Indigo user when one is set, the API key
+    otherwise.
+    """
+    headers = dict(headers or {})
+    if settings.indigo_username:
+        password = settings.indigo_password
+        auth = HTTPDigestAuth(
+            settings.indigo_username, password.get_secret_value() if password else ""
+        )
+        return {"headers": headers, "auth": auth}
+    api_key = settings.indigo_api_key.get_secret_value()
+    headers["Authorization"] = f"Bearer {api_key}"
+    return {"headers": headers}
+
+
+def getIndigoDevices(
+    settings: utilities.Settings,
+    session=None,
+    cache: Optional[DeviceListCache] = None,
+    refresh: bool = False,
+):
+    """
+    Get the list of indigo devices
+
+    Parameters
+    ----------
+    settings : Settings
+        Where the Indigo URL and credentials come from
+    session : requests.Session, optional
+        Session to send the request on
+    cache : DeviceListCache, optional
+        Cache to serve and revalidate the list from
+    refresh : bool
+        Revalidate the list even if the cache is within its TTL
+
+    Returns
+    -------
+    json
+        All of the indigo devices, reduced to DEVICE_FIELDS
+    """
+    if cache is not None and not refresh and cache.is_fresh():
+        return cache.entry["devices"]
+
+    headers = {}
+    if cache is not None and "devices" in cache.entry:
+        if cache.entry.get("etag"):
+            headers["If-None-Match"] = cache.entry["etag"]
+        if cache.entry.get("last_modified"):
+            headers["If-Modified-Since"] = cache.entry["last_modified"]
+
+    url = _rest_url(settings, "devices.json")
+    r = resilience.call(
+        "indigo",
+        (session or requests).get,
+        url,
+        stream=True,
+        **_rest_auth(settings, headers),
+    )
+    if r.status_code == 304 and headers:
+        print("Indigo device list unchanged")
+        cache.touch()
+        return cache.entry["devices"]
+    utilities.checkResponse(r)
+    devices = list(iter_items(r, fields=DEVICE_FIELDS))
+    if cache is not None:
+        cache.store(devices, r.headers.get("ETag"), r.headers.get("Last-Modified"))
+    return devices
+
+
+def device_urls(
+    names: list,
+    settings: utilities.Settings,
+    session=None,
+    cache: Optional[DeviceListCache] = None,
+) -> dict:
+    """Looks up the restURL of each named device
+
+    On a warm cache no listing is downloaded at all. A name missing from the
+    index, e.g. a device that was just added, revalidates the list once.
+
+    Parameters
+    ----------
+    names : list
+        Names of the Indigo devices
+    settings : Settings
+        Where the Indigo URL and credentials come from
+    session : requests.Session, optional
+        Session to send the request on
+    cache : DeviceListCache, optional
+        Where the index is kept, without one the list is always downloaded
+
+    Returns
+    -------
+    dict
+        Device name -> restURL, for the names Indigo knows
+    """
+    if cache is None:
+        devices = getIndigoDevices(settings, session)
+        index = {device["name"]: device["restURL"] for device in devices}
+    else:
+        getIndigoDevices(settings, session, cache)
+        index = cache.entry["index"]
+        if any(name not in index for name in names):
+            getIndigoDevices(settings, session, cache, refresh=True)
+            index = cache.entry["index"]
+    return {name: index[name] for name in names if name in index}
+
+
+def getIndigoDevice(uri, settings: utilities.Settings, session=None):
+    """
+    Get details for the passed indigo device
+
+    Parameters
+    ----------
+    uri : str
+        the restURL of the device, from the device list
+    settings : Settings
+        Where the Indigo URL and credentials come from
+    session : requests.Session, optional
+        Session to send the request on
+
+    Returns
+    -------
+    json
+        a json object with the details for the device
+    """
+    url = _rest_url(settings, uri)
+    r = resilience.call(
+        "indigo", (session or requests).get, url, **_rest_auth(settings)
+    )
+    utilities.checkResponse(r)
+    return r.json()
+
+
+def archive_readings(
+    readings: list, timestamp: float, settings: Optional[utilities.Settings] = None
+):
+    """Appends the numeric device readings to the indigo table of the columnar store
+
+    Parameters
+    ----------
+    readings : list
+        Dicts with the device, sensor and measurement
+    timestamp : float
+        Epoch seconds they were read
+    settings : Settings, optional
+        Defaults to utilities.SETTINGS
+    """
+    rows = []
+    for reading in readings:
+        try:
+            rows.append(
+                (reading["device"], reading["sensor"], float(reading["measurement"]))
+            )
+        except (TypeError, ValueError):
+            continue  # e.g. a device that was never read
+    if not rows:
+        return
+    devices, sensors, values = zip(*rows)
+    try:
+        columnar.ColumnStore.from_settings(settings or utilities.SETTINGS).append(
+            "indigo",
+            {
+                columnar.TIME: [timestamp] * len(rows),
+                "device": devices,
+                "sensor": sensors,
+                "value": values,
+            },
+        )
+    except OSError as error:
+        print(f"Unable to archive the Indigo readings: {error}")
+
+
+def mirror_from_settings(settings: utilities.Settings) -> DeviceStateMirror:
+    """The device state mirror configured by Settings, kept under state_dir"""
+    return DeviceStateMirror(
+        os.path.join(settings.state_dir, "indigo_states.json"),
+        settings.indigo_state_max_age,
+    )
+
+
+def run(
+    settings: Optional[utilities.Settings] = None,
+    session: Optional[requests.Session] = None,
+):
+    """Reads the logged devices from Indigo and sends them to the metrics server
+
+    Runs the default :class:`home_automation.collectors.IndigoCollector`, so
+    this is the same pipeline the collectors job runs.
+
+    Parameters
+    ----------
+    settings : Settings, optional
+        Defaults to utilities.SETTINGS
+    session : requests.Session, optional
+        Session to send the requests on, so jobs can share connection pools
+    """
+    from home_automation import collectors  # It builds on this module
+
+    collectors.run_collectors([collectors.IndigoCollector()], settings, session)
@@ -0,0 +1,109 @@
+"""Resolves Indigo variable names to the object ids the v2 API expects"""
+
+import time
+from typing import Callable, Optional, Union
+
+from home_automation import state
+
+
+class VariableResolver:
+    """A name to id index of the Indigo variables, cached on disk
+
+    The variable list is fetched once and the index kept for ``ttl`` seconds,
+    so resolving a name is a dict lookup. A name that isn't in the index, e.g.
+    a variable created since, refreshes it once before giving up. Names that
+    are still missing are remembered until the next refresh, so a typo
+    doesn't cost a fetch on every write.
+
+    Parameters
+    ----------
+    fetch : callable
+        Returns the Indigo variables, dicts with at least an id and a name.
+    path : str, optional
+        JSON file the index is kept in, None keeps it in memory only.
+    ttl : float
+        Seconds the index is trusted before it is fetched again.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[], list],
+        path: Optional[str] = None,
+        ttl: float = 86400,
+    ):
+        """Set up the resolver, the file is only read on first use"""
+        self.fetch = fetch
+        self.path = path
+        self.ttl = ttl
+        self._cache = None
+
+    @property
+    def cache(self) -> dict:
+        """The index and when it was fetched"""
+        if self._cache is None:
+            default = {"fetched": 0, "index": {}}
+            self._cache = state.load_json(self.path, default) if self.path else default
+        return self._cache
+
+    def refresh(self, now: Optional[float] = None) -> bool:
+        """Fetches the variable list and rebuilds the index
+
+        Returns
+        -------
+        bool
+            False if the list could not be fetched, the old index is kept
+        """
+        variables = self.fetch()
+        if variables is None:
+            return False
+        self._cache = {
+            "fetched": time.time() if now is None else now,
+            "index": {v["name"]: int(v["id"]) for v in variables},
+            "missing": [],
+        }
+        if self.path:
+            state.save_json(self.path, self._cache)
+        return True
+
+    def invalidate(self):
+        """Forgets the index, the next name lookup fetches the list again"""
+        self.cache["fetched"] = 0
+        if self.path:
+            state.save_json(self.path, self.cache)
+
+    def resolve(
+        self, variable: Union[int, str], now: Optional[float] = None
+    ) -> Optional[int]:
+        """The object id of a variable
+
+        Parameters
+        ----------
+        variable : int or str
+            An object id, or a variable name
+        now : float, optional
+            The current time, defaults to time.time()
+
+        Returns
+        -------
+        int
+            The object id, None if Indigo has no variable by that name
+        """
+        if isinstance(variable, int) or str(variable).isdigit():
+            return int(variable)
+        now = time.time() if now is None else now
+        fetched = False
+        if now - self.cache["fetched"] >= self.ttl:
+            fetched = self.refresh(now)
+        object_id = self.cache["index"].get(variable)
+        if object_id is None and not fetched:
+            if variable in self.cache.get("missing", []):
+                return None
+            # Invalidated on a miss, the variable may have been created since
+            fetched = self.refresh(now)
+            object_id = self.cache["index"].get(variable)
+        if object_id is None and fetched:
+            print(f"Indigo has no variable named {variable}")
+            self.cache["missing"].append(variable)
+            if self.path:
+                state.save_json(self.path, self.cache)
+        return object_id
@@ -0,0 +1,278 @@
+"""Runs several jobs concurrently in one process
+
+Every job is a module with a ``run(settings, session)`` function. The jobs
+spend most of their time waiting on the network, so each gets a thread and
+they share one Settings instance and one HTTP session, whose connection pools
+are sized for all of them. CPU bound work that would hold the GIL, rendering
+the sprinkler chart, goes to a process pool instead. A full run takes about
+as long as the slowest job rather than the sum of all of them.
+"""
+
+import argparse
+import importlib
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+from tabulate import tabulate
+
+from home_automation import exposition, read_api, resilience, utilities
+
+# Job name -> the module with its run() function
+JOBS = {
+    "sprinkler": "home_automation.sprinkler_multiplier",
+    "netatmo": "home_automation.netatmo",
+    "netatmo-accounts": "home_automation.netatmo_accounts",
+    "indigo-metrics": "home_automation.indigo_metrics",
+    "magic-mirror": "home_automation.magic_mirror",
+    "collectors": "home_automation.collectors",
+    "digest": "home_automation.digest",
+}
+
+# Jobs only run when named, collectors polls what netatmo and indigo-metrics
+# do, and the digest is sent weekly
+OPTIONAL_JOBS = {"collectors", "digest"}
+
+# Jobs serve only runs when named, the sprinkler job sends an email and spends
+# the Tomorrow.io budget every run, it is scheduled daily instead
+SERVE_EXCLUDED_JOBS = {"sprinkler"}
+
+# Jobs whose run() takes a process pool for CPU bound work
+PROCESS_JOBS = {"sprinkler"}
+
+
+def _run_job(name: str, settings, session, processes) -> tuple:
+    """Runs one job, catching its failure so the others carry on
+
+    Returns
+    -------
+    tuple
+        (name, error or None, seconds taken)
+    """
+    start = time.perf_counter()
+    kwargs = {"settings": settings, "session": session}
+    if name in PROCESS_JOBS:
+        kwargs["processes"] = processes
+    try:
+        importlib.import_module(JOBS[name]).run(**kwargs)
+        error = None
+    except (Exception, SystemExit) as exc:  # Jobs exit on fatal errors
+        print(f"Job {name} failed: {exc!r}")
+        error = exc
+    seconds = time.perf_counter() - start
+    exposition.REGISTRY.set(
+        "job_duration_seconds",
+        seconds,
+        {"job": name},
+        help_text="How long the last run of the job took",
+    )
+    exposition.REGISTRY.set(
+        "job_success",
+        error is None,
+        {"job": name},
+        help_text="1 if the last run of the job succeeded",
+    )
+    return name, error, seconds
+
+
+def run_all(
+    names: Optional[list] = None,
+    settings: Optional[utilities.Settings] = None,
+    workers: Optional[int] = None,
+) -> dict:
+    """Runs the named jobs concurrently
+
+    Parameters
+    ----------
+    names : list, optional
+        Jobs to run, keys of JOBS, defaults to all but the OPTIONAL_JOBS
+    settings : Settings, optional
+        Shared by every job, defaults to utilities.SETTINGS
+    workers : int, optional
+        Threads to run the jobs on, defaults to one per job
+
+    Returns
+    -------
+    dict
+        Job name -> (error or None, seconds taken)
+    """
+    names = list(names or [name for name in JOBS if name not in OPTIONAL_JOBS])
+    unknown = [name for name in names if name not in JOBS]
+    if unknown:
+        raise ValueError(f"Unknown jobs: {', '.join(unknown)}")
+    settings = settings or utilities.SETTINGS
+    resilience.start_deadline(settings.job_deadline)
+
+    session = utilities.make_session(pool_size=max(len(names), 1) * 2)
+    # Spawn rather than fork, forking a process that is running threads
+    # can copy locks that are held
+    processes = ProcessPoolExecutor(
+        max_workers=1, mp_context=multiprocessing.get_context("spawn")
+    )
+    try:
+        with ThreadPoolExecutor(
+            max_workers=workers or len(names), thread_name_prefix="job"
+        ) as threads:
+            futures = [
+                threads.submit(_run_job, name, settings, session, processes)
+                for name in names
+            ]
+            results = [future.result() for future in futures]
+    finally:
+        processes.shutdown()
+        session.close()
+        # Send the Indigo writes the jobs left in the write-behind buffer
+        utilities.INDIGO_WRITE_BUFFER.flush()
+    return {name: (error, seconds) for name, error, seconds in results}
+
+
+def publish_persisted(settings: utilities.Settings):
+    """Publishes what jobs run in other processes persisted
+
+    The sprinkler runs daily on its own, serve picks up its multiplier and
+    forecast from the state_dir so the API and gauges still have them.
+
+    Parameters
+    ----------
+    settings : Settings
+        Whose state_dir the other processes write to
+    """
+    sections = read_api.SNAPSHOT.load(
+        os.path.join(settings.state_dir, read_api.PERSISTED_FILE)
+    )
+    if "multiplier" in sections:
+        exposition.REGISTRY.set(
+            "sprinkler_multiplier",
+            sections["multiplier"]["multiplier"],
+            help_text="Multiplier applied to the sprinkler run times",
+        )
+
+
+def serve(
+    names: Optional[list] = None,
+    interval: float = 300,
+    port: Optional[int] = None,
+    settings: Optional[utilities.Settings] = None,
+    workers: Optional[int] = None,
+    stop: Optional[threading.Event] = None,
+):
+    """Runs the jobs every interval and serves their latest readings
+
+    The readings are served by :mod:`home_automation.exposition` for a
+    scraper to pull whenever it likes, and the latest results as JSON by
+    :mod:`home_automation.read_api`. Between runs they only live in memory.
+    Before each run the Settings are reloaded if a secret file changed, and
+    the results other processes persisted are published.
+
+    Parameters
+    ----------
+    names : list, optional
+        Jobs to run, keys of JOBS, defaults to all but the OPTIONAL_JOBS and
+        the SERVE_EXCLUDED_JOBS
+    interval : float
+        Seconds from the start of one run to the start of the next
+    port : int, optional
+        Port to serve the gauges on, defaults to the exposition_port of the
+        Settings, the JSON API is on its api_port
+    settings : Settings, optional
+        Shared by every job, defaults to utilities.SETTINGS
+    workers : int, optional
+        Threads to run the jobs on, defaults to one per job
+    stop : threading.Event, optional
+        Set to stop after the current run
+    """
+    settings = settings or utilities.SETTINGS
+    stop = stop or threading.Event()
+    names = list(
+        names
+        or [
+            name
+            for name in JOBS
+            if name not in OPTIONAL_JOBS and name not in SERVE_EXCLUDED_JOBS
+        ]
+    )
+    servers = [
+        exposition.start_server(settings.exposition_port if port is None else port),
+        read_api.start_server(settings.api_port),
+    ]
+    try:
+        while not stop.is_set():
+            start = time.monotonic()
+            # Pick up rotated credentials without a restart
+            utilities.SETTINGS_LOADER.reload_if_changed()
+            publish_persisted(settings)
+            run_all(names, settings, workers)
+            stop.wait(max(0.0, interval - (time.monotonic() - start)))
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+
+def main(argv=None) -> int:
+    """Command line entry point, ``python -m home_automation run-all``
+
+    Parameters
+    ----------
+    argv : list, optional
+        Command line arguments, defaults to sys.argv[1:]
+
+    Returns
+    -------
+    int
+        The exit status, 1 if any job failed
+    """
+    parser = argparse.ArgumentParser(prog="python3 -m home_automation")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_all_parser = commands.add_parser(
+        "run-all", help="Run jobs concurrently in this process"
+    )
+    serve_parser = commands.add_parser(
+        "serve", help="Run jobs on an interval and serve their latest readings"
+    )
+    for command_parser in (run_all_parser, serve_parser):
+        command_parser.add_argument(
+            "jobs",
+            nargs="*",
+            metavar="job",
+            help=f"Any of {', '.join(JOBS)}, or all for every one of them",
+        )
+        command_parser.add_argument("--workers", type=int, default=None)
+    serve_parser.add_argument(
+        "--interval", type=float, default=300, help="Seconds between runs"
+    )
+    serve_parser.add_argument(
+        "--port", type=int, default=None, help="Defaults to exposition_port"
+    )
+    args = parser.parse_args(argv)
+    # all includes the OPTIONAL_JOBS, which no names leaves out
+    names = [job for name in args.jobs for job in (JOBS if name == "all" else [name])]
+    args.jobs = list(dict.fromkeys(names))
+    unknown = [name for name in args.jobs if name not in JOBS]
+    if unknown:
+        parser.error(f"unknown jobs: {', '.join(unknown)}")
+
+    if args.command == "serve":
+        try:
+            serve(args.jobs or None, args.interval, args.port, workers=args.workers)
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    start = time.perf_counter()
+    results = run_all(args.jobs or None, workers=args.workers)
+    rows = [
+        [name, "failed" if error else "ok", f"{seconds:.2f}"]
+        for name, (error, seconds) in results.items()
+    ]
+    print(tabulate(rows, headers=["Job", "Status", "Seconds"]))
+    print(f"All jobs finished in {time.perf_counter() - start:.2f} seconds")
+    return 1 if any(error for error, _ in results.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""Remembers the last value written to each Indigo variable so unchanged
+values are not written again"""
+
+import threading
+import time
+from typing import Any, Optional
+
+from home_automation import state
+
+
+def _as_float(value: Any) -> Optional[float]:
+    """Returns the value as a float, or None if it is not numeric"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class LastWrittenStore:
+    """Last written value per variable, in memory and persisted to disk
+
+    Parameters
+    ----------
+    path : str, optional
+        JSON file the values are persisted to, None keeps them in memory only.
+    deadband : float
+        Numeric values that differ from the last written value by no more than
+        this are treated as unchanged.
+    refresh_seconds : float
+        A value is written again once this long has passed since the last
+        write, even when it has not changed.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        deadband: float = 0.0,
+        refresh_seconds: float = 86400,
+    ):
+        """Set up the store, the file is only read on first use"""
+        self.path = path
+        self.deadband = deadband
+        self.refresh_seconds = refresh_seconds
+        self._values = None  # key -> [value, written at]
+        self._lock = threading.Lock()
+
+    @property
+    def values(self) -> dict:
+        """The last written values, loaded from disk on first access"""
+        with self._lock:
+            return self._load()
+
+    def _load(self) -> dict:
+        """Loads the values from disk if needed, the caller holds the lock"""
+        if self._values is None:
+            self._values = state.load_json(self.path, {}) if self.path else {}
+        return self._values
+
+    def should_write(
+        self,
+        key: Any,
+        value: Any,
+        deadband: Optional[float] = None,
+        now: Optional[float] = None,
+    ) -> bool:
+        """Decides if a value needs to be written
+
+        Parameters
+        ----------
+        key : Any
+            The variable being written, usually the Indigo object id.
+        value : Any
+            The new value.
+        deadband : float, optional
+            Overrides the store's deadband for this call.
+        now : float, optional
+            The current epoch time, defaults to time.time().
+
+        Returns
+        -------
+        bool
+            False if the value matches the last write and that write is
+            recent enough, True otherwise.
+        """
+        last = self.values.get(str(key))
+        if last is None:
+            return True
+        last_value, written_at = last
+        now = time.time() if now is None else now
+        if now - written_at >= self.refresh_seconds:
+            return True
+        if str(value) == last_value:
+            return False
+
+        new_number = _as_float(value)
+        last_number = _as_float(last_value)
+        if new_number is None or last_number is None:
+            return True
+        deadband = self.deadband if deadband is None else deadband
+        return abs(new_number - last_number) > deadband
+
+    def record(self, key: Any, value: Any, now: Optional[float] = None):
+        """Records a successful write and persists the store
+
+        Parameters
+        ----------
+        key : Any
+            The variable that was written.
+        value : Any
+            The value that was written.
+        now : float, optional
+            The time of the write, defaults to time.time().
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            values = self._load()
+            values[str(key)] = [str(value), now]
+            if self.path:
+                state.save_json(self.path, dict(values))
@@ -0,0 +1,303 @@
+"""Pushes an Indigo variable to the MagicMirror as soon as it changes
+
+Instead of a scheduled GET and POST, push mode subscribes to Indigo's variable
+websocket feed and forwards changes to the mirror's ``/indoor-temperature``
+endpoint over a persistent connection. Rapid changes are coalesced with a
+debounce window, so the mirror only sees the settled value. When the
+websocket-client package is not installed, or the feed is unavailable, the
+variable is polled instead and only real changes are forwarded.
+"""
+
+import json
+import time
+from typing import Any, Callable, Optional
+from urllib.parse import urlsplit
+
+import requests
+
+from home_automation import profiling, utilities
+
+try:
+    import websocket
+except ImportError:  # Optional, we fall back to polling
+    websocket = None
+
+# The Indigo variable set by the scheduled task 'Update Office Temperature'
+VARIABLE = "office_temperature"
+
+
+class Debouncer:
+    """Coalesces rapid value changes, only the settled value is released
+
+    A released value stays pending until it is marked sent, if sending it
+    failed it is released again after the retry delay.
+
+    Parameters
+    ----------
+    window : float
+        Seconds a value has to stay unchanged before it is released.
+    retry : float
+        Seconds before a value that failed to send is released again.
+    """
+
+    def __init__(self, window: float = 0.5, retry: float = 5.0):
+        """Set up an empty debouncer"""
+        self.window = window
+        self.retry = retry
+        self._pending = None
+        self._due_at = None
+        self._sent = None
+
+    def offer(self, value: Any, now: Optional[float] = None):
+        """Records a value seen on the feed
+
+        Parameters
+        ----------
+        value : Any
+            The latest value of the variable.
+        now : float, optional
+            When it was seen, defaults to time.monotonic().
+        """
+        now = time.monotonic() if now is None else now
+        if value == self._pending and self._due_at is not None:
+            return
+        if value == self._sent and self._due_at is None:
+            return
+        self._pending = value
+        self._due_at = now + self.window
+
+    def timeout(self, now: Optional[float] = None) -> Optional[float]:
+        """Seconds until the pending value is due, None when nothing is pending"""
+        if self._due_at is None:
+            return None
+        now = time.monotonic() if now is None else now
+        return max(self._due_at - now, 0.0)
+
+    def due(self, now: Optional[float] = None) -> tuple:
+        """Releases the pending value once it has settled
+
+        Parameters
+        ----------
+        now : float, optional
+            The current time, defaults to time.monotonic().
+
+        Returns
+        -------
+        tuple
+            (True, value) when a changed value should be sent, else (False, None).
+            The value stays pending until sent or failed is called.
+        """
+        if self.timeout(now) != 0.0:
+            return False, None
+        if self._pending == self._sent:
+            self._due_at = None
+            return False, None
+        return True, self._pending
+
+    def sent(self, value: Any):
+        """Marks a value as delivered"""
+        self._sent = value
+        if value == self._pending:
+            self._due_at = None
+
+    def failed(self, now: Optional[float] = None):
+        """Keeps the pending value, to be released again after the retry delay"""
+        if self._due_at is not None:
+            now = time.monotonic() if now is None else now
+            self._due_at = now + self.retry
+
+
+def variable_value(message: dict, variable, object_id: Optional[int] = None) -> tuple:
+    """Extracts a variable's value from an Indigo variable feed message
+
+    Parameters
+    ----------
+    message : dict
+        A decoded message from the variable feed.
+    variable : int or str
+        The object id or name of the variable we follow.
+    object_id : int, optional
+        The variable's object id when it is followed by name, patches only
+        carry the id.
+
+    Returns
+    -------
+    tuple
+        (True, value) if the message carries a new value for the variable,
+        else (False, None).
+    """
+
+    def matches(item: dict) -> bool:
+        """Checks if an object dict is the variable we follow"""
+        return variable in (item.get("id"), item.get("name")) or (
+            object_id is not None and item.get("id") == object_id
+        )
+
+    kind = message.get("message")
+    if kind in ("add", "update") and matches(message.get("objectDict", {})):
+        return True, message["objectDict"].get("value")
+    if kind == "refresh":
+        for item in message.get("list", []):
+            if matches(item):
+                return True, item.get("value")
+    patched = message.get("objectId")
+    if kind == "patch" and patched is not None and patched in (variable, object_id):
+        for change in message.get("patch", []):
+            if change[0] == "change" and change[1] == "value":
+                return True, change[2][1]
+    return False, None
+
+
+class MirrorPusher:
+    """Follows an Indigo variable and pushes its changes to the MagicMirror
+
+    Parameters
+    ----------
+    variable : int or str
+        The Indigo variable to follow.
+    debounce : float
+        Seconds a new value must settle before it is pushed.
+    poll_interval : float
+        Seconds between reads when falling back to polling, and before a
+        push the mirror failed is retried.
+    session : requests.Session, optional
+        Session used for Indigo and the mirror, keeps the connections open.
+    """
+
+    def __init__(
+        self,
+        variable,
+        debounce: float = 0.5,
+        poll_interval: float = 5.0,
+        session: Optional[requests.Session] = None,
+    ):
+        """Set up a pusher, nothing is sent until run() is called"""
+        self.variable = variable
+        self.poll_interval = poll_interval
+        self.session = session or requests.Session()
+        self.debouncer = Debouncer(debounce, retry=poll_interval)
+        self.pushes = 0
+
+    def flush(self, now: Optional[float] = None):
+        """Pushes the pending value to the mirror once it has settled"""
+        ready, value = self.debouncer.due(now)
+        if not ready:
+            return
+        if utilities.update_magicmirror_internal_temperature(
+            value, session=self.session
+        ):
+            self.debouncer.sent(value)
+            self.pushes += 1
+        else:
+            self.debouncer.failed(now)
+
+    def feed_url(self) -> str:
+        """The websocket URL of Indigo's variable feed"""
+        parts = urlsplit(str(utilities.SETTINGS.indigo_url))
+        scheme = "wss" if parts.scheme == "https" else "ws"
+        return f"{scheme}://{parts.netloc}/v2/api/ws/variable-feed"
+
+    def follow_feed(self, until: Callable[[], bool]):
+        """Pushes changes received from the websocket feed until told to stop
+
+        Raises
+        ------
+        Exception
+            Whatever websocket-client raises when the feed is lost.
+        """
+        api_key = utilities.SETTINGS.indigo_api_key.get_secret_value()
+        object_id = utilities.INDIGO_VARIABLES.resolve(self.variable)
+        feed = websocket.create_connection(
+            self.feed_url(), header=[f"Authorization: Bearer {api_key}"]
+        )
+        print(f"Following {self.variable} on {self.feed_url()}")
+        try:
+            while not until():
+                timeout = self.debouncer.timeout()
+                feed.settimeout(
+                    self.poll_interval if timeout is None else max(timeout, 0.01)
+                )
+                try:
+                    changed, value = variable_value(
+                        json.loads(feed.recv()), self.variable, object_id
+                    )
+                    if changed:
+                        self.debouncer.offer(value)
+                except websocket.WebSocketTimeoutException:
+                    pass
+                self.flush()
+        finally:
+            feed.close()
+
+    def poll(self, until: Callable[[], bool]):
+        """Polls the variable and pushes real changes until told to stop"""
+        print(f"Polling {self.variable} every {self.poll_interval} seconds")
+        while not until():
+            value = utilities.get_indigo_variable(self.variable, session=self.session)
+            if value is not None:
+                self.debouncer.offer(value)
+            timeout = self.debouncer.timeout()
+            time.sleep(self.poll_interval if timeout is None else timeout)
+            self.flush()
+
+    def run(self, until: Callable[[], bool] = lambda: False):
+        """Pushes changes, preferring the websocket feed over polling
+
+        Before each connection to the feed or round of polling the Settings
+        are reloaded if a secret file changed.
+
+        Parameters
+        ----------
+        until : callable
+            Returns True when the pusher should stop, by default it runs forever.
+        """
+        while not until():
+            # Pick up rotated credentials before connecting again
+            utilities.SETTINGS_LOADER.reload_if_changed()
+            if websocket is not None:
+                try:
+                    self.follow_feed(until)
+                    continue
+                except Exception as error:
+                    print(f"Variable feed unavailable ({error}), polling instead")
+            # Poll for a while, then try the feed again
+            deadline = time.monotonic() + 60 * self.poll_interval
+            self.poll(lambda: until() or time.monotonic() > deadline)
+
+
+def run(
+    settings: Optional[utilities.Settings] = None,
+    session: Optional[requests.Session] = None,
+    push: bool = False,
+    debounce: float = 0.5,
+    poll_interval: float = 5.0,
+):
+    """Copies the office temperature to the MagicMirror
+
+    Parameters
+    ----------
+    settings : Settings, optional
+        Unused, the utilities functions read utilities.SETTINGS. Accepted so
+        every job can be run the same way.
+    session : requests.Session, optional
+        Session to send the requests on, so jobs can share connection pools
+    push : bool
+        Keep running and push every change, instead of copying it once
+    debounce : float
+        Seconds a new value must settle before it is pushed
+    poll_interval : float
+        Seconds between reads when falling back to polling
+    """
+    if push:
+        MirrorPusher(
+            VARIABLE, debounce=debounce, poll_interval=poll_interval, session=session
+        ).run()
+        return
+
+    with profiling.phase("fetch"):
+        indoor_temperature = utilities.get_indigo_variable(VARIABLE, session=session)
+
+    with profiling.phase("write"):
+        utilities.update_magicmirror_internal_temperature(
+            indoor_temperature, session=session
+        )
@@ -0,0 +1,743 @@
+"""Helpers for talking to the Netatmo weather station API"""
+
+import os
+import time
+from typing import Iterator, Optional
+
+import numpy as np
+import pandas as pd
+import requests
+
+from home_automation import (
+    columnar,
+    derived,
+    resilience,
+    state,
+    utilities,
+)
+from home_automation.ratelimit import RateLimited
+from home_automation.streaming_json import iter_items
+
+TOKEN_URL = "https://api.netatmo.com/oauth2/token"
+API_URL = "https://api.netatmo.com/api/"
+
+# getmeasure returns at most this many timestamps per call
+MAX_MEASURES = 1024
+
+# Netatmo allows 50 requests per 10 seconds per user, stay under it
+MIN_REQUEST_INTERVAL = 0.25
+
+# Sensors reported for each data_type that are not named after it
+DATA_TYPE_SENSORS = {
+    "Wind": ["WindStrength", "WindAngle", "GustStrength", "GustAngle"],
+}
+
+# Dashboard values reported alongside the sensors of each data_type
+DASHBOARD_EXTRAS = {
+    "Rain": ["sum_rain_24"],
+}
+
+# Status fields of the station and its modules that are logged as well
+STATUS_FIELDS = ["wifi_status", "battery_percent", "battery_vp", "rf_status"]
+
+# The parts of each station in getstationsdata that the jobs use
+STATION_FIELDS = ["_id", "module_name", "reachable", "data_type", "dashboard_data"]
+STATION_FIELDS += ["modules"] + STATUS_FIELDS
+
+# Outdoor readings copied to Indigo variables
+INDIGO_VARIABLES = {
+    ("Outdoor", "Temperature"): "Netatmo_Outside_Temp",
+    ("Outdoor", "Humidity"): "Netatmo_Outside_Humidity",
+}
+
+# Stations upload their readings about this often, in seconds
+UPLOAD_INTERVAL = 600
+
+# Polls are scheduled this long after an upload is expected, to let it land
+UPLOAD_MARGIN = 30
+
+# How soon to look again when an upload is overdue
+OVERDUE_RETRY = 60
+
+# Budget key -> time.monotonic() of its last request
+_last_requests = {}
+
+
+def convert_celsius_to_fahrenheit(celsius: float):
+    """The US doesn't like easy math, give us hard to calculate stuff.
+
+    Parameters
+    ----------
+    celsius : float
+        The observed temperature in celsius
+
+    Returns
+    -------
+    farenheit : float
+        The converted temperature in farenheit
+    """
+    fahrenheit = 9.0 / 5.0 * celsius + 32
+    return fahrenheit
+
+
+def _escape_tag(tag) -> str:
+    """Escapes the characters line protocol doesn't allow in a tag value"""
+    return str(tag).replace(",", r"\,").replace(" ", r"\ ")
+
+
+def line_protocol(
+    sensor: str,
+    device: str,
+    value: float,
+    timestamp: int,
+    tags: Optional[dict] = None,
+) -> str:
+    """Formats one reading as an InfluxDB line protocol point
+
+    Parameters
+    ----------
+    sensor : str
+        The measurement name, e.g. Temperature
+    device : str
+        The Netatmo module name
+    value : float
+        The reading
+    timestamp : int
+        Epoch time of the reading in milliseconds
+    tags : dict, optional
+        More tags for the point, e.g. the account it was read from, or the
+        product when it isn't netatmo
+
+    Returns
+    -------
+    str
+        The line protocol point
+    """
+    tags = dict({"product": "netatmo"}, **(tags or {}), device=device)
+    tag_set = ",".join(f"{key}={_escape_tag(tag)}" for key, tag in sorted(tags.items()))
+    return f"{sensor},{tag_set} value={value} {timestamp}"
+
+
+def get_access_token(
+    settings: Optional[utilities.Settings] = None,
+    session: Optional[requests.Session] = None,
+) -> str:
+    """Gets an access token using the account credentials
+
+    Parameters
+    ----------
+    settings : Settings, optional
+        Where the credentials come from, defaults to utilities.SETTINGS
+    session : requests.Session, optional
+        Session to send the request on, so jobs can share connection pools
+
+    Returns
+    -------
+    str
+        The access token
+    """
+    settings = settings or utilities.SETTINGS
+    payload = {
+        "grant_type": "password",
+        "username": settings.email_to,
+        "password": settings.netatmo_password,
+        "client_id": settings.netatmo_client_id,
+        "client_secret": settings.netatmo_client_secret,
+        "scope": "read_station",
+    }
+    return request_token(payload, session=session)["access_token"]
+
+
+def request_token(
+    payload: dict,
+    budget_key: Optional[str] = None,
+    session: Optional[requests.Session] = None,
+) -> dict:
+    """Posts a grant to the token endpoint
+
+    Parameters
+    ----------
+    payload : dict
+        The grant, with the client credentials
+    budget_key : str, optional
+        Whose hourly budget the request counts against, defaults to the
+        client id of the grant
+    session : requests.Session, optional
+        Session to send the request on, so jobs can share connection pools
+
+    Returns
+    -------
+    dict
+        The token response, with the access_token, refresh_token and
+        expires_in
+    """
+    _reserve(budget_key or payload["client_id"])
+    response = resilience.call(
+        "netatmo", (session or requests).post, TOKEN_URL, data=payload
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def _reserve(budget_key: Optional[str] = None):
+    """Takes a request from the hourly budget of a Netatmo user
+
+    Waits for the budget to refill if needed, as long as the job's deadline
+    allows.
+
+    Parameters
+    ----------
+    budget_key : str, optional
+        Whose budget, defaults to the netatmo_client_id of the Settings
+
+    Raises
+    ------
+    RateLimited
+        If the budget won't refill before the deadline.
+    """
+    if not utilities.RATE_LIMITS.acquire(
+        "netatmo",
+        budget_key or utilities.SETTINGS.netatmo_client_id,
+        max_wait=resilience.remaining(),
+    ):
+        raise RateLimited("Netatmo hourly budget spent")
+
+
+def _throttle(min_interval: float, budget_key: Optional[str] = None):
+    """Sleeps so that one user's requests are at least min_interval apart
+
+    Each user has their own limit, so accounts polled in parallel don't
+    wait on each other.
+    """
+    last = _last_requests.get(budget_key, 0.0)
+    wait = last + min_interval - time.monotonic()
+    if wait > 0:
+        time.sleep(wait)
+    _last_requests[budget_key] = time.monotonic()
+
+
+def _rate_limited(response: requests.Response) -> bool:
+    """Checks if Netatmo refused a request because of its usage limits"""
+    if response.status_code == 429:
+        return True
+    if response.status_code != 403:
+        return False
+    try:
+        return response.json()["error"]["code"] == 26  # user usage reached
+    except (ValueError, KeyError, TypeError):
+        return False
+
+
+def api_request(
+    method: str,
+    params: dict,
+    min_interval: float = MIN_REQUEST_INTERVAL,
+    retries: int = 5,
+    session: Optional[requests.Session] = None,
+    stream: Optional[str] = None,
+    fields: Optional[list] = None,
+    budget_key: Optional[str] = None,
+):
+    """Calls a Netatmo API method, backing off when the rate limit is hit
+
+    Parameters
+    ----------
+    method : str
+        The API method, e.g. getstationsdata
+    params : dict
+        The request parameters, including the access token
+    min_interval : float
+        Minimum number of seconds between requests
+    retries : int
+        How many times a rate limited request is retried
+    session : requests.Session, optional
+        Session to send the request on, so jobs can share connection pools
+    stream : str, optional
+        Dotted path of an array in the response, e.g. body.devices. Its items
+        are streamed out of the body instead of decoding all of it.
+    fields : list, optional
+        With stream, the keys kept from each item
+    budget_key : str, optional
+        Whose hourly budget and request spacing the request counts against,
+        defaults to the netatmo_client_id of the Settings
+
+    Returns
+    -------
+    dict or list
+        The body of the response, or the items of the streamed array
+    """
+    backoff = 10
+    for attempt in range(retries + 1):
+        _reserve(budget_key)
+        _throttle(min_interval, budget_key)
+        response = resilience.call(
+            "netatmo",
+            (session or requests).post,
+            API_URL + method,
+            params=params,
+            stream=stream is not None,
+        )
+        if not _rate_limited(response) or attempt == retries:
+            break
+        delay = float(response.headers.get("Retry-After", backoff))
+        left = resilience.remaining()
+        if left is not None and delay >= left:
+            break  # Waiting would run past the job's deadline
+        print(f"Netatmo rate limit reached, waiting {delay} seconds")
+        time.sleep(delay)
+        backoff = min(backoff * 2, 600)
+    response.raise_for_status()
+    if stream is not None:
+        return list(iter_items(response, stream, fields))
+    return response.json()["body"]
+
+
+def get_stations_data(
+    access_token: str,
+    device_id: Optional[str],
+    session: Optional[requests.Session] = None,
+    budget_key: Optional[str] = None,
+) -> dict:
+    """Gets the current station data, including each module's dashboard
+
+    Parameters
+    ----------
+    access_token : str
+        A valid access token
+    device_id : str, optional
+        The MAC address of the main station, None for every station of the
+        account
+    session : requests.Session, optional
+        Session to send the request on, so jobs can share connection pools
+    budget_key : str, optional
+        Whose hourly budget the request counts against, see api_request
+
+    Returns
+    -------
+    dict
+        The devices of the getstationsdata response, reduced to STATION_FIELDS
+    """
+    params = {"access_token": access_token}
+    if device_id:
+        params["device_id"] = device_id
+    devices = api_request(
+        "getstationsdata",
+        params,
+        session=session,
+        stream="body.devices",
+        fields=STATION_FIELDS,
+        budget_key=budget_key,
+    )
+    return {"devices": devices}
+
+
+def iter_sensors(stations_data: dict) -> Iterator[tuple]:
+    """Lists the historical series available for each station and module
+
+    Parameters
+    ----------
+    stations_data : dict
+        The body of a getstationsdata response
+
+    Yields
+    ------
+    tuple
+        (device_id, module_id or None, module name, list of sensor names)
+    """
+    for device in stations_data["devices"]:
+        modules = [(None, device)] + [(m["_id"], m) for m in device["modules"]]
+        for module_id, module in modules:
+            sensors = []
+            for data_type in module["data_type"]:
+                sensors.extend(DATA_TYPE_SENSORS.get(data_type, [data_type]))
+            yield device["_id"], module_id, module["module_name"], sensors
+
+
+def iter_measurements(
+    access_token: str,
+    device_id: str,
+    module_id: Optional[str],
+    sensors: list,
+    date_begin: int,
+    date_end: int,
+    scale: str = "max",
+    min_interval: float = MIN_REQUEST_INTERVAL,
+) -> Iterator[list]:
+    """Pages through the measurement history of one module
+
+    Only one page is held in memory at a time, so arbitrarily long ranges can
+    be streamed.
+
+    Parameters
+    ----------
+    access_token : str
+        A valid access token
+    device_id : str
+        The MAC address of the main station
+    module_id : str, optional
+        The module to read, None for the main station itself
+    sensors : list
+        Sensor names to read, e.g. ["Temperature", "Humidity"]
+    date_begin : int
+        Epoch seconds to start from (inclusive)
+    date_end : int
+        Epoch seconds to stop at (inclusive)
+    scale : str
+        Netatmo aggregation scale, "max" is the raw ~5 minute data
+    min_interval : float
+        Minimum number of seconds between requests
+
+    Yields
+    ------
+    list
+        A page of (epoch seconds, [value per sensor]) tuples, oldest first
+    """
+    params = {
+        "access_token": access_token,
+        "device_id": device_id,
+        "scale": scale,
+        "type": ",".join(sensors),
+        "date_end": date_end,
+        "limit": MAX_MEASURES,
+        "optimize": "false",
+        "real_time": "true",
+    }
+    if module_id:
+        params["module_id"] = module_id
+
+    while date_begin <= date_end:
+        body = api_request(
+            "getmeasure", dict(params, date_begin=date_begin), min_interval
+        )
+        if not body:
+            return
+        page = sorted((int(ts), values) for ts, values in body.items())
+        yield page
+        date_begin = page[-1][0] + 1
+
+
+def page_frame(page: list, sensors: list, device: str) -> pd.DataFrame:
+    """A getmeasure page as a batch of readings, temperatures in fahrenheit
+
+    Parameters
+    ----------
+    page : list
+        (epoch seconds, [value per sensor]) tuples from iter_measurements
+    sensors : list
+        The sensor of each value
+    device : str
+        The module name
+
+    Returns
+    -------
+    pandas.DataFrame
+        The time, device, sensor and value of every reading that isn't None,
+        in the order of the page
+    """
+    times = np.array([timestamp for timestamp, _ in page], dtype=float)
+    values = np.array([row for _, row in page], dtype=float).reshape(len(page), -1)
+    if "Temperature" in sensors:
+        column = sensors.index("Temperature")
+        values[:, column] = convert_celsius_to_fahrenheit(values[:, column])
+    readings = pd.DataFrame(
+        {
+            "time": np.repeat(times, len(sensors)),
+            "device": device,
+            "sensor": np.tile(np.asarray(sensors, dtype=object), len(page)),
+            "value": values.ravel(),
+        }
+    )
+    return readings[~np.isnan(readings["value"].to_numpy())].reset_index(drop=True)
+
+
+def backfill(
+    access_token: str,
+    stations_data: dict,
+    date_begin: int,
+    date_end: int,
+    write,
+    checkpoint_path: Optional[str] = None,
+    batch_size: int = 5000,
+    scale: str = "max",
+) -> int:
+    """Streams the history of every module into batched line protocol writes
+
+    Each page is written along with the series derived from it, see
+    home_automation.derived. Progress is checkpointed per module and requested
+    range after every batch, so an interrupted backfill picks up where it
+    stopped when run again for the same range with the same checkpoint file,
+    and a different range starts from its own beginning.
+
+    Parameters
+    ----------
+    access_token : str
+        A valid access token
+    stations_data : dict
+        The body of a getstationsdata response, used to list the modules
+    date_begin : int
+        Epoch seconds to start from
+    date_end : int
+        Epoch seconds to stop at
+    write : callable
+        Called with each batch, a list of line protocol strings
+    checkpoint_path : str, optional
+        JSON file recording the last timestamp written per module and range
+    batch_size : int
+        Number of points per write
+    scale : str
+        Netatmo aggregation scale
+
+    Returns
+    -------
+    int
+        The number of points written
+    """
+    checkpoint = state.load_json(checkpoint_path, {}) if checkpoint_path else {}
+    written = 0
+
+    for device_id, module_id, name, sensors in iter_sensors(stations_data):
+        key = f"{device_id}/{module_id or device_id}:{date_begin}-{date_end}"
+        start = max(date_begin, checkpoint.get(key, date_begin - 1) + 1)
+        print(f"Backfilling {name} {sensors} from {start}")
+        batch = []
+        previous = None  # The last page, for the pressure trend
+        for page in iter_measurements(
+            access_token, device_id, module_id, sensors, start, date_end, scale
+        ):
+            readings = page_frame(page, sensors, name)
+            points = pd.concat(
+                [readings, derived.derive(readings, previous)], ignore_index=True
+            )
+            batch.extend(
+                line_protocol(sensor, name, value, int(timestamp * 1000))
+                for timestamp, sensor, value in zip(
+                    points["time"], points["sensor"], points["value"]
+                )
+            )
+            previous = readings
+            checkpoint[key] = page[-1][0]
+            if len(batch) >= batch_size:
+                write(batch)
+                written += len(batch)
+                batch = []
+                if checkpoint_path:
+                    state.save_json(checkpoint_path, checkpoint)
+        if batch:
+            write(batch)
+            written += len(batch)
+        if checkpoint_path:
+            state.save_json(checkpoint_path, checkpoint)
+
+    return written
+
+
+def dashboard_metrics(stations_data: dict) -> list:
+    """Flattens the current readings of every station and module
+
+    Parameters
+    ----------
+    stations_data : dict
+        The body of a getstationsdata response
+
+    Returns
+    -------
+    list
+        A dict per reading with the device, sensor and measurement,
+        temperatures converted to fahrenheit, and the module id and epoch
+        time_utc of the upload it came in, None if the module has none
+    """
+    metrics = []
+    for device in stations_data["devices"]:
+        for module in [device] + device.get("modules", []):
+            name = module["module_name"]
+            print(name, module.get("reachable"))
+            readings = [
+                (field, module[field]) for field in STATUS_FIELDS if field in module
+            ]
+            dashboard = module.get("dashboard_data")
+            if dashboard is not None:
+                for data_type in module["data_type"]:
+                    sensors = DATA_TYPE_SENSORS.get(data_type, [data_type])
+                    for sensor in sensors + DASHBOARD_EXTRAS.get(data_type, []):
+                        readings.append((sensor, dashboard[sensor]))
+            uploaded = (dashboard or {}).get("time_utc")
+            for sensor, measurement in readings:
+                if sensor == "Temperature":
+                    measurement = convert_celsius_to_fahrenheit(measurement)
+                metrics.append(
+                    {
+                        "device": name,
+                        "sensor": sensor,
+                        "measurement": measurement,
+                        "module": module.get("_id"),
+                        "time": uploaded,
+                    }
+                )
+                print(f"\tdevice: {name}, sensor: {sensor}, measurement: {measurement}")
+    return metrics
+
+
+class UploadTracker:
+    """The last upload seen from each module, and when the next one is due
+
+    Stations upload about every UPLOAD_INTERVAL seconds, and in between
+    getstationsdata returns the same readings. Each module's time_utc is
+    kept, so readings that were already logged are dropped, and the next poll
+    is scheduled just after the next upload is expected.
+
+    Parameters
+    ----------
+    path : str, optional
+        JSON file the uploads are kept in, None keeps them in memory only.
+    interval : float
+        Seconds between a station's uploads.
+    margin : float
+        Seconds after an expected upload the poll is scheduled.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        interval: float = UPLOAD_INTERVAL,
+        margin: float = UPLOAD_MARGIN,
+    ):
+        """Set up the tracker, the file is only read on first use"""
+        self.path = path
+        self.interval = interval
+        self.margin = margin
+        self._entry = None
+
+    @classmethod
+    def from_settings(cls, settings: utilities.Settings) -> "UploadTracker":
+        """The tracker configured by Settings, kept under state_dir"""
+        return cls(os.path.join(settings.state_dir, "netatmo_uploads.json"))
+
+    @property
+    def entry(self) -> dict:
+        """Module id -> its last time_utc, and the time of the next poll"""
+        if self._entry is None:
+            default = {"modules": {}, "next_poll": 0}
+            self._entry = state.load_json(self.path, default) if self.path else default
+        return self._entry
+
+    def due(self, now: Optional[float] = None) -> bool:
+        """True once the next upload should have arrived"""
+        return (time.time() if now is None else now) >= self.entry["next_poll"]
+
+    def record(self, metrics: list, now: Optional[float] = None) -> list:
+        """Keeps the readings of new uploads and schedules the next poll
+
+        Parameters
+        ----------
+        metrics : list
+            Readings from dashboard_metrics
+        now : float, optional
+            The current time, defaults to time.time()
+
+        Returns
+        -------
+        list
+            The readings that were not logged before, readings without an
+            upload time are always kept
+        """
+        now = time.time() if now is None else now
+        modules = self.entry["modules"]
+        fresh = [
+            m
+            for m in metrics
+            if m.get("time") is None or m["time"] > modules.get(str(m["module"]), 0)
+        ]
+        for metric in fresh:
+            if metric.get("time") is not None:
+                modules[str(metric["module"])] = metric["time"]
+
+        uploads = [m["time"] for m in metrics if m.get("time") is not None]
+        next_poll = max(uploads, default=now) + self.interval + self.margin
+        if next_poll <= now:
+            next_poll = now + OVERDUE_RETRY  # Late, the station may be offline
+        self.entry["next_poll"] = next_poll
+        return fresh
+
+    def save(self):
+        """Persists the uploads"""
+        if self.path:
+            state.save_json(self.path, self.entry)
+
+
+def archive_metrics(
+    metrics: list,
+    timestamp: float,
+    settings: Optional[utilities.Settings] = None,
+    table: str = "netatmo",
+):
+    """Appends the numeric readings to a table of the columnar store
+
+    Parameters
+    ----------
+    metrics : list
+        Readings from dashboard_metrics
+    timestamp : float
+        Epoch seconds they were taken, for readings without their own time
+    settings : Settings, optional
+        Defaults to utilities.SETTINGS
+    table : str
+        The table, netatmo is the home station that forecasts are checked
+        against
+    """
+    rows = []
+    for metric in metrics:
+        try:
+            rows.append(
+                (
+                    metric.get("time") or timestamp,
+                    metric["device"],
+                    metric["sensor"],
+                    float(metric["measurement"]),
+                )
+            )
+        except (TypeError, ValueError):
+            continue
+    if not rows:
+        return
+    times, devices, sensors, values = zip(*rows)
+    try:
+        columnar.ColumnStore.from_settings(settings or utilities.SETTINGS).append(
+            table,
+            {
+                columnar.TIME: times,
+                "device": devices,
+                "sensor": sensors,
+                "value": values,
+            },
+        )
+    except OSError as error:
+        print(f"Unable to archive the Netatmo readings: {error}")
+
+
+def run(
+    settings: Optional[utilities.Settings] = None,
+    session: Optional[requests.Session] = None,
+    force: bool = False,
+):
+    """Logs the current Netatmo readings to InfluxDB, the ring buffers and Indigo
+
+    Runs the default :class:`home_automation.collectors.NetatmoCollector`, so
+    this is the same pipeline the collectors job runs. Netatmo is only asked
+    once the station's next upload is due, and only readings from uploads
+    that weren't logged before are written, stamped with the time they were
+    uploaded, along with the series derived from them.
+
+    Parameters
+    ----------
+    settings : Settings, optional
+        Defaults to utilities.SETTINGS
+    session : requests.Session, optional
+        Session to send the requests on, so jobs can share connection pools
+    force : bool
+        Poll even if no upload is due yet
+    """
+    from home_automation import collectors  # It builds on this module
+
+    collectors.run_collectors(
+        [collectors.NetatmoCollector()], settings, session, force=force
+    )
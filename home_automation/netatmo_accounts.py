@@ -0,0 +1,447 @@
+"""Polls the weather stations of many Netatmo accounts from one process
+
+The single station job reads one account from Settings, so logging many homes
+used to take a Job per home, each with its own interpreter and connections.
+Here the accounts are listed in a JSON file (``netatmo_accounts_file``)::
+
+    [
+        {
+            "name": "home",
+            "username": "someone@example.com",
+            "password": "...",
+            "client_id": "...",
+            "client_secret": "...",
+            "device_ids": ["70:ee:50:00:00:01"]
+        }
+    ]
+
+and polled concurrently on a bounded thread pool, one getstationsdata call per
+account. Each account has its own cached token, hourly budget and request
+spacing, and a failing account is reported without holding up the others.
+The readings of every account go out together in one batched InfluxDB write.
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
+
+import requests
+from influxdb import InfluxDBClient
+from pydantic import BaseModel, SecretStr
+
+from home_automation import (
+    exposition,
+    netatmo,
+    profiling,
+    read_api,
+    state,
+    utilities,
+)
+from home_automation.ringbuffer import RingBufferStore
+
+# Columnar table of the readings, apart from the home station's netatmo table
+TABLE = "netatmo_accounts"
+
+# Tokens this close to expiring are renewed before they are used
+EXPIRY_MARGIN = 60
+
+# Netatmo error codes for an access token that is invalid or has expired
+TOKEN_ERRORS = (2, 3)
+
+
+class NetatmoAccount(BaseModel):
+    """One Netatmo account and the stations read from it
+
+    Attributes
+    ----------
+    name: str
+        Unique name of the account, its readings are tagged with it.
+    username: str
+        The Netatmo login.
+    password: SecretStr
+        The Netatmo password.
+    client_id: str
+        The id of the Netatmo app the account is read through.
+    client_secret: SecretStr
+        The secret of the Netatmo app.
+    device_ids: list
+        MAC addresses of the stations to log, empty logs every station of
+        the account.
+    """
+
+    name: str
+    username: str
+    password: SecretStr
+    client_id: str
+    client_secret: SecretStr
+    device_ids: list = []
+
+    @property
+    def budget_key(self) -> str:
+        """Netatmo limits each user of an app, so budgets are kept per both"""
+        return f"{self.client_id}/{self.username}"
+
+
+def load_accounts(path: str) -> list:
+    """Reads the accounts file
+
+    Parameters
+    ----------
+    path : str
+        JSON list of accounts
+
+    Returns
+    -------
+    list
+        A NetatmoAccount per entry
+
+    Raises
+    ------
+    ValueError
+        If two accounts have the same name.
+    """
+    with open(path, encoding="utf-8") as accounts_file:
+        accounts = [NetatmoAccount(**entry) for entry in json.load(accounts_file)]
+    names = [account.name for account in accounts]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate Netatmo account names: {', '.join(duplicates)}")
+    return accounts
+
+
+class TokenCache:
+    """Access and refresh tokens of each account, cached on disk
+
+    A token is reused until it is about to expire, then renewed with its
+    refresh token, and only if that fails with the password. Most runs
+    therefore cost each account a single request. The cache is shared by the
+    polling threads and saved once at the end of a run.
+
+    Parameters
+    ----------
+    path : str, optional
+        JSON file the tokens are kept in, None keeps them in memory only.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """Set up the cache, the file is only read on first use"""
+        self.path = path
+        self._tokens = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings: utilities.Settings) -> "TokenCache":
+        """The cache configured by Settings, kept under state_dir"""
+        return cls(os.path.join(settings.state_dir, "netatmo_tokens.json"))
+
+    @property
+    def tokens(self) -> dict:
+        """Account name -> access_token, refresh_token, expires_at, username"""
+        if self._tokens is None:
+            self._tokens = state.load_json(self.path, {}) if self.path else {}
+        return self._tokens
+
+    def token(
+        self,
+        account: NetatmoAccount,
+        session: Optional[requests.Session] = None,
+        now: Optional[float] = None,
+    ) -> str:
+        """A valid access token for an account
+
+        Parameters
+        ----------
+        account : NetatmoAccount
+            The account
+        session : requests.Session, optional
+            Session to send a token request on
+        now : float, optional
+            The current time, defaults to time.time()
+
+        Returns
+        -------
+        str
+            The access token
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            cached = dict(self.tokens.get(account.name, {}))
+        if cached.get("username") != account.username:
+            cached = {}  # The account's login was changed
+        if cached.get("access_token") and cached["expires_at"] - EXPIRY_MARGIN > now:
+            return cached["access_token"]
+
+        credentials = {
+            "client_id": account.client_id,
+            "client_secret": account.client_secret.get_secret_value(),
+        }
+        body = None
+        if cached.get("refresh_token"):
+            try:
+                body = netatmo.request_token(
+                    dict(
+                        credentials,
+                        grant_type="refresh_token",
+                        refresh_token=cached["refresh_token"],
+                    ),
+                    account.budget_key,
+                    session,
+                )
+            except requests.HTTPError as error:
+                print(f"Unable to refresh the {account.name} Netatmo token: {error}")
+        if body is None:
+            body = netatmo.request_token(
+                dict(
+                    credentials,
+                    grant_type="password",
+                    username=account.username,
+                    password=account.password.get_secret_value(),
+                    scope="read_station",
+                ),
+                account.budget_key,
+                session,
+            )
+
+        entry = {
+            "access_token": body["access_token"],
+            "refresh_token": body.get("refresh_token"),
+            "expires_at": now + float(body.get("expires_in", 10800)),
+            "username": account.username,
+        }
+        with self._lock:
+            self.tokens[account.name] = entry
+        return entry["access_token"]
+
+    def invalidate(self, name: str):
+        """Forgets an account's access token, keeping its refresh token"""
+        with self._lock:
+            if name in self.tokens:
+                self.tokens[name]["access_token"] = None
+
+    def save(self):
+        """Persists the tokens"""
+        if self.path:
+            with self._lock:
+                state.save_json(self.path, self.tokens)
+
+
+def _token_rejected(error: requests.HTTPError) -> bool:
+    """Checks if Netatmo refused a request because of its access token"""
+    if error.response is None or error.response.status_code not in (401, 403):
+        return False
+    try:
+        return error.response.json()["error"]["code"] in TOKEN_ERRORS
+    except (ValueError, KeyError, TypeError):
+        return False
+
+
+def poll_account(
+    account: NetatmoAccount,
+    tokens: TokenCache,
+    session: Optional[requests.Session] = None,
+) -> list:
+    """Reads the current readings of an account's stations
+
+    Parameters
+    ----------
+    account : NetatmoAccount
+        The account
+    tokens : TokenCache
+        Where its access token comes from
+    session : requests.Session, optional
+        Session to send the requests on
+
+    Returns
+    -------
+    list
+        A dict per reading like dashboard_metrics, with the account as well
+    """
+
+    def fetch(access_token: str) -> dict:
+        """One getstationsdata call covers every station of the account"""
+        return netatmo.get_stations_data(
+            access_token, None, session=session, budget_key=account.budget_key
+        )
+
+    try:
+        data = fetch(tokens.token(account, session))
+    except requests.HTTPError as error:
+        if not _token_rejected(error):
+            raise
+        # Revoked before it expired, e.g. the password was changed
+        tokens.invalidate(account.name)
+        data = fetch(tokens.token(account, session))
+
+    if account.device_ids:
+        data["devices"] = [d for d in data["devices"] if d["_id"] in account.device_ids]
+    return [
+        dict(metric, account=account.name) for metric in netatmo.dashboard_metrics(data)
+    ]
+
+
+def collect(
+    accounts: list,
+    tokens: TokenCache,
+    session: Optional[requests.Session] = None,
+    workers: int = 16,
+) -> tuple:
+    """Polls the accounts concurrently
+
+    Parameters
+    ----------
+    accounts : list
+        NetatmoAccount to poll
+    tokens : TokenCache
+        Where their access tokens come from
+    session : requests.Session, optional
+        Session to send the requests on, its pool should fit the workers
+    workers : int
+        Accounts polled at the same time
+
+    Returns
+    -------
+    tuple
+        (the readings of every account that could be read,
+        account name -> the exception of each that could not)
+    """
+    metrics = []
+    errors = {}
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(workers, len(accounts))),
+        thread_name_prefix="netatmo",
+    ) as executor:
+        futures = {
+            executor.submit(poll_account, account, tokens, session): account
+            for account in accounts
+        }
+        for future in as_completed(futures):
+            account = futures[future]
+            try:
+                metrics.extend(future.result())
+            except Exception as error:  # One account mustn't stop the rest
+                print(f"Netatmo account {account.name} failed: {error!r}")
+                errors[account.name] = error
+    return metrics, errors
+
+
+def write_metrics(
+    metrics: list, timestamp: int, settings: Optional[utilities.Settings] = None
+):
+    """Writes the readings of every account in one go
+
+    Each reading is stamped with the time_utc of the upload it came in, so a
+    reading is one point however often it is polled.
+
+    Parameters
+    ----------
+    metrics : list
+        Readings from collect
+    timestamp : int
+        Epoch milliseconds they were polled, for readings without their own
+        time
+    settings : Settings, optional
+        Defaults to utilities.SETTINGS
+    """
+    settings = settings or utilities.SETTINGS
+    # Epoch milliseconds each reading was taken
+    taken = [int(m["time"] * 1000) if m.get("time") else timestamp for m in metrics]
+    if settings.metrics_push:
+        influx = InfluxDBClient(
+            host=settings.metrics_server,
+            port=8086,
+            database="metrics",
+            timeout=settings.http_read_timeout,
+        )
+        influx.write_points(
+            [
+                netatmo.line_protocol(
+                    m["sensor"],
+                    m["device"],
+                    m["measurement"],
+                    at,
+                    {"account": m["account"]},
+                )
+                for m, at in zip(metrics, taken)
+            ],
+            time_precision="ms",
+            batch_size=10000,
+            protocol="line",
+        )
+
+    readings = {}
+    for metric in metrics:
+        exposition.REGISTRY.set(
+            f"netatmo_{metric['sensor']}",
+            metric["measurement"],
+            {"account": metric["account"], "device": metric["device"]},
+        )
+        devices = readings.setdefault(metric["account"], {})
+        devices.setdefault(metric["device"], {})[metric["sensor"]] = metric[
+            "measurement"
+        ]
+    read_api.SNAPSHOT.merge("readings", "netatmo_accounts", readings)
+
+    # Module names repeat between accounts, e.g. Outdoor
+    qualified = [dict(m, device=f"{m['account']}/{m['device']}") for m in metrics]
+    ring_buffers = RingBufferStore.from_settings(settings)
+    for metric, at in zip(qualified, taken):
+        ring_buffers.append(
+            metric["device"], metric["sensor"], at / 1000, metric["measurement"]
+        )
+    netatmo.archive_metrics(qualified, timestamp / 1000, settings, TABLE)
+
+
+def run(
+    settings: Optional[utilities.Settings] = None,
+    session: Optional[requests.Session] = None,
+) -> dict:
+    """Logs the current readings of every account in netatmo_accounts_file
+
+    Parameters
+    ----------
+    settings : Settings, optional
+        Defaults to utilities.SETTINGS
+    session : requests.Session, optional
+        Session to send the requests on, one sized for the workers is made
+        if not given
+
+    Returns
+    -------
+    dict
+        Account name -> the exception of each account that could not be read
+
+    Raises
+    ------
+    RuntimeError
+        If not a single account could be read.
+    """
+    settings = settings or utilities.SETTINGS
+    if not settings.netatmo_accounts_file:
+        print("No netatmo_accounts_file configured, nothing to poll")
+        return {}
+    accounts = load_accounts(settings.netatmo_accounts_file)
+    tokens = TokenCache.from_settings(settings)
+    timestamp = int(time.time() * 1000)  # milliseconds
+
+    own_session = session is None
+    if own_session:
+        session = utilities.make_session(settings.netatmo_account_workers)
+    try:
+        with profiling.phase("fetch"):
+            metrics, errors = collect(
+                accounts, tokens, session, settings.netatmo_account_workers
+            )
+            print(f"Read {len(accounts) - len(errors)} of {len(accounts)} accounts")
+    finally:
+        tokens.save()
+        if own_session:
+            session.close()
+
+    if accounts and len(errors) == len(accounts):
+        raise RuntimeError("None of the Netatmo accounts could be read")
+    with profiling.phase("write"):
+        write_metrics(metrics, timestamp, settings)
+    return errors
@@ -0,0 +1,288 @@
+"""Profiling support for the entry scripts.
+
+Any of the top level scripts can be profiled without editing them, either by
+setting ``profile_enabled=true`` in the environment or by running the script
+through this module::
+
+    python3 -m home_automation.profiling --profile /app/log_netatmo.py
+
+The job runs under cProfile (and optionally tracemalloc). Threads started
+while profiling, like the pools the jobs run on, get a profiler of their own
+that is merged into the results. When it finishes the raw pstats and a top-N
+summary are written to ``profile_dir`` and a table of wall time, CPU time and
+peak memory per phase is printed. The memory peak is process wide, so it is
+only reported for phases that ran alone, phases that overlapped another, like
+the jobs run by run-all, show "-" and the total row has the peak RSS of the
+whole process. Scripts and modules
+mark their phases with :func:`phase`, which costs next to nothing when
+profiling is off.
+"""
+
+import argparse
+import atexit
+import cProfile
+import io
+import os
+import pstats
+import resource
+import runpy
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Optional
+
+from pydantic_settings import BaseSettings
+from tabulate import tabulate
+
+
+class ProfileSettings(BaseSettings):
+    """Profiling options, read from the environment
+
+    These are kept apart from ``utilities.Settings`` so that profiling can be
+    switched on before anything else (including the credentials) is loaded.
+
+    Attributes
+    ----------
+    profile_enabled: bool
+        Run the job under cProfile.
+    profile_dir: str
+        Directory the pstats and summary files are written to.
+    profile_top: int
+        Number of functions listed in the summary.
+    profile_memory: bool
+        Also trace allocations with tracemalloc, giving true per phase peak
+        memory at the cost of a slower run.
+    """
+
+    profile_enabled: bool = False
+    profile_dir: str = "/tmp/profiles"
+    profile_top: int = 25
+    profile_memory: bool = False
+
+
+class _Profiler:
+    """Holds the state of one profiling session"""
+
+    def __init__(self, name: str, settings: ProfileSettings):
+        """Set up a session writing files prefixed with name"""
+        self.name = name
+        self.settings = settings
+        self.phases = {}  # name -> [wall, cpu, peak bytes or None]
+        self.lock = threading.Lock()  # Jobs may record from several threads
+        self.active = 0  # Phases running right now
+        self.overlaps = 0  # Phases started while another was running
+        self.profile = cProfile.Profile()
+        self.thread_profiles = []
+        self.started = time.strftime("%Y%m%d-%H%M%S")
+
+    def start(self):
+        """Begin collecting"""
+        if self.settings.profile_memory:
+            tracemalloc.start()
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        threading.setprofile(self._profile_thread)
+        self.profile.enable()
+
+    def _profile_thread(self, frame, event, arg):
+        """Set in new threads by threading.setprofile, replaces itself with a
+        profiler of the thread's own on the first call
+        """
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # The main profiler already sees every thread
+            sys.setprofile(None)
+            return
+        with self.lock:
+            self.thread_profiles.append(profile)
+
+    def enter(self) -> Optional[int]:
+        """Marks a phase as running, returns the overlap count if it is alone
+        and None if another phase is already running"""
+        with self.lock:
+            self.active += 1
+            if self.active > 1:
+                self.overlaps += 1
+                return None
+            if tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+            return self.overlaps
+
+    def leave(self, entered: Optional[int]) -> Optional[int]:
+        """Marks a phase as done, returns its peak memory if no other phase
+        ran alongside it, else None"""
+        with self.lock:
+            self.active -= 1
+            if entered is None or entered != self.overlaps:
+                return None
+            return _peak_memory()
+
+    def record(self, name: str, wall: float, cpu: float, peak: Optional[int]):
+        """Add a measurement to a phase, repeated phases are summed and the
+        peak is the largest of the runs that had one"""
+        with self.lock:
+            totals = self.phases.setdefault(name, [0.0, 0.0, None])
+            totals[0] += wall
+            totals[1] += cpu
+            if peak is not None:
+                totals[2] = max(totals[2] or 0, peak)
+
+    def stop(self) -> str:
+        """Stop collecting, write the results and return the summary"""
+        threading.setprofile(None)
+        self.profile.disable()
+        self.record(
+            "total",
+            time.perf_counter() - self.wall,
+            time.process_time() - self.cpu,
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        )
+        if self.settings.profile_memory:
+            tracemalloc.stop()
+
+        os.makedirs(self.settings.profile_dir, exist_ok=True)
+        base = os.path.join(self.settings.profile_dir, f"{self.name}-{self.started}")
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=stream)
+        with self.lock:
+            for profile in self.thread_profiles:
+                stats.add(profile)
+        stats.dump_stats(base + ".pstats")
+        stats.sort_stats("cumulative").print_stats(self.settings.profile_top)
+
+        rows = [
+            [
+                name,
+                f"{wall:.3f}",
+                f"{cpu:.3f}",
+                "-" if peak is None else f"{peak / 2**20:.1f}",
+            ]
+            for name, (wall, cpu, peak) in self.phases.items()
+        ]
+        table = tabulate(
+            rows, headers=["Phase", "Wall (s)", "CPU (s)", "Peak mem (MiB)"]
+        )
+        summary = f"{table}\n\n{stream.getvalue()}"
+        with open(base + ".txt", "w") as out:
+            out.write(summary)
+        return f"{table}\n\nProfile written to {base}.pstats"
+
+
+_profiler: Optional[_Profiler] = None
+
+
+def _peak_memory() -> int:
+    """Peak memory in bytes, per phase with tracemalloc, else the process max RSS"""
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[1]
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _run_as_main() -> bool:
+    """True when this module is the entry point, run with python3 -m"""
+    spec = getattr(sys.modules.get("__main__"), "__spec__", None)
+    return spec is not None and spec.name == __name__
+
+
+def start(name: Optional[str] = None, settings: Optional[ProfileSettings] = None):
+    """Start profiling this process, does nothing if it is already running
+
+    Parameters
+    ----------
+    name : str, optional
+        Prefix for the output files, defaults to the running script's name.
+    settings : ProfileSettings, optional
+        Overrides the settings read from the environment.
+    """
+    global _profiler
+    if _profiler is not None:
+        return
+    if name is None:
+        name = os.path.splitext(os.path.basename(sys.argv[0]))[0] or "python"
+    _profiler = _Profiler(name, settings or ProfileSettings())
+    _profiler.start()
+
+
+def stop():
+    """Stop profiling and print the per phase summary"""
+    global _profiler
+    if _profiler is None:
+        return
+    profiler, _profiler = _profiler, None
+    print(profiler.stop())
+
+
+@contextmanager
+def phase(name: str):
+    """Time a phase of the job (imports, fetch, compute, write...)
+
+    The memory peak is reset on entry when no other phase is running, and
+    only recorded if none started before this one finished, tracemalloc and
+    the RSS can't tell concurrent phases apart.
+
+    Parameters
+    ----------
+    name : str
+        The name of the phase, repeated names are added together.
+    """
+    profiler = _profiler
+    if profiler is None:
+        yield
+        return
+    entered = profiler.enter()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        profiler.record(name, wall, cpu, profiler.leave(entered))
+
+
+def main(argv=None):
+    """Run a script, under the profiler when --profile is given
+
+    Parameters
+    ----------
+    argv : list, optional
+        Command line arguments, defaults to sys.argv[1:]
+    """
+    settings = ProfileSettings()
+    parser = argparse.ArgumentParser(prog="python3 -m home_automation.profiling")
+    parser.add_argument(
+        "--profile", action="store_true", default=settings.profile_enabled
+    )
+    parser.add_argument("--memory", action="store_true", default=None)
+    parser.add_argument("--profile-dir", default=settings.profile_dir)
+    parser.add_argument("--top", type=int, default=settings.profile_top)
+    parser.add_argument("script")
+    parser.add_argument("args", nargs=argparse.REMAINDER)
+    args = parser.parse_args(argv)
+
+    sys.argv = [args.script] + args.args
+    if args.profile:
+        settings.profile_dir = args.profile_dir
+        settings.profile_top = args.top
+        if args.memory is not None:
+            settings.profile_memory = args.memory
+        start(settings=settings)
+    try:
+        runpy.run_path(args.script, run_name="__main__")
+    finally:
+        stop()
+
+
+if __name__ == "__main__":
+    # Hand over to the imported module so the script shares our profiler
+    from home_automation.profiling import main as _main
+
+    _main()
+elif ProfileSettings().profile_enabled and not _run_as_main():
+    # Under python3 -m home_automation.profiling main() starts the session,
+    # with the command line options
+    start()
+    atexit.register(stop)
@@ -0,0 +1,147 @@
+"""Token bucket rate limiting for the metered APIs, shared between processes
+
+Tomorrow.io and Netatmo both have hourly quotas. Each API key gets a token
+bucket that holds up to the hourly quota and refills continuously. The
+buckets live in a SQLite database in the state directory, and every update
+happens inside an immediate transaction, so overlapping Jobs and retries
+draw from the same budget instead of each assuming they have it all.
+"""
+
+import hashlib
+import math
+import os
+import sqlite3
+import time
+from typing import Callable, Optional
+
+import requests
+
+
+class RateLimited(requests.exceptions.RequestException):
+    """The API's budget is spent and waiting for it would take too long"""
+
+
+class TokenBucketLimiter:
+    """Token buckets per API key, persisted in SQLite
+
+    Parameters
+    ----------
+    path : str
+        The SQLite database file, shared by every process using the limiter.
+    buckets : dict
+        Maps an API name to (capacity, tokens refilled per second).
+    report : callable, optional
+        Called with (api, tokens remaining) after every request is granted,
+        e.g. to send the budget to the metrics server.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        buckets: dict,
+        report: Optional[Callable[[str, float], None]] = None,
+    ):
+        """Set up the limiter, the database is created on first use"""
+        self.path = path
+        self.buckets = buckets
+        self.report = report
+        self._created = False
+
+    def _connect(self) -> sqlite3.Connection:
+        """Opens the database, creating the table the first time"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        if not self._created:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS buckets "
+                "(key TEXT PRIMARY KEY, tokens REAL, updated REAL)"
+            )
+            self._created = True
+        return connection
+
+    @staticmethod
+    def key(api: str, api_key: str) -> str:
+        """The bucket name for an API key, without storing the key itself"""
+        digest = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+        return f"{api}:{digest}"
+
+    def _take(self, api: str, api_key: str, tokens: float, now: float) -> tuple:
+        """Takes tokens if there are enough
+
+        Returns
+        -------
+        tuple
+            (granted, seconds until enough tokens, tokens left), the wait
+            is infinite when the bucket doesn't refill
+        """
+        capacity, rate = self.buckets[api]
+        key = self.key(api, api_key)
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT tokens, updated FROM buckets WHERE key = ?", (key,)
+            ).fetchone()
+            level = capacity
+            if row is not None:
+                level = min(capacity, row[0] + max(now - row[1], 0) * rate)
+            granted = level >= tokens
+            if granted:
+                level -= tokens
+            connection.execute(
+                "INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)", (key, level, now)
+            )
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+        if granted:
+            wait = 0.0
+        elif rate > 0:
+            wait = (tokens - level) / rate
+        else:
+            wait = math.inf
+        return granted, wait, level
+
+    def remaining(self, api: str, api_key: str) -> float:
+        """Tokens currently available for an API key"""
+        return self._take(api, api_key, 0, time.time())[2]
+
+    def acquire(
+        self,
+        api: str,
+        api_key: str,
+        tokens: float = 1,
+        max_wait: Optional[float] = None,
+    ) -> bool:
+        """Takes tokens for a request, waiting for the bucket to refill
+
+        Parameters
+        ----------
+        api : str
+            The API being called, a key of buckets.
+        api_key : str
+            The API key or client id the quota belongs to.
+        tokens : float
+            Tokens the request costs.
+        max_wait : float, optional
+            Longest to wait for tokens, None waits as long as needed.
+
+        Returns
+        -------
+        bool
+            True when the request may go ahead, False if it would have to
+            wait longer than max_wait, or forever because the bucket has no
+            refill rate.
+        """
+        waited = 0.0
+        while True:
+            granted, wait, level = self._take(api, api_key, tokens, time.time())
+            if granted:
+                if self.report:
+                    self.report(api, level)
+                return True
+            if math.isinf(wait) or (max_wait is not None and waited + wait > max_wait):
+                return False
+            print(f"{api} budget spent, waiting {wait:.1f} seconds")
+            time.sleep(wait)
+            waited += wait
@@ -0,0 +1,244 @@
+"""A read-only JSON API of the latest results, served from memory
+
+Dashboards used to re-run the sprinkler calculation, and so call Tomorrow.io,
+just to show the current multiplier. Instead the jobs publish what they
+computed to :data:`SNAPSHOT` and this API serves it::
+
+    GET /api                 the sections and their ETags
+    GET /api/multiplier      the last sprinkler multiplier and its inputs
+    GET /api/forecast        the daily forecast it was calculated from
+    GET /api/readings        the latest Netatmo and Indigo readings
+
+A section is encoded once when a job publishes it, with an ETag of its
+content, so a request is a dict lookup and never reaches an upstream API.
+Clients that send If-None-Match get a 304 until the content changes.
+
+Jobs that run in another process, the daily sprinkler run, also
+:func:`persist` their sections to :data:`PERSISTED_FILE` in the state_dir,
+and ``serve`` loads them into its snapshot before every run.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from home_automation import state
+
+CONTENT_TYPE = "application/json"
+
+# Sections persisted for other processes to serve, in the state_dir
+PERSISTED_FILE = "read_api.json"
+
+
+class Snapshot:
+    """The latest published sections, each kept encoded with its ETag"""
+
+    def __init__(self):
+        """Set up an empty snapshot"""
+        self._lock = threading.Lock()
+        self._data = {}  # section -> the published data, for merge
+        self._encoded = {}  # section -> (body, etag)
+
+    def update(self, section: str, data, now: Optional[float] = None) -> bool:
+        """Publishes a section, replacing what it held
+
+        Parameters
+        ----------
+        section : str
+            The section, served at /api/<section>
+        data : Any
+            Anything json can encode, dates and other objects become strings
+        now : float, optional
+            When it was computed, defaults to time.time()
+
+        Returns
+        -------
+        bool
+            True if the content changed
+        """
+        content, etag = self._encode(data)
+        with self._lock:
+            return self._store(section, data, content, etag, now)
+
+    @staticmethod
+    def _encode(data) -> tuple:
+        """The JSON content of a section and its ETag"""
+        content = json.dumps(data, default=str, sort_keys=True)
+        return content, '"' + hashlib.sha1(content.encode("utf-8")).hexdigest() + '"'
+
+    def _store(
+        self, section: str, data, content: str, etag: str, now: Optional[float]
+    ) -> bool:
+        """Publishes encoded content, the lock must be held"""
+        if section in self._encoded and self._encoded[section][1] == etag:
+            return False  # Unchanged, clients keep their cached copy
+        updated = time.time() if now is None else now
+        body = f'{{"updated": {updated}, "data": {content}}}'.encode("utf-8")
+        self._data[section] = data
+        self._encoded[section] = (body, etag)
+        return True
+
+    def merge(self, section: str, key: str, data, now: Optional[float] = None):
+        """Publishes one part of a section, keeping the parts other jobs set
+
+        Parameters
+        ----------
+        section : str
+            The section, e.g. readings
+        key : str
+            The part, e.g. netatmo
+        data : Any
+            The part's content
+        now : float, optional
+            When it was computed, defaults to time.time()
+
+        Returns
+        -------
+        bool
+            True if the content changed
+        """
+        # Read, merge and publish under one lock, or concurrent merges of
+        # different parts would lose each other's
+        with self._lock:
+            merged = dict(self._data.get(section) or {}, **{key: data})
+            return self._store(section, merged, *self._encode(merged), now)
+
+    def load(self, path: str) -> dict:
+        """Publishes the sections another process persisted
+
+        Parameters
+        ----------
+        path : str
+            The file written by :func:`persist`
+
+        Returns
+        -------
+        dict
+            Section -> data of every section in the file, changed or not
+        """
+        sections = {}
+        for section, saved in state.load_json(path, {}).items():
+            self.update(section, saved["data"], now=saved["updated"])
+            sections[section] = saved["data"]
+        return sections
+
+    def get(self, section: str) -> Optional[tuple]:
+        """The encoded body and ETag of a section, None if never published"""
+        return self._encoded.get(section)
+
+    def index(self) -> tuple:
+        """The encoded list of sections with their ETags, and its own ETag"""
+        with self._lock:
+            sections = {name: etag for name, (_, etag) in self._encoded.items()}
+        content = json.dumps({"sections": sections}, sort_keys=True)
+        etag = '"' + hashlib.sha1(content.encode("utf-8")).hexdigest() + '"'
+        return content.encode("utf-8"), etag
+
+
+# The snapshot the jobs publish to
+SNAPSHOT = Snapshot()
+
+
+def persist(state_dir: str, sections: dict, now: Optional[float] = None) -> bool:
+    """Saves sections for ``serve`` in another process to publish
+
+    Sections already in the file that are not given are kept.
+
+    Parameters
+    ----------
+    state_dir : str
+        The state_dir shared with the serving process
+    sections : dict
+        Section -> data, anything json can encode
+    now : float, optional
+        When they were computed, defaults to time.time()
+
+    Returns
+    -------
+    bool
+        True if the file was written
+    """
+    path = os.path.join(state_dir, PERSISTED_FILE)
+    updated = time.time() if now is None else now
+    saved = state.load_json(path, {})
+    for section, data in sections.items():
+        saved[section] = {"updated": updated, "data": data}
+    return state.save_json(path, saved)
+
+
+class _ApiHandler(BaseHTTPRequestHandler):
+    """Answers GET and HEAD requests from the snapshot"""
+
+    protocol_version = "HTTP/1.1"  # Keep alive, dashboards poll
+    disable_nagle_algorithm = True  # Headers and body are separate writes
+    snapshot = SNAPSHOT
+
+    def _respond(self, send_body: bool):
+        """Sends a section, a 304 if the client has it, or a 404"""
+        path = self.path.split("?")[0].rstrip("/")
+        if path == "/api":
+            found = self.snapshot.index()
+        elif path.startswith("/api/"):
+            found = self.snapshot.get(path[len("/api/") :])
+        else:
+            found = None
+        if found is None:
+            self.send_error(404)
+            return
+        body, etag = found
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag in self.headers.get("If-None-Match", ""):
+            self.send_response(304)
+            headers["Content-Length"] = "0"
+            body = b""
+        else:
+            self.send_response(200)
+            headers["Content-Type"] = CONTENT_TYPE
+            headers["Content-Length"] = str(len(body))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if send_body and body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        """Serves a section"""
+        self._respond(send_body=True)
+
+    def do_HEAD(self):
+        """Serves a section's headers"""
+        self._respond(send_body=False)
+
+    def log_message(self, format, *args):
+        """Dashboards poll too often to log every request"""
+
+
+def start_server(
+    port: int, host: str = "", snapshot: Optional[Snapshot] = None
+) -> ThreadingHTTPServer:
+    """Serves a snapshot on a background thread
+
+    Parameters
+    ----------
+    port : int
+        Port to listen on, 0 picks a free one
+    host : str
+        Address to listen on, "" for all of them
+    snapshot : Snapshot, optional
+        Defaults to SNAPSHOT
+
+    Returns
+    -------
+    ThreadingHTTPServer
+        The running server, shutdown() stops it
+    """
+    handler = type("ApiHandler", (_ApiHandler,), {"snapshot": snapshot or SNAPSHOT})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="read-api", daemon=True).start()
+    print(f"Serving the read API on port {server.server_address[1]}")
+    return server
@@ -0,0 +1,298 @@
+"""Timeouts, a per job deadline and circuit breakers for outbound calls
+
+Every HTTP call goes through :func:`call`, which
+
+* adds a (connect, read) timeout for the endpoint, shortened so the call
+  cannot outlive the job's deadline when one has been started,
+* refuses to call an endpoint whose circuit breaker is open, so a dead server
+  fails fast instead of stalling every job behind it,
+* records the outcome in the breaker, which lets one probe through after
+  ``reset_timeout`` seconds to check for recovery.
+
+Breaker state is persisted so that the next Job run also fails fast.
+"""
+
+import contextlib
+import fcntl
+import os
+import time
+from typing import Callable, Optional
+
+import requests
+
+from home_automation import state
+
+# (connect, read) timeouts in seconds per endpoint
+ENDPOINT_TIMEOUTS = {
+    "indigo": (3.05, 10),
+    "magic_mirror": (3.05, 5),
+    "netatmo": (3.05, 20),
+    "tomorrow_io": (3.05, 20),
+}
+
+# Responses that say the server, rather than the request, is in trouble
+SERVER_ERRORS = (500, 502, 503, 504)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """The endpoint has failed repeatedly and is not being called"""
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """The job has run out of time for outbound calls"""
+
+
+class CircuitBreaker:
+    """Tracks the health of one endpoint
+
+    Parameters
+    ----------
+    failure_threshold : int
+        Consecutive failures that open the breaker.
+    reset_timeout : float
+        Seconds an open breaker waits before letting a probe through.
+    failures : int
+        Consecutive failures so far, when restoring saved state.
+    opened_at : float, optional
+        Epoch time the breaker opened, when restoring saved state.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 3,
+        reset_timeout: float = 60,
+        failures: int = 0,
+        opened_at: Optional[float] = None,
+    ):
+        """Set up a closed breaker, or restore a saved one"""
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = failures
+        self.opened_at = opened_at
+
+    @property
+    def is_open(self) -> bool:
+        """True while calls are being refused"""
+        return self.opened_at is not None
+
+    def allow(self, now: Optional[float] = None) -> bool:
+        """Checks if a call may go ahead
+
+        Once the reset timeout has passed a single call is let through as a
+        probe, the next one waits for another reset timeout.
+        """
+        if self.opened_at is None:
+            return True
+        now = time.time() if now is None else now
+        if now - self.opened_at >= self.reset_timeout:
+            self.opened_at = now
+            return True
+        return False
+
+    def record_success(self) -> bool:
+        """Closes the breaker, returns True if its state changed"""
+        changed = self.failures > 0 or self.opened_at is not None
+        self.failures = 0
+        self.opened_at = None
+        return changed
+
+    def record_failure(self, now: Optional[float] = None) -> bool:
+        """Counts a failure, opening the breaker at the threshold"""
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.time() if now is None else now
+        return True
+
+
+@contextlib.contextmanager
+def _locked(path: str):
+    """Holds an exclusive lock on a file next to path, across processes"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class BreakerRegistry:
+    """The circuit breakers for every endpoint, optionally persisted
+
+    Parameters
+    ----------
+    path : str, optional
+        JSON file the breaker state is kept in, None keeps it in memory.
+    failure_threshold : int
+        Consecutive failures that open a breaker.
+    reset_timeout : float
+        Seconds an open breaker waits before probing.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        failure_threshold: int = 3,
+        reset_timeout: float = 60,
+    ):
+        """Set up the registry, saved state is read on first use"""
+        self.path = path
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = None
+
+    def get(self, endpoint: str) -> CircuitBreaker:
+        """The breaker for an endpoint"""
+        if self._breakers is None:
+            saved = state.load_json(self.path, {}) if self.path else {}
+            self._breakers = {
+                name: CircuitBreaker(
+                    self.failure_threshold, self.reset_timeout, **values
+                )
+                for name, values in saved.items()
+            }
+        if endpoint not in self._breakers:
+            self._breakers[endpoint] = CircuitBreaker(
+                self.failure_threshold, self.reset_timeout
+            )
+        return self._breakers[endpoint]
+
+    def save(self, endpoint: Optional[str] = None):
+        """Persists breaker state, keeping what other processes saved
+
+        The file is read, updated and written under a lock, and only the
+        given breaker replaces its saved entry, so processes sharing the file
+        don't overwrite each other's breakers.
+
+        Parameters
+        ----------
+        endpoint : str, optional
+            The breaker whose state changed, None saves every breaker.
+        """
+        if not self.path or self._breakers is None:
+            return
+        names = list(self._breakers) if endpoint is None else [endpoint]
+        with _locked(self.path):
+            saved = state.load_json(self.path, {})
+            for name in names:
+                breaker = self._breakers[name]
+                saved[name] = {
+                    "failures": breaker.failures,
+                    "opened_at": breaker.opened_at,
+                }
+            state.save_json(self.path, saved)
+
+
+BREAKERS = BreakerRegistry()
+DEFAULT_TIMEOUT = (3.05, 15)
+_deadline: Optional[float] = None  # time.monotonic() the job must finish by
+
+
+def configure(
+    path: Optional[str] = None,
+    failure_threshold: int = 3,
+    reset_timeout: float = 60,
+    connect_timeout: float = 3.05,
+    read_timeout: float = 15,
+):
+    """Sets up the breakers and the timeout for endpoints without their own
+
+    Parameters
+    ----------
+    path : str, optional
+        JSON file the breaker state is persisted to.
+    failure_threshold : int
+        Consecutive failures that open a breaker.
+    reset_timeout : float
+        Seconds an open breaker waits before probing.
+    connect_timeout : float
+        Default connect timeout in seconds.
+    read_timeout : float
+        Default read timeout in seconds.
+    """
+    global BREAKERS, DEFAULT_TIMEOUT
+    BREAKERS = BreakerRegistry(path, failure_threshold, reset_timeout)
+    DEFAULT_TIMEOUT = (connect_timeout, read_timeout)
+
+
+def start_deadline(seconds: Optional[float]):
+    """Starts the job's deadline, every later call has to finish within it
+
+    Parameters
+    ----------
+    seconds : float, optional
+        Time the job has from now, None or 0 removes the deadline.
+    """
+    global _deadline
+    _deadline = time.monotonic() + seconds if seconds else None
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the job's deadline, None if there is no deadline"""
+    if _deadline is None:
+        return None
+    return _deadline - time.monotonic()
+
+
+def timeout_for(endpoint: str) -> tuple:
+    """The (connect, read) timeout for an endpoint, within the deadline
+
+    Raises
+    ------
+    DeadlineExceeded
+        If the job's deadline has already passed.
+    """
+    connect, read = ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT)
+    left = remaining()
+    if left is None:
+        return connect, read
+    if left <= 0:
+        raise DeadlineExceeded(f"Job deadline passed, not calling {endpoint}")
+    return min(connect, left), min(read, left)
+
+
+def call(endpoint: str, func: Callable, *args, **kwargs) -> requests.Response:
+    """Makes an HTTP call with a timeout, guarded by the endpoint's breaker
+
+    Parameters
+    ----------
+    endpoint : str
+        Name of the service being called, e.g. indigo
+    func : callable
+        The requests function or session method to call, e.g. requests.post
+    *args, **kwargs
+        Passed on to func, a timeout is added unless one is given
+
+    Returns
+    -------
+    requests.Response
+        The response, server errors are returned as well as counted
+
+    Raises
+    ------
+    CircuitOpenError
+        If the endpoint's breaker is open.
+    DeadlineExceeded
+        If the job's deadline has passed.
+    requests.exceptions.RequestException
+        If the call itself fails.
+    """
+    breaker = BREAKERS.get(endpoint)
+    if not breaker.allow():
+        raise CircuitOpenError(f"Circuit open for {endpoint}, not calling it")
+    kwargs.setdefault("timeout", timeout_for(endpoint))
+
+    try:
+        response = func(*args, **kwargs)
+    except requests.exceptions.RequestException:
+        breaker.record_failure()
+        BREAKERS.save(endpoint)
+        raise
+
+    if response.status_code in SERVER_ERRORS:
+        changed = breaker.record_failure()
+    else:
+        changed = breaker.record_success()
+    if changed:
+        BREAKERS.save(endpoint)
+    return response
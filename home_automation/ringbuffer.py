@@ -0,0 +1,251 @@
+"""Fixed size, memory mapped ring buffers of recent sensor readings
+
+Every sensor gets a pair of files in the store directory: a NumPy ``.npy``
+array of (time, value) records and a one element counter of how many readings
+have ever been appended. Appends overwrite the oldest record, so a buffer
+never grows, and windowed statistics are computed over the whole array at
+once. Because the files are memory mapped any process can read the latest
+history without asking InfluxDB or Netatmo again.
+"""
+
+import os
+import re
+import time
+from typing import Optional
+
+import numpy as np
+
+from home_automation.derived import dew_point
+
+RECORD = np.dtype([("time", "<f8"), ("value", "<f8")])
+
+STATISTICS = {
+    "min": np.min,
+    "max": np.max,
+    "mean": np.mean,
+    "sum": np.sum,
+}
+
+
+class RingBuffer:
+    """A memory mapped ring buffer of timestamped readings for one sensor
+
+    Parameters
+    ----------
+    path : str
+        The path of the buffer, without extension.
+    capacity : int
+        Number of readings kept when the buffer is created. An existing
+        buffer keeps its own capacity.
+    """
+
+    def __init__(self, path: str, capacity: int = 4096):
+        """Open the buffer at path, creating it if needed"""
+        data_path = path + ".npy"
+        count_path = path + ".count.npy"
+        if os.path.exists(data_path) and os.path.exists(count_path):
+            self._data = np.lib.format.open_memmap(data_path, mode="r+")
+            self._count = np.lib.format.open_memmap(count_path, mode="r+")
+        else:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._data = np.lib.format.open_memmap(
+                data_path, mode="w+", dtype=RECORD, shape=(capacity,)
+            )
+            self._count = np.lib.format.open_memmap(
+                count_path, mode="w+", dtype="<i8", shape=(1,)
+            )
+        self.capacity = len(self._data)
+
+    def __len__(self) -> int:
+        """Number of readings held, at most the capacity"""
+        return int(min(self._count[0], self.capacity))
+
+    def append(self, timestamp: float, value: float):
+        """Adds a reading, replacing the oldest once the buffer is full
+
+        Parameters
+        ----------
+        timestamp : float
+            Epoch seconds of the reading.
+        value : float
+            The reading.
+        """
+        count = int(self._count[0])
+        self._data[count % self.capacity] = (timestamp, value)
+        self._count[0] = count + 1
+
+    def latest(self) -> Optional[tuple]:
+        """The most recent (timestamp, value), None if the buffer is empty"""
+        count = int(self._count[0])
+        if count == 0:
+            return None
+        record = self._data[(count - 1) % self.capacity]
+        return float(record["time"]), float(record["value"])
+
+    def window(self, seconds: float, now: Optional[float] = None) -> tuple:
+        """Readings from the last number of seconds, oldest first
+
+        Parameters
+        ----------
+        seconds : float
+            Length of the window.
+        now : float, optional
+            End of the window in epoch seconds, defaults to time.time().
+
+        Returns
+        -------
+        tuple
+            Arrays of timestamps and values.
+        """
+        now = time.time() if now is None else now
+        data = self._data[: len(self)]
+        selected = data[(data["time"] > now - seconds) & (data["time"] <= now)]
+        selected = np.sort(selected, order="time")
+        return selected["time"], selected["value"]
+
+    def aggregate(
+        self, statistic: str, seconds: float, now: Optional[float] = None
+    ) -> Optional[float]:
+        """A statistic over a window, e.g. the 24 hour maximum
+
+        Parameters
+        ----------
+        statistic : str
+            One of min, max, mean or sum.
+        seconds : float
+            Length of the window.
+        now : float, optional
+            End of the window in epoch seconds, defaults to time.time().
+
+        Returns
+        -------
+        float
+            The statistic, None if there are no readings in the window.
+        """
+        now = time.time() if now is None else now
+        data = self._data[: len(self)]
+        values = data["value"][(data["time"] > now - seconds) & (data["time"] <= now)]
+        if len(values) == 0:
+            return None
+        return float(STATISTICS[statistic](values))
+
+
+class RingBufferStore:
+    """A directory of ring buffers, one per device and sensor
+
+    Parameters
+    ----------
+    directory : str
+        Where the buffer files are kept.
+    capacity : int
+        Capacity of newly created buffers.
+    """
+
+    def __init__(self, directory: str, capacity: int = 4096):
+        """Set up a store, buffers are opened on first use"""
+        self.directory = directory
+        self.capacity = capacity
+        self._buffers = {}
+
+    @classmethod
+    def from_settings(cls, settings) -> "RingBufferStore":
+        """The store configured by Settings, kept under state_dir"""
+        return cls(
+            os.path.join(settings.state_dir, "ringbuffers"),
+            settings.ringbuffer_capacity,
+        )
+
+    def buffer(self, device: str, sensor: str) -> RingBuffer:
+        """The buffer for a device's sensor, created if it doesn't exist"""
+        key = (device, sensor)
+        if key not in self._buffers:
+            name = re.sub(r"[^A-Za-z0-9_-]", "_", f"{device}.{sensor}")
+            self._buffers[key] = RingBuffer(
+                os.path.join(self.directory, name), self.capacity
+            )
+        return self._buffers[key]
+
+    def append(self, device: str, sensor: str, timestamp: float, value) -> bool:
+        """Adds a reading, non numeric values are ignored
+
+        Parameters
+        ----------
+        device : str
+            The device name
+        sensor : str
+            The sensor name
+        timestamp : float
+            Epoch seconds of the reading
+        value : Any
+            The reading, anything float() accepts
+
+        Returns
+        -------
+        bool
+            True if the reading was stored
+        """
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return False
+        self.buffer(device, sensor).append(timestamp, value)
+        return True
+
+    def aggregate(
+        self,
+        device: str,
+        sensor: str,
+        statistic: str,
+        seconds: float,
+        now: Optional[float] = None,
+    ) -> Optional[float]:
+        """A statistic over a window for a device's sensor
+
+        See RingBuffer.aggregate for the parameters.
+        """
+        return self.buffer(device, sensor).aggregate(statistic, seconds, now)
+
+    def dew_point(
+        self,
+        device: str,
+        seconds: float,
+        temperature: str = "Temperature",
+        humidity: str = "Humidity",
+        fahrenheit: bool = True,
+        now: Optional[float] = None,
+    ) -> tuple:
+        """Dew point series from readings taken at the same time
+
+        Parameters
+        ----------
+        device : str
+            The device with both sensors
+        seconds : float
+            Length of the window
+        temperature : str
+            Name of the temperature sensor
+        humidity : str
+            Name of the humidity sensor
+        fahrenheit : bool
+            The temperatures are stored, and the dew point returned, in
+            fahrenheit
+        now : float, optional
+            End of the window in epoch seconds, defaults to time.time()
+
+        Returns
+        -------
+        tuple
+            Arrays of timestamps and dew points
+        """
+        temp_times, temps = self.buffer(device, temperature).window(seconds, now)
+        hum_times, hums = self.buffer(device, humidity).window(seconds, now)
+        times, temp_index, hum_index = np.intersect1d(
+            temp_times, hum_times, return_indices=True
+        )
+        temps = temps[temp_index]
+        if fahrenheit:
+            temps = (temps - 32) * 5 / 9
+        points = dew_point(temps, hums[hum_index])
+        if fahrenheit:
+            points = points * 9 / 5 + 32
+        return times, points
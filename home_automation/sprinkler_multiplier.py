@@ -2,8 +2,11 @@
 
 import inspect
 import json
+import os
 import sys
 import tempfile
+import time
+from concurrent.futures import Executor
 from email.message import EmailMessage
 from email.utils import make_msgid
 from typing import Any, Optional
@@ -16,9 +19,128 @@ import requests
 from pydantic import BaseModel, PrivateAttr
 from tabulate import tabulate
 
-from home_automation import utilities
+from home_automation import (
+    columnar,
+    evapotranspiration,
+    exposition,
+    profiling,
+    read_api,
+    resilience,
+    state,
+    utilities,
+)
+from home_automation.stages import StageGraph
+
+# Shared with every other job in the process
+settings = utilities.SETTINGS
+
+
+def archive_forecast(
+    table: str,
+    intervals: list,
+    issued: Optional[float] = None,
+    settings: Optional[utilities.Settings] = None,
+):
+    """Keeps a forecast in the local columnar store
+
+    Every field of the forecast becomes a column, alongside the time the
+    forecast is for and the time it was issued, so forecasts can later be
+    compared with what actually happened.
+
+    Parameters
+    ----------
+    table : str
+        The table to append to, e.g. forecast_daily
+    intervals : list
+        The Tomorrow.io timeline intervals
+    issued : float, optional
+        Epoch seconds the forecast was fetched, defaults to now
+    settings : Settings, optional
+        Where the store lives, defaults to the shared utilities.SETTINGS
+    """
+    if not intervals:
+        return
+    settings = settings or utilities.SETTINGS
+    issued = time.time() if issued is None else issued
+    columns = {
+        columnar.TIME: pd.to_datetime(
+            [interval["startTime"] for interval in intervals], utc=True
+        )
+        .as_unit("s")
+        .asi8,
+        "issued": [issued] * len(intervals),
+    }
+    for field in intervals[0]["values"]:
+        values = [interval["values"].get(field) for interval in intervals]
+        columns[field] = [float("nan") if v is None else float(v) for v in values]
+    try:
+        columnar.ColumnStore.from_settings(settings).append(table, columns)
+    except OSError as error:
+        print(f"Unable to archive the {table} forecast: {error}")
+
+
+def archive_multiplier(
+    summary: dict,
+    now: Optional[float] = None,
+    settings: Optional[utilities.Settings] = None,
+):
+    """Keeps a multiplier and what it was decided on in the columnar store
+
+    Parameters
+    ----------
+    summary : dict
+        From sprinkler_multiplier.summary
+    now : float, optional
+        Epoch seconds it was calculated, defaults to now
+    settings : Settings, optional
+        Where the store lives, defaults to the shared utilities.SETTINGS
+    """
+    settings = settings or utilities.SETTINGS
+    columns = {
+        columnar.TIME: [time.time() if now is None else now],
+        "multiplier": [float(summary["multiplier"])],
+        "average_temperature": [float(summary["average_temperature"])],
+        "rain": [float(summary["rain"])],
+        "water_deficit": [float(summary["water_deficit"])],
+    }
+    try:
+        columnar.ColumnStore.from_settings(settings).append("sprinkler", columns)
+    except OSError as error:
+        print(f"Unable to archive the multiplier: {error}")
+
+
+def render_chart(df: pd.DataFrame, path: str) -> str:
+    """Draws the forecast temperature and rain chart
+
+    A plain function of its arguments, so it can run in a worker process.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The daily forecast, indexed by date with Temp and Rain (in) columns
+    path : str
+        Where the png is saved
 
-settings = utilities.Settings()
+    Returns
+    -------
+    str
+        The path of the png
+    """
+    fig, ax1 = plt.subplots()
+    ax1.plot(df.index, df.Temp, marker="o", color="green")
+    ax1.set_ylim(0, 110)
+    ax1.set_ylabel("Temperature (F)", color="green")
+    ax1.legend(["Temp"], loc="upper left")
+    ax1.xaxis.set_major_formatter(mdates.DateFormatter("%m-%d"))
+
+    ax2 = ax1.twinx()
+    ax2.set_ylim(0, 1)
+    ax2.set_ylabel("Rain (in)", color="blue")
+    ax2.bar(df.index, df["Rain (in)"], color="blue")
+    ax2.legend(["Rain"], loc="upper right")
+    fig.savefig(path, format="png")
+    plt.close(fig)
+    return path
 
 
 class sprinkler_multiplier(BaseModel):
@@ -34,6 +156,9 @@ class sprinkler_multiplier(BaseModel):
     api_key: str
         The Tomorrow.io API key, found in the developer console. Set via an
         environment variable: tomorrow_io
+    engine: str
+        "temperature" to decide on the 5 day average temperature, "et" to
+        decide on the evapotranspiration water deficit from the hourly forecast.
     my_report: Any
 
     Methods
@@ -46,15 +171,74 @@ class sprinkler_multiplier(BaseModel):
     my_report_html: str = ""
     location: str = settings.tmrw_location_id
     api_key: str = settings.tomorrow_io_api_key
+    engine: str = settings.sprinkler_engine
     _forecast: dict = PrivateAttr(default_factory=dict)
     _forecast_df: Any = PrivateAttr()
     _forecast_averages: Any = PrivateAttr()
     _forecast_rain: int = PrivateAttr(default=0)  # Default to zero, no rain
     _value: int = PrivateAttr(default=0)  # Default to zero, we don't water
+    _hourly: dict = PrivateAttr(default_factory=dict)
+    _hourly_df: Any = PrivateAttr(default=None)
+    _water_deficit: float = PrivateAttr(default=0.0)  # mm per day
     _chart_png = tempfile.NamedTemporaryFile(
         delete=False
     ).name  # Just the temp filename is all we need
 
+    def _fetch(self, url: str, payload: dict, headers: dict, cache: str) -> dict:
+        """POST to Tomorrow.io and return the decoded forecast
+
+        Requests wait for a token from the shared Tomorrow.io budget. If the
+        budget stays spent for longer than the job can wait, the last
+        forecast of the same kind is served from the cache instead, every
+        successful request refreshes it. Exits if neither is available.
+
+        Parameters
+        ----------
+        url : str
+            The Tomorrow.io endpoint
+        payload : dict
+            The request body
+        headers : dict
+            The request headers
+        cache : str
+            Name of the cache file for this kind of forecast
+
+        Returns
+        -------
+        dict
+            The decoded response
+        """
+        cache_path = os.path.join(settings.state_dir, f"{cache}.json")
+        if not utilities.RATE_LIMITS.acquire(
+            "tomorrow_io", self.api_key, max_wait=resilience.remaining()
+        ):
+            forecast = state.load_json(cache_path)
+            if forecast is not None:
+                print("Tomorrow.io budget spent, using the cached forecast")
+                return forecast
+            print("Get forecast failed, error: Tomorrow.io budget spent")
+            sys.exit(255)
+
+        try:
+            response = resilience.call(
+                "tomorrow_io",
+                requests.request,
+                "POST",
+                url,
+                data=json.dumps(payload),
+                headers=headers,
+            )
+        except requests.exceptions.RequestException as error:
+            print("Get forecast failed, error: ", error)
+            sys.exit(255)
+        if not response.ok:
+            print("Get forecast failed, error: ", response.text)
+            sys.exit(255)
+
+        forecast = response.json()
+        state.save_json(cache_path, forecast)
+        return forecast
+
     # Get latest measurements
     def update_data(self):
         """Retrieve the latest measurements from Tomorrow.io"""
@@ -72,11 +256,10 @@ class sprinkler_multiplier(BaseModel):
             "apikey": self.api_key,
         }
 
-        response = requests.request(
-            "POST", url, data=json.dumps(payload), headers=headers
-        )
-        if response.ok:
-            self._forecast = response.json()
+        with profiling.phase("fetch"):
+            self._forecast = self._fetch(url, payload, headers, "forecast_daily")
+
+        with profiling.phase("compute"):
             self._forecast_df = pd.json_normalize(
                 self._forecast["data"]["timelines"][0]["intervals"]
             )
@@ -98,15 +281,74 @@ class sprinkler_multiplier(BaseModel):
             self._forecast_rain = self._forecast_df[["Rain (in)"]][0:3].sum()[
                 "Rain (in)"
             ]
-        else:
-            print("Get forecast failed, error: ", response.text)
-            sys.exit(255)
+
+    def update_hourly_data(self):
+        """Retrieve the hourly forecast and calculate the water deficit
+
+        The hourly temperature, humidity, wind and solar radiation feed a
+        Penman-Monteith reference evapotranspiration, computed over the whole
+        forecast at once. The deficit is the lawn's demand less the forecast
+        rain, averaged per day.
+        """
+        url = "https://api.tomorrow.io/v4/timelines"
+        payload = {
+            "units": "metric",
+            "location": self.location,
+            "timesteps": ["1h"],
+            "startTime": "now",
+            "endTime": "nowPlus5d",
+            "fields": [
+                "temperature",
+                "humidity",
+                "windSpeed",
+                "solarGHI",
+                "rainAccumulation",
+            ],
+            "timezone": "America/Denver",
+        }
+
+        headers = {
+            "Content-Type": "application/json",
+            "apikey": self.api_key,
+        }
+
+        with profiling.phase("fetch"):
+            self._hourly = self._fetch(url, payload, headers, "forecast_hourly")
+
+        with profiling.phase("compute"):
+            intervals = self._hourly["data"]["timelines"][0]["intervals"]
+            self._hourly_df = pd.DataFrame(
+                [interval["values"] for interval in intervals],
+                index=pd.to_datetime([interval["startTime"] for interval in intervals]),
+            )
+            timestamps = self._hourly_df.index.as_unit("s").asi8
+            et0 = evapotranspiration.reference_et(
+                self._hourly_df["temperature"].to_numpy(),
+                self._hourly_df["humidity"].to_numpy(),
+                evapotranspiration.wind_at_2m(self._hourly_df["windSpeed"].to_numpy()),
+                self._hourly_df["solarGHI"].to_numpy(),
+                timestamps,
+                settings.latitude,
+                settings.longitude,
+                settings.elevation,
+            )
+            self._hourly_df["ET0 (mm)"] = et0
+            deficit = evapotranspiration.water_deficit(
+                et0, self._hourly_df["rainAccumulation"].to_numpy()
+            )
+            self._water_deficit = float(deficit) / max(len(et0) / 24, 1)
 
     def calc_multiplier(self):
         """Calculate the sprinkler multiplier for home automation system"""
 
         self.update_data()  # First lets update the forecast data
 
+        if self.engine == "et":
+            # Decide on how much water the lawn is losing instead
+            self.update_hourly_data()
+            self._value = evapotranspiration.deficit_to_multiplier(self.water_deficit)
+            return
+
         # Setup a list of tuples for ranges, home automation system has the
         # logic to what a 1, 2, 3, or 4 mean. Basically, it's typically the
         # number of days to water. Temp ranges in F
@@ -141,11 +383,59 @@ class sprinkler_multiplier(BaseModel):
         """Returns the multiplier value that has been calculated"""
         return self._value  # This should return the sprinkler multiplier value
 
+    @property
+    def water_deficit(self):
+        """Returns the average daily water deficit in mm from the ET engine"""
+        return self._water_deficit
+
     @property
     def rain(self):
         """Returns the amount of calculated rain"""
         return self._forecast_rain  # Tell us the amount of rain in next 3 days
 
+    @property
+    def average_temperature(self):
+        """Returns the average temperature of the next 5 days"""
+        return self._forecast_averages["Temp"]
+
+    def summary(self) -> dict:
+        """The multiplier and what it was decided on, for the read API
+
+        Returns
+        -------
+        dict
+            The multiplier, engine, 5 day average temperature, 3 day rain,
+            water deficit and the daily forecast
+        """
+        forecast = self._forecast_df.reset_index()
+        forecast["Date"] = forecast["Date"].astype(str)
+        return {
+            "multiplier": int(self.value),
+            "engine": self.engine,
+            "average_temperature": float(self.average_temperature),
+            "rain": float(self.rain),
+            "water_deficit": float(self.water_deficit),
+            "forecast": forecast.to_dict("records"),
+        }
+
+    def forecasts(self) -> dict:
+        """The fetched forecast intervals, for the columnar store
+
+        Returns
+        -------
+        dict
+            Table name to Tomorrow.io intervals, the hourly forecast is only
+            there when the et engine fetched it
+        """
+        forecasts = {}
+        for table, forecast in (
+            ("forecast_daily", self._forecast),
+            ("forecast_hourly", self._hourly),
+        ):
+            if forecast:
+                forecasts[table] = forecast["data"]["timelines"][0]["intervals"]
+        return forecasts
+
     def text_report(self):
         """Prints a simple table of the multiplier report"""
         headers = ["Measurement", "Value"]
@@ -154,25 +444,24 @@ class sprinkler_multiplier(BaseModel):
             ["Rain", self.rain],
             ["Multiplier", self.value],
         ]
+        if self.engine == "et":
+            data.insert(2, ["Water deficit (mm/day)", self.water_deficit])
 
         return tabulate(data, headers=headers)
 
-    def get_chart(self):
-        """Returns a png of a matplotlib figure of the multiplier report"""
-        df = self._forecast_df
-        fig, ax1 = plt.subplots()
-        ax1.plot(df.index, df.Temp, marker="o", color="green")
-        ax1.set_ylim(0, 110)
-        ax1.set_ylabel("Temperature (F)", color="green")
-        ax1.legend(["Temp"], loc="upper left")
-        ax1.xaxis.set_major_formatter(mdates.DateFormatter("%m-%d"))
-
-        ax2 = ax1.twinx()
-        ax2.set_ylim(0, 1)
-        ax2.set_ylabel("Rain (in)", color="blue")
-        ax2.bar(df.index, df["Rain (in)"], color="blue")
-        ax2.legend(["Rain"], loc="upper right")
-        fig.savefig(self._chart_png, format="png")
+    def get_chart(self, executor: Optional[Executor] = None):
+        """Saves a png of a matplotlib figure of the multiplier report
+
+        Parameters
+        ----------
+        executor : concurrent.futures.Executor, optional
+            Renders the chart there instead, e.g. in a process pool so the
+            drawing doesn't hold the GIL while other jobs run
+        """
+        if executor is None:
+            render_chart(self._forecast_df, self._chart_png)
+        else:
+            executor.submit(render_chart, self._forecast_df, self._chart_png).result()
 
     def get_email_message(self) -> EmailMessage:
         """Returns an email message with the multiplier report
@@ -208,3 +497,84 @@ class sprinkler_multiplier(BaseModel):
             msg.get_payload()[1].add_related(img.read(), "image", "png", cid=graph_cid)
 
         return msg
+
+
+def run(
+    settings: Optional[utilities.Settings] = None,
+    session: Optional[requests.Session] = None,
+    processes: Optional[Executor] = None,
+):
+    """Calculates the multiplier, updates Indigo and emails the report
+
+    The stages run as a graph, see home_automation.stages. Updating Indigo
+    only waits for the forecast, the chart and email run alongside it.
+
+    Parameters
+    ----------
+    settings : Settings, optional
+        Defaults to the shared utilities.SETTINGS
+    session : requests.Session, optional
+        Session for the Indigo update, so jobs can share connection pools
+    processes : concurrent.futures.Executor, optional
+        Where the chart is rendered, defaults to this process
+    Returns
+    -------
+    sprinkler_multiplier
+        The calculated multiplier and its report
+    """
+    settings = settings or utilities.SETTINGS
+    sprinkler = sprinkler_multiplier(
+        location=settings.tmrw_location_id,
+        api_key=settings.tomorrow_io_api_key,
+        engine=settings.sprinkler_engine,
+    )
+
+    def update_indigo():
+        """The critical path, Indigo waters with this multiplier"""
+        with profiling.phase("write"):
+            return utilities.update_indigo_variable(
+                "sprinklerDurationMultiplier", sprinkler.value, session=session
+            )
+
+    def publish():
+        """Keeps the results for the exposition endpoint and API, in memory
+        and in the state_dir for serve to pick up"""
+        exposition.REGISTRY.set(
+            "sprinkler_multiplier",
+            sprinkler.value,
+            help_text="Multiplier applied to the sprinkler run times",
+        )
+        summary = sprinkler.summary()
+        sections = {"forecast": summary.pop("forecast"), "multiplier": summary}
+        for section, data in sections.items():
+            read_api.SNAPSHOT.update(section, data)
+        read_api.persist(settings.state_dir, sections)
+
+    def archive():
+        """Keeps the forecasts and the multiplier in the columnar store"""
+        with profiling.phase("write"):
+            for table, intervals in sprinkler.forecasts().items():
+                archive_forecast(table, intervals, settings=settings)
+            archive_multiplier(sprinkler.summary(), settings=settings)
+
+    def render_chart():
+        """Generate the chart"""
+        with profiling.phase("compute"):
+            sprinkler.get_chart(processes)
+
+    def send_report():
+        """Email html report"""
+        with profiling.phase("write"):
+            utilities.send_email(sprinkler.get_email_message())
+
+    # Once the forecast is in, Indigo is updated while the report is made
+    graph = StageGraph("sprinkler")
+    graph.add("forecast", sprinkler.calc_multiplier)  # fetch and compute inside
+    graph.add("indigo", update_indigo, after=("forecast",))
+    graph.add("publish", publish, after=("forecast",))
+    graph.add("archive", archive, after=("forecast",))
+    graph.add("chart", render_chart, after=("forecast",))
+    graph.add("email", send_report, after=("chart",))
+    graph.add("report", lambda: print(sprinkler.text_report()), after=("forecast",))
+    graph.run()
+    return sprinkler
@@ -0,0 +1,131 @@
+"""Runs the stages of a job as a dependency graph
+
+A job's stages often don't depend on each other: once the sprinkler forecast
+is computed, Indigo can be updated while the chart renders, and the email
+only waits for the chart. A :class:`StageGraph` starts every stage on its own
+thread as soon as the stages it comes after have finished, so the critical
+path isn't held up by reporting work, and times each stage.
+"""
+
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable
+
+from tabulate import tabulate
+
+from home_automation import exposition
+
+
+class StageGraph:
+    """The stages of a job and what each has to wait for
+
+    Parameters
+    ----------
+    name : str
+        The job, used to label the stage timings.
+    """
+
+    def __init__(self, name: str):
+        """Set up an empty graph"""
+        self.name = name
+        self.timings = {}  # stage -> seconds, of the last run
+        self._stages = {}  # stage -> (func, the stages it comes after)
+
+    def add(self, name: str, func: Callable, after: tuple = ()) -> "StageGraph":
+        """Adds a stage
+
+        Parameters
+        ----------
+        name : str
+            The stage
+        func : callable
+            Called without arguments, its result is kept
+        after : tuple
+            Stages that must succeed before this one starts, they must have
+            been added already
+
+        Returns
+        -------
+        StageGraph
+            The graph, so stages can be chained
+        """
+        unknown = [stage for stage in after if stage not in self._stages]
+        if unknown:
+            raise ValueError(f"{name} comes after unknown stages: {unknown}")
+        self._stages[name] = (func, tuple(after))
+        return self
+
+    def _timed(self, name: str, func: Callable):
+        """Runs a stage, recording how long it took even if it fails"""
+        start = time.perf_counter()
+        try:
+            return func()
+        finally:
+            self.timings[name] = time.perf_counter() - start
+
+    def run(self) -> dict:
+        """Runs every stage as soon as the stages it comes after are done
+
+        A stage that fails skips the stages after it, the others carry on.
+
+        Returns
+        -------
+        dict
+            Stage name -> its result
+
+        Raises
+        ------
+        BaseException
+            The error of the first stage that failed, once every stage that
+            could run has finished.
+        """
+        self.timings = {}
+        results = {}
+        errors = {}
+        succeeded = {}  # stage -> True if it succeeded, False if failed or skipped
+        pending = dict(self._stages)
+        running = {}
+        with ThreadPoolExecutor(
+            max_workers=max(len(pending), 1), thread_name_prefix=self.name
+        ) as pool:
+            while pending or running:
+                for name, (func, after) in list(pending.items()):
+                    if any(succeeded.get(stage) is False for stage in after):
+                        print(f"Skipping {name}, a stage before it failed")
+                        succeeded[name] = False
+                        del pending[name]
+                    elif all(succeeded.get(stage) for stage in after):
+                        running[pool.submit(self._timed, name, func)] = name
+                        del pending[name]
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                        succeeded[name] = True
+                    except BaseException as error:  # Jobs exit on fatal errors
+                        print(f"Stage {name} failed: {error!r}")
+                        errors[name] = error
+                        succeeded[name] = False
+
+        self.report()
+        for name in self._stages:
+            if name in errors:
+                raise errors[name]
+        return results
+
+    def report(self):
+        """Prints the stage timings and records them for the exposition endpoint"""
+        rows = []
+        for name in self._stages:
+            if name in self.timings:
+                rows.append([name, f"{self.timings[name]:.3f}"])
+                exposition.REGISTRY.set(
+                    "job_stage_seconds",
+                    self.timings[name],
+                    {"job": self.name, "stage": name},
+                    help_text="How long each stage of the job's last run took",
+                )
+        print(tabulate(rows, headers=["Stage", "Seconds"]))
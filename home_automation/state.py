@@ -0,0 +1,59 @@
+"""Small helpers for the JSON state files kept between job runs"""
+
+import json
+import os
+import tempfile
+from typing import Any
+
+
+def load_json(path: str, default: Any = None) -> Any:
+    """Loads a JSON state file
+
+    Parameters
+    ----------
+    path : str
+        The file to read.
+    default : Any
+        Returned when the file does not exist or cannot be parsed.
+
+    Returns
+    -------
+    Any
+        The decoded contents of the file.
+    """
+    try:
+        with open(path, "r") as state_file:
+            return json.load(state_file)
+    except (OSError, ValueError):
+        return default
+
+
+def save_json(path: str, data: Any) -> bool:
+    """Atomically writes a JSON state file
+
+    The data is written to a temporary file in the same directory and moved
+    over the old file, so concurrent readers never see a partial write.
+
+    Parameters
+    ----------
+    path : str
+        The file to write, missing directories are created.
+    data : Any
+        Anything json.dump can serialize.
+
+    Returns
+    -------
+    bool
+        True if the file was written, False if the filesystem refused.
+    """
+    directory = os.path.dirname(path) or "."
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as tmp_file:
+            json.dump(data, tmp_file)
+        os.replace(tmp_path, path)
+    except OSError as error:
+        print(f"Unable to save state to {path}: {error}")
+        return False
+    return True
@@ -0,0 +1,199 @@
+"""Streams the items of a large JSON array out of an HTTP response
+
+``response.json()`` builds the whole object tree before we look at it, even
+though the jobs only need a few fields of each Indigo device or Netatmo
+module. Here the body is read in chunks and the items of one array are
+decoded one at a time, keeping only the requested fields, so peak memory is
+one item plus one chunk however many devices there are.
+
+ijson is used when it is installed. Otherwise a small reader built on
+``json.JSONDecoder.raw_decode`` walks to the array and decodes one item at a
+time, values next to the path are decoded and dropped.
+"""
+
+import codecs
+import json
+from typing import Iterable, Iterator, Optional
+
+import requests
+
+try:
+    import ijson
+except ImportError:  # Optional, the pure Python reader is used instead
+    ijson = None
+
+_WHITESPACE = " \t\n\r"
+_DELIMITERS = _WHITESPACE + ",]}"
+
+
+class _ChunkReader:
+    """Decodes JSON values from a stream of byte chunks, one at a time
+
+    Parameters
+    ----------
+    chunks : iterable
+        The body of the response in byte chunks
+    """
+
+    def __init__(self, chunks: Iterable[bytes]):
+        """Set up an empty buffer, chunks are read as they are needed"""
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._done = False
+
+    def _fill(self) -> bool:
+        """Reads another chunk, returns False at the end of the body"""
+        if self._done:
+            return False
+        # Drop what has been consumed so the buffer stays one chunk or so
+        self._buffer = self._buffer[self._pos :]
+        self._pos = 0
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self._done = True
+            self._buffer += self._decoder.decode(b"", final=True)
+            return False
+        self._buffer += self._decoder.decode(chunk)
+        return True
+
+    def peek(self) -> str:
+        """The next character that is not whitespace, "" at the end"""
+        while True:
+            while self._pos < len(self._buffer):
+                if self._buffer[self._pos] not in _WHITESPACE:
+                    return self._buffer[self._pos]
+                self._pos += 1
+            if not self._fill():
+                return ""
+
+    def expect(self, characters: str) -> str:
+        """Consumes the next character, which must be one of characters"""
+        character = self.peek()
+        if not character or character not in characters:
+            raise ValueError(f"Expected one of {characters!r}, found {character!r}")
+        self._pos += 1
+        return character
+
+    def value(self):
+        """Decodes the next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # A number may continue in the next chunk, e.g. "5." then "5"
+            if (
+                isinstance(value, (int, float))
+                and not any(c in _DELIMITERS for c in self._buffer[end:])
+                and self._fill()
+            ):
+                continue
+            self._pos = end
+            return value
+
+    def seek(self, path: list):
+        """Walks into nested objects along path, up to the value at its end
+
+        Raises
+        ------
+        KeyError
+            If an object on the way doesn't have the next key.
+        """
+        for key in path:
+            self.expect("{")
+            while True:
+                if self.peek() == "}":
+                    raise KeyError(key)
+                name = self.value()
+                self.expect(":")
+                if name == key:
+                    break
+                self.value()  # A sibling we don't need
+                if self.expect(",}") == "}":
+                    raise KeyError(key)
+
+    def items(self) -> Iterator:
+        """Decodes the items of the array at the current position"""
+        self.expect("[")
+        if self.peek() == "]":
+            return
+        while True:
+            yield self.value()
+            if self.expect(",]") == "]":
+                return
+
+
+def _select(item, fields: Optional[list]):
+    """Keeps only the fields of an item that were asked for"""
+    if fields is None or not isinstance(item, dict):
+        return item
+    return {field: item[field] for field in fields if field in item}
+
+
+def iter_chunk_items(
+    chunks: Iterable[bytes], path: str = "", fields: Optional[list] = None
+) -> Iterator:
+    """Streams the items of an array out of a JSON document
+
+    Parameters
+    ----------
+    chunks : iterable
+        The document in byte chunks
+    path : str
+        Dotted keys leading to the array, e.g. body.devices, "" when the
+        document is the array
+    fields : list, optional
+        Keys to keep from each item, defaults to all of them
+
+    Yields
+    ------
+    Any
+        Each item of the array, reduced to the fields
+    """
+    reader = _ChunkReader(chunks)
+    reader.seek(path.split(".") if path else [])
+    for item in reader.items():
+        yield _select(item, fields)
+
+
+def iter_items(
+    response: requests.Response,
+    path: str = "",
+    fields: Optional[list] = None,
+    chunk_size: int = 65536,
+) -> Iterator:
+    """Streams the items of an array out of a response body
+
+    The request should be made with ``stream=True``, otherwise requests has
+    already read the whole body.
+
+    Parameters
+    ----------
+    response : requests.Response
+        The response
+    path : str
+        Dotted keys leading to the array, "" when the body is the array
+    fields : list, optional
+        Keys to keep from each item, defaults to all of them
+    chunk_size : int
+        Bytes read at a time
+
+    Yields
+    ------
+    Any
+        Each item of the array, reduced to the fields
+    """
+    if ijson is not None and getattr(response, "raw", None) is not None:
+        response.raw.decode_content = True
+        prefix = f"{path}.item" if path else "item"
+        for item in ijson.items(response.raw, prefix, use_float=True):
+            yield _select(item, fields)
+        return
+    yield from iter_chunk_items(response.iter_content(chunk_size), path, fields)
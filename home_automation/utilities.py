@@ -1,14 +1,25 @@
 """Utilities modules that are common to many scripts and modules"""
 
 import json
+import os
 import smtplib
 import sys
+import threading
 from email.message import EmailMessage
+from typing import Optional, Union
 from xmlrpc.client import Boolean
 
 import requests
-from pydantic import AnyHttpUrl, SecretStr
+import statsd
+from pydantic import AnyHttpUrl, SecretStr, ValidationError
 from pydantic_settings import BaseSettings
+from requests.adapters import HTTPAdapter
+
+from home_automation import exposition, resilience
+from home_automation.indigo_variables import VariableResolver
+from home_automation.last_written import LastWrittenStore
+from home_automation.ratelimit import TokenBucketLimiter
+from home_automation.write_behind import WriteBehindBuffer
 
 # Contains utilities that will be used across home automation scripts.
 
@@ -45,12 +56,83 @@ class Settings(BaseSettings):
         The URL to the Magic Mirror server.
     indigo_api_key: SecretStr
         The API key for the Indigo server. Necessary for authentication.
+    indigo_username: str
+        The Indigo user for the REST API's digest authentication, without one
+        the REST API is sent the API key.
+    indigo_password: SecretStr
+        The password of the Indigo user.
     tmrw_location_id: str
         The Tomorrow.io location ID, found in the developer console. Set via
         an environment variable: tmrw_location_id
     tomorrow_io: str
         The Tomorrow.io API key, found in the developer console. Set via an
         environment variable: tomorrow_io
+    state_dir: str
+        Directory for state kept between runs, mount a volume here to keep it
+        across containers.
+    indigo_write_deadband: float
+        Numeric Indigo variable updates within this distance of the last
+        written value are skipped.
+    indigo_write_refresh: int
+        Seconds after which an unchanged Indigo variable is written anyway.
+    ringbuffer_capacity: int
+        Number of readings kept per sensor in the local ring buffers.
+    sprinkler_engine: str
+        How the sprinkler multiplier is decided, "temperature" uses the 5 day
+        average temperature, "et" the hourly evapotranspiration water deficit.
+    latitude: float
+        Latitude of the yard, used for the solar radiation in the ET engine.
+    longitude: float
+        Longitude of the yard, east positive.
+    elevation: float
+        Elevation of the yard in metres.
+    http_connect_timeout: float
+        Connect timeout in seconds for endpoints without their own.
+    http_read_timeout: float
+        Read timeout in seconds for endpoints without their own.
+    job_deadline: float
+        Seconds a job has for all of its outbound calls, 0 for no limit.
+    breaker_failure_threshold: int
+        Consecutive failures after which calls to an endpoint fail fast.
+    breaker_reset_timeout: float
+        Seconds before a failing endpoint is probed again.
+    tomorrow_io_hourly_limit: int
+        Requests per hour allowed by the Tomorrow.io plan.
+    netatmo_hourly_limit: int
+        Requests per hour Netatmo allows each user.
+    indigo_devices_ttl: float
+        Seconds the cached Indigo device list is used before revalidating it.
+    indigo_variables_ttl: float
+        Seconds the cached index of Indigo variable names is used before it
+        is fetched again.
+    indigo_state_max_age: float
+        Seconds a mirrored Indigo device state is trusted when the device
+        list isn't revalidated in a run, so Indigo hasn't said when the
+        device last changed, 0 reads it on every run.
+    netatmo_accounts_file: str
+        JSON list of the Netatmo accounts polled by the multi-account job,
+        see home_automation.netatmo_accounts.
+    netatmo_account_workers: int
+        Accounts the multi-account job polls at the same time.
+    indigo_write_interval: float
+        Seconds Indigo variable writes are held so that only the latest value
+        of each is sent, 0 writes immediately.
+    indigo_write_max_pending: int
+        Variables waiting to be written before the held writes are sent early.
+    exposition_port: int
+        Port ``python3 -m home_automation serve`` serves the latest readings
+        on for scrapers to pull.
+    api_port: int
+        Port ``python3 -m home_automation serve`` serves the read-only JSON
+        API of the latest results on.
+    metrics_push: bool
+        Push every reading to the metrics server, turn off when a scraper
+        pulls them from the exposition endpoint instead.
+    collectors_file: str
+        JSON list of the collectors the collectors job runs, see
+        home_automation.collectors, defaults to Netatmo and Indigo.
+    collector_workers: int
+        Collectors the collectors job runs at the same time.
 
     """
 
@@ -60,6 +142,8 @@ class Settings(BaseSettings):
     indigo_url: AnyHttpUrl = "http://blanc.thesniderpad.com:8000"
     magic_mirror_url: str = "giro.thesniderpad.com:8080"
     indigo_api_key: SecretStr
+    indigo_username: Optional[str] = None
+    indigo_password: Optional[SecretStr] = None
     tmrw_location_id: str
     tomorrow_io_api_key: str
     metrics_server: str = "metrics.thesniderpad.com"
@@ -67,10 +151,234 @@ class Settings(BaseSettings):
     netatmo_client_secret: str
     netatmo_password: str
     netatmo_device_id: str
+    state_dir: str = "/tmp/home_automation"
+    indigo_write_deadband: float = 0.0
+    indigo_write_refresh: int = 86400
+    ringbuffer_capacity: int = 4096
+    sprinkler_engine: str = "temperature"
+    latitude: float = 39.74
+    longitude: float = -104.99
+    elevation: float = 1609
+    http_connect_timeout: float = 3.05
+    http_read_timeout: float = 15
+    job_deadline: float = 300
+    breaker_failure_threshold: int = 3
+    breaker_reset_timeout: float = 60
+    tomorrow_io_hourly_limit: int = 25
+    netatmo_hourly_limit: int = 500
+    indigo_devices_ttl: float = 3600
+    indigo_state_max_age: float = 900
+    indigo_variables_ttl: float = 86400
+    netatmo_accounts_file: Optional[str] = None
+    netatmo_account_workers: int = 16
+    indigo_write_interval: float = 0
+    indigo_write_max_pending: int = 50
+    exposition_port: int = 9108
+    api_port: int = 9109
+    metrics_push: bool = True
+    collectors_file: Optional[str] = None
+    collector_workers: int = 8
+
+
+class SettingsLoader:
+    """Builds the Settings once per process, and again when the secrets change
+
+    Fields can also be read from a directory of secret files, one file per
+    field named after it, e.g. a Docker or Kubernetes secret mount. A long
+    running process calls reload_if_changed between runs, which only
+    re-reads the Settings when a file in the directory was modified, so
+    rotated credentials are picked up without a restart. The reloaded values
+    are copied into the same Settings instance, so every module holding it
+    sees them. Objects built from the Settings at import, like the rate
+    limits, keep the values they were built with.
+
+    Parameters
+    ----------
+    secrets_dir : str, optional
+        Directory of secret files, ignored while it doesn't exist.
+    """
+
+    def __init__(self, secrets_dir: Optional[str] = None):
+        """Set up the loader, the Settings are only built on first use"""
+        self.secrets_dir = secrets_dir
+        self._settings = None
+        self._fingerprint = None
+        self._lock = threading.Lock()
+
+    def _secrets(self) -> Optional[tuple]:
+        """The name and modification time of every secret file"""
+        if not self.secrets_dir or not os.path.isdir(self.secrets_dir):
+            return None
+        return tuple(
+            sorted(
+                (entry.name, entry.stat().st_mtime_ns)
+                for entry in os.scandir(self.secrets_dir)
+                if entry.is_file()
+            )
+        )
+
+    def _build(self, fingerprint: Optional[tuple]) -> Settings:
+        """Reads the Settings from the environment and the secret files"""
+        secrets_dir = self.secrets_dir if fingerprint is not None else None
+        return Settings(_secrets_dir=secrets_dir)
+
+    def get(self) -> Settings:
+        """The Settings, built on the first call"""
+        with self._lock:
+            if self._settings is None:
+                self._fingerprint = self._secrets()
+                self._settings = self._build(self._fingerprint)
+            return self._settings
+
+    def reload_if_changed(self) -> bool:
+        """Re-reads the Settings if a secret file changed since they were read
+
+        Returns
+        -------
+        bool
+            True if the Settings were reloaded
+        """
+        fingerprint = self._secrets()
+        with self._lock:
+            if self._settings is None or fingerprint == self._fingerprint:
+                return False
+            try:
+                fresh = self._build(fingerprint)
+            except ValidationError as error:  # e.g. a secret half written
+                print(f"Keeping the current settings, the secrets are invalid: {error}")
+                return False
+            for name in Settings.model_fields:
+                if getattr(fresh, name) != getattr(self._settings, name):
+                    setattr(self._settings, name, getattr(fresh, name))
+            self._fingerprint = fingerprint
+        print("Reloaded the settings, the secrets changed")
+        return True
+
+
+# Where the secret files are mounted, /run/secrets for Docker secrets
+SETTINGS_LOADER = SettingsLoader(os.environ.get("secrets_dir", "/run/secrets"))
+
+
+def get_settings() -> Settings:
+    """The Settings shared by every module of this process"""
+    return SETTINGS_LOADER.get()
 
 
 # Make these available in this module
-SETTINGS = Settings()
+SETTINGS = get_settings()
+
+# Last value written to each Indigo variable, used to skip unchanged writes
+INDIGO_WRITES = LastWrittenStore(
+    path=os.path.join(SETTINGS.state_dir, "indigo_writes.json"),
+    deadband=SETTINGS.indigo_write_deadband,
+    refresh_seconds=SETTINGS.indigo_write_refresh,
+)
+
+
+def report_api_budget(api: str, remaining: float):
+    """Sends the requests left in an API's hourly budget to the metrics server
+
+    Parameters
+    ----------
+    api : str
+        The API name, e.g. tomorrow_io
+    remaining : float
+        The tokens left in its bucket
+    """
+    exposition.REGISTRY.set("api_budget", remaining, {"api": api})
+    try:
+        statsd.StatsClient(SETTINGS.metrics_server, 8125).gauge(
+            f"api_budget,api={api}", remaining
+        )
+    except OSError as error:
+        print(f"Unable to report the {api} budget: {error}")
+
+
+# Hourly request budgets for the metered APIs, shared between processes
+RATE_LIMITS = TokenBucketLimiter(
+    os.path.join(SETTINGS.state_dir, "ratelimit.sqlite"),
+    {
+        "tomorrow_io": (
+            SETTINGS.tomorrow_io_hourly_limit,
+            SETTINGS.tomorrow_io_hourly_limit / 3600,
+        ),
+        "netatmo": (
+            SETTINGS.netatmo_hourly_limit,
+            SETTINGS.netatmo_hourly_limit / 3600,
+        ),
+    },
+    report=report_api_budget,
+)
+
+# Timeouts and circuit breakers for every outbound call
+resilience.configure(
+    path=os.path.join(SETTINGS.state_dir, "circuit_breakers.json"),
+    failure_threshold=SETTINGS.breaker_failure_threshold,
+    reset_timeout=SETTINGS.breaker_reset_timeout,
+    connect_timeout=SETTINGS.http_connect_timeout,
+    read_timeout=SETTINGS.http_read_timeout,
+)
+
+
+def make_session(pool_size: int = 10) -> requests.Session:
+    """An HTTP session with connection pools big enough for concurrent calls
+
+    Parameters
+    ----------
+    pool_size : int
+        Connections kept open per host
+
+    Returns
+    -------
+    requests.Session
+        The session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _indigo_auth_headers() -> dict:
+    """The Authorization header for the Indigo v2 API"""
+    return {"Authorization": f"Bearer {SETTINGS.indigo_api_key.get_secret_value()}"}
+
+
+def list_indigo_variables(session: requests.Session = None) -> Optional[list]:
+    """Lists every Indigo variable
+
+    Parameters
+    ----------
+    session : requests.Session, optional
+        Session to send the request on
+
+    Returns
+    -------
+    list
+        The variables as dicts with their id, name and value, None if Indigo
+        could not be reached
+    """
+    url = str(SETTINGS.indigo_url) + "v2/api/indigo.variables"
+    try:
+        r = resilience.call(
+            "indigo", (session or requests).get, url, headers=_indigo_auth_headers()
+        )
+    except requests.exceptions.RequestException as error:
+        print(f"Unable to list indigo variables, error: {error}")
+        return None
+    if not r.ok:
+        print(f"Unable to list indigo variables, error: {r.text}")
+        return None
+    return r.json()
+
+
+# Name to id index of the Indigo variables, so helpers accept either
+INDIGO_VARIABLES = VariableResolver(
+    list_indigo_variables,
+    path=os.path.join(SETTINGS.state_dir, "indigo_variables.json"),
+    ttl=SETTINGS.indigo_variables_ttl,
+)
 
 # Mail function
 
@@ -86,13 +394,21 @@ def send_email(message: EmailMessage):
         A fully formed EmailMessage object, ready to send
     """
 
-    s = smtplib.SMTP(host=SETTINGS.smtp_server, port=2525)
+    s = smtplib.SMTP(
+        host=SETTINGS.smtp_server, port=2525, timeout=SETTINGS.http_read_timeout
+    )
     s.send_message(message)
     s.quit()
 
 
 # Update Indigo Function
-def update_indigo_variable(object_id: int, value: str) -> Boolean:
+def update_indigo_variable(
+    object_id: Union[int, str],
+    value: str,
+    force: bool = False,
+    deadband: Optional[float] = None,
+    session: Optional[requests.Session] = None,
+) -> Boolean:
     """
     Updates the value of a specified Indigo variable.
 
@@ -101,64 +417,152 @@ def update_indigo_variable(object_id: int, value: str) -> Boolean:
     of the variable to be updated, and the new value. The request is authenticated
     using an API key.
 
+    The write is skipped when the value matches the last value written (within
+    the configured deadband for numbers) and that write is more recent than
+    the forced refresh interval, so Indigo triggers only fire on real changes.
+
+    With an indigo_write_interval the write is queued in INDIGO_WRITE_BUFFER
+    instead, and only the latest value queued for the variable within the
+    interval is sent.
+
     Args:
-        object_id (int): The object ID of the variable to be updated.
+        object_id (int or str): The object ID of the variable to be updated,
+            or its name.
         value (str): The new value for the variable.
+        force (bool): Write even if the value has not changed.
+        deadband (float): Overrides the configured deadband for this variable.
+        session (requests.Session): Session to send the request on, so
+            repeated calls reuse a connection. Queued writes use their own.
 
     Returns:
-        bool: True if the update was successful, False otherwise.
+        bool: True if the update was successful, queued or not needed, False
+        otherwise, including when Indigo could not be reached in time.
+    """
+    name, object_id = object_id, INDIGO_VARIABLES.resolve(object_id)
+    if object_id is None:
+        print(f"indigo variable update failed: {name} not found")
+        return False
+    if SETTINGS.indigo_write_interval > 0:
+        INDIGO_WRITE_BUFFER.put(
+            object_id, value, name=name, force=force, deadband=deadband
+        )
+        return True
+    return _write_indigo_variable(object_id, value, name, force, deadband, session)
+
+
+def _write_indigo_variable(
+    object_id: int,
+    value: str,
+    name: Union[int, str],
+    force: bool = False,
+    deadband: Optional[float] = None,
+    session: Optional[requests.Session] = None,
+) -> bool:
+    """Sends a variable update to Indigo unless the value is unchanged
 
-    Raises:
-        Exception: If the request to the Indigo API fails.
+    See update_indigo_variable, object_id is already resolved and name is
+    what it was resolved from.
     """
+    if not force and not INDIGO_WRITES.should_write(object_id, value, deadband):
+        print(f"Indigo variable {name} unchanged, skipping update")
+        return True
+
     variable_update_payload = {
         "message": "indigo.variable.updateValue",
         "objectId": object_id,
         "parameters": {"value": f"{value}"},  # Variable values must be strings
     }
-    headers = {"Authorization": f"Bearer {SETTINGS.indigo_api_key.get_secret_value()}"}
-    r = requests.post(
-        str(SETTINGS.indigo_url) + "v2/api/command",
-        headers=headers,
-        data=json.dumps(variable_update_payload),
-    )
+    headers = _indigo_auth_headers()
+    try:
+        r = resilience.call(
+            "indigo",
+            (session or requests).post,
+            str(SETTINGS.indigo_url) + "v2/api/command",
+            headers=headers,
+            data=json.dumps(variable_update_payload),
+        )
+    except requests.exceptions.RequestException as error:
+        print(f"indigo variable update failed: {object_id}, error: {error}")
+        return False
     if r.ok:
         # log.info(f"indigo variable updated: {object_id}")
+        INDIGO_WRITES.record(object_id, value)
         return True
     else:
         # log.error(f"indigo variable updated failed: {object_id}")
+        if r.status_code == 404:
+            INDIGO_VARIABLES.invalidate()  # Deleted or recreated with a new id
         return False
 
 
-def get_indigo_variable(object_id: int):
+def report_indigo_write_buffer(counts: dict):
+    """Records the counts of the Indigo write buffer for the exposition endpoint
+
+    Parameters
+    ----------
+    counts : dict
+        queued, coalesced, written and failed writes so far
+    """
+    for count, value in counts.items():
+        exposition.REGISTRY.set(
+            f"indigo_writes_{count}",
+            value,
+            help_text=f"Indigo variable writes {count} by the write-behind buffer",
+        )
+
+
+# Coalesces bursts of writes to the same variable, see update_indigo_variable
+INDIGO_WRITE_BUFFER = WriteBehindBuffer(
+    _write_indigo_variable,
+    interval=SETTINGS.indigo_write_interval,
+    max_pending=SETTINGS.indigo_write_max_pending,
+    report=report_indigo_write_buffer,
+)
+
+
+def get_indigo_variable(object_id: Union[int, str], session: requests.Session = None):
     """Gets the value of an Indigo variable
 
     Parameters
     ----------
-    variable : str
-        The name of the variable to be retrieved
+    object_id : int or str
+        The object ID or the name of the variable to be retrieved
+    session : requests.Session, optional
+        Session to send the request on, so repeated calls reuse a connection
 
     Returns
     -------
     return_value: Str
         The value of the requested variable.
     """
+    name, object_id = object_id, INDIGO_VARIABLES.resolve(object_id)
+    if object_id is None:
+        print(f"Unable to get indigo variable {name}, not found")
+        return None
     url = str(SETTINGS.indigo_url) + "v2/api/indigo.variables/" + str(object_id)
-    headers = {"Authorization": f"Bearer {SETTINGS.indigo_api_key.get_secret_value()}"}
+    headers = _indigo_auth_headers()
 
-    r = requests.get(url, headers=headers)
+    try:
+        r = resilience.call("indigo", (session or requests).get, url, headers=headers)
+    except requests.exceptions.RequestException as error:
+        print(f"Unable to get indigo variable {object_id}, error: {error}")
+        return None
     if r.ok:
         return_value = r.json()["value"]
         return return_value
 
 
-def update_magicmirror_internal_temperature(temperature: float):
+def update_magicmirror_internal_temperature(
+    temperature: float, session: requests.Session = None
+):
     """Updates the internal temperature of the MagicMirror variable
 
     Parameters
     ----------
     temperature : float
         The temperature to update the MagicMirror with.
+    session : requests.Session, optional
+        Session to send the request on, so repeated calls reuse a connection
 
     Returns
     -------
@@ -169,7 +573,13 @@ def update_magicmirror_internal_temperature(temperature: float):
     data = f"temp={temperature}".encode("utf-8")
     header = {"Content-Type": "application/x-www-form-urlencoded"}
     url = f"http://{SETTINGS.magic_mirror_url}/indoor-temperature"
-    r = requests.post(url, data=data, headers=header)
+    try:
+        r = resilience.call(
+            "magic_mirror", (session or requests).post, url, data=data, headers=header
+        )
+    except requests.exceptions.RequestException as error:
+        print(f"Failed to update temperature variable to {temperature}, error: {error}")
+        return False
     if r.ok:
         print(f"Successfully update temperature variable to {temperature}")
     else:
@@ -0,0 +1,135 @@
+"""A write-behind buffer that coalesces bursts of writes to the same key
+
+Several jobs, or a burst of readings, can set the same Indigo variable within
+seconds. Each set used to be its own POST, and fired the variable's triggers
+each time. The buffer keeps only the latest value per key and writes them out
+every ``interval`` seconds, or sooner once ``max_pending`` keys are waiting, so
+a key is written at most once per interval with its latest value.
+"""
+
+import atexit
+import threading
+from typing import Callable, Optional
+
+
+class WriteBehindBuffer:
+    """Keeps the latest pending value per key and writes them in the background
+
+    Parameters
+    ----------
+    write : callable
+        Called as ``write(key, value, **options)`` for each pending key,
+        returns True if the write succeeded.
+    interval : float
+        Seconds between flushes.
+    max_pending : int
+        Keys that can wait before a flush is started early.
+    report : callable, optional
+        Called with the counts after every flush.
+    """
+
+    def __init__(
+        self,
+        write: Callable[..., bool],
+        interval: float = 2.0,
+        max_pending: int = 50,
+        report: Optional[Callable[[dict], None]] = None,
+    ):
+        """Set up an empty buffer, the flush thread starts on first use"""
+        self.write = write
+        self.interval = interval
+        self.max_pending = max_pending
+        self.report = report
+        self.counts = {"queued": 0, "coalesced": 0, "written": 0, "failed": 0}
+        self._pending = {}  # key -> (value, options), in the order first queued
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def pending(self) -> int:
+        """Keys waiting to be written"""
+        return len(self._pending)
+
+    def put(self, key, value, **options):
+        """Queues a write, replacing any pending write of the same key
+
+        Parameters
+        ----------
+        key : Any
+            What is written, e.g. an Indigo object id
+        value : Any
+            The value to write
+        **options
+            Passed on to write, the latest ones win
+        """
+        with self._lock:
+            self.counts["queued"] += 1
+            if key in self._pending:
+                self.counts["coalesced"] += 1
+            self._pending[key] = (value, options)
+            full = len(self._pending) >= self.max_pending
+            if self._thread is None:
+                self._start()
+        if full:
+            self._wake.set()
+
+    def _start(self):
+        """Starts the flush thread, and drains the buffer when Python exits"""
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="write-behind", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        """Flushes every interval, or when woken because the buffer is full"""
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """Writes every pending key now
+
+        Returns
+        -------
+        int
+            The number of writes that succeeded
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            written = 0
+            for key, (value, options) in pending.items():
+                try:
+                    ok = self.write(key, value, **options)
+                except Exception as error:  # The flush thread must carry on
+                    print(f"Buffered write of {key} failed: {error!r}")
+                    ok = False
+                written += bool(ok)
+            with self._lock:
+                self.counts["written"] += written
+                self.counts["failed"] += len(pending) - written
+                counts = dict(self.counts)
+        if pending and self.report is not None:
+            self.report(counts)
+        return written
+
+    def close(self):
+        """Stops the flush thread and writes whatever is still pending"""
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            self._wake.set()
+            thread.join()
+            atexit.unregister(self.close)
+        self.flush()
+        if self.counts["queued"]:
+            print(
+                "Buffered writes: {queued} queued, {coalesced} coalesced, "
+                "{written} written, {failed} failed".format(**self.counts)
+            )
@@ -0,0 +1,18 @@
+#!/usr/local/bin/python
+"""
+This script runs the sensor collectors that are due, see the collectors_file,
+and logs their readings to influxdb.
+
+"""
+
+import sys
+
+from home_automation import profiling
+
+with profiling.phase("imports"):
+    from home_automation import collectors, resilience, utilities
+
+if __name__ == "__main__":
+    resilience.start_deadline(utilities.SETTINGS.job_deadline)
+    failed = collectors.run()
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,18 @@
+#!/usr/local/bin/python
+"""
+This script pulls data from the stations of every Netatmo account listed in
+the netatmo_accounts_file and logs it to influxdb.
+
+"""
+
+import sys
+
+from home_automation import profiling
+
+with profiling.phase("imports"):
+    from home_automation import netatmo_accounts, resilience, utilities
+
+if __name__ == "__main__":
+    resilience.start_deadline(utilities.SETTINGS.job_deadline)
+    failed = netatmo_accounts.run()
+    sys.exit(1 if failed else 0)
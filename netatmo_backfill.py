@@ -0,0 +1,78 @@
+#!/usr/local/bin/python
+"""
+Backfills InfluxDB with the Netatmo measurement history for a date range, for
+example to fill the gaps left by failed log_netatmo runs.
+
+    python3 netatmo_backfill.py --start 2024-01-01 --end 2024-03-31
+
+The history is streamed page by page into batched writes and progress is
+checkpointed, so running the same command again resumes where it stopped.
+"""
+
+import argparse
+import os
+from datetime import datetime
+
+from home_automation import profiling
+
+with profiling.phase("imports"):
+    from influxdb import InfluxDBClient
+
+    from home_automation import netatmo, utilities
+
+
+def main(argv=None):
+    """Parses the command line and backfills the requested range"""
+    settings = utilities.get_settings()
+
+    parser = argparse.ArgumentParser(description="Backfill Netatmo history")
+    parser.add_argument("--start", required=True, help="First day, YYYY-MM-DD")
+    parser.add_argument("--end", help="Last day, YYYY-MM-DD, defaults to now")
+    parser.add_argument("--scale", default="max", help="Netatmo scale, e.g. 30min")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument(
+        "--checkpoint",
+        default=os.path.join(settings.state_dir, "netatmo_backfill.json"),
+        help="File used to resume an interrupted backfill",
+    )
+    args = parser.parse_args(argv)
+
+    date_begin = int(datetime.fromisoformat(args.start).timestamp())
+    if args.end:
+        date_end = int(datetime.fromisoformat(args.end).timestamp()) + 86399
+    else:
+        date_end = int(datetime.now().timestamp())
+
+    influx = InfluxDBClient(
+        host=settings.metrics_server,
+        port=8086,
+        database="metrics",
+        timeout=settings.http_read_timeout,
+    )
+
+    def write(batch):
+        """Writes one batch of line protocol points to InfluxDB"""
+        influx.write_points(batch, time_precision="ms", protocol="line")
+        print(f"\tWrote {len(batch)} points")
+
+    with profiling.phase("fetch"):
+        access_token = netatmo.get_access_token(settings)
+        data = netatmo.get_stations_data(access_token, settings.netatmo_device_id)
+
+    with profiling.phase("write"):
+        points = netatmo.backfill(
+            access_token,
+            data,
+            date_begin,
+            date_end,
+            write,
+            checkpoint_path=args.checkpoint,
+            batch_size=args.batch_size,
+            scale=args.scale,
+        )
+
+    print(f"Backfill complete, {points} points written")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,23 +2,11 @@
 to Indigo.
 """
 
-from home_automation import sprinkler_multiplier, utilities
+from home_automation import profiling
 
-# Create our multiplier object
-sprinkler = sprinkler_multiplier.sprinkler_multiplier()
+with profiling.phase("imports"):
+    from home_automation import resilience, sprinkler_multiplier, utilities
 
-# Get all of our values
-sprinkler.calc_multiplier()
-
-# Update our Home Automation Server
-utilities.update_indigo_variable("sprinklerDurationMultiplier", sprinkler.value)
-
-# Generate the chart
-sprinkler.get_chart()
-
-# Email html report
-email_message = sprinkler.get_email_message()
-utilities.send_email(email_message)
-
-# Print Text Report
-print(sprinkler.text_report())
+if __name__ == "__main__":
+    resilience.start_deadline(utilities.SETTINGS.job_deadline)
+    sprinkler_multiplier.run()
@@ -0,0 +1,79 @@
+"""Shared pytest fixtures"""
+
+import pytest
+
+from home_automation import (
+    exposition,
+    read_api,
+    resilience,
+    sprinkler_multiplier,
+    utilities,
+)
+from home_automation.indigo_variables import VariableResolver
+from home_automation.last_written import LastWrittenStore
+from home_automation.ratelimit import TokenBucketLimiter
+
+
+@pytest.fixture(autouse=True)
+def state_dir(monkeypatch, tmp_path):
+    """Keep the state files written during a test in its temporary directory"""
+    path = str(tmp_path / "state")
+    monkeypatch.setattr(utilities.SETTINGS, "state_dir", path)
+    monkeypatch.setattr(sprinkler_multiplier.settings, "state_dir", path)
+    return path
+
+
+@pytest.fixture(autouse=True)
+def indigo_writes(monkeypatch):
+    """Give every test an empty, in memory store of Indigo writes so that
+    writes made by one test are not suppressed in the next.
+    """
+    store = LastWrittenStore()
+    monkeypatch.setattr(utilities, "INDIGO_WRITES", store)
+    return store
+
+
+@pytest.fixture(autouse=True)
+def circuit_breakers(monkeypatch):
+    """Give every test closed, in memory circuit breakers and no deadline"""
+    registry = resilience.BreakerRegistry()
+    monkeypatch.setattr(resilience, "BREAKERS", registry)
+    monkeypatch.setattr(resilience, "_deadline", None)
+    return registry
+
+
+@pytest.fixture(autouse=True)
+def rate_limits(monkeypatch, state_dir):
+    """Give every test full API budgets that are not reported anywhere"""
+    limiter = TokenBucketLimiter(
+        f"{state_dir}/ratelimit.sqlite",
+        {"tomorrow_io": (25, 25 / 3600), "netatmo": (500, 500 / 3600)},
+    )
+    monkeypatch.setattr(utilities, "RATE_LIMITS", limiter)
+    return limiter
+
+
+@pytest.fixture(autouse=True)
+def indigo_variables(monkeypatch):
+    """Give every test an in memory variable index, empty unless a test
+    replaces its fetch
+    """
+    resolver = VariableResolver(lambda: [])
+    monkeypatch.setattr(utilities, "INDIGO_VARIABLES", resolver)
+    return resolver
+
+
+@pytest.fixture(autouse=True)
+def gauges(monkeypatch):
+    """Give every test an empty registry of the latest readings"""
+    registry = exposition.GaugeRegistry()
+    monkeypatch.setattr(exposition, "REGISTRY", registry)
+    return registry
+
+
+@pytest.fixture(autouse=True)
+def snapshot(monkeypatch):
+    """Give every test an empty snapshot of the published results"""
+    published = read_api.Snapshot()
+    monkeypatch.setattr(read_api, "SNAPSHOT", published)
+    return published
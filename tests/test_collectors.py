@@ -0,0 +1,213 @@
+"""Tests for the collectors module"""
+
+import json
+
+import pytest
+
+from home_automation import collectors, utilities
+from home_automation.collectors import Collector, Schedule
+from home_automation.ringbuffer import RingBufferStore
+
+
+class FakeCollector(Collector):
+    """Returns the readings it was given, or raises the error it was given"""
+
+    kind = "fake"
+
+    def __init__(self, name: str, interval: float = 60, readings=None, error=None):
+        """Set up the collector"""
+        super().__init__(name, interval)
+        self.readings = readings or []
+        self.error = error
+        self.collected = 0
+        self.written_readings = None
+
+    def collect(self, settings, session=None) -> list:
+        """The readings, or the error"""
+        self.collected += 1
+        if self.error is not None:
+            raise self.error
+        return self.readings
+
+    def written(self, readings, settings, session=None):
+        """Remembers what was written"""
+        self.written_readings = readings
+
+
+def test_load_collectors():
+    """Collectors are created by kind, unknown kinds and names are rejected"""
+    loaded = collectors.load_collectors(
+        [
+            {"kind": "netatmo", "name": "netatmo", "interval": 120},
+            {
+                "kind": "indigo",
+                "name": "office",
+                "devices": [{"name": "Office Temp", "metric": "temp", "device": "o"}],
+            },
+        ]
+    )
+    assert [type(c) for c in loaded] == [
+        collectors.NetatmoCollector,
+        collectors.IndigoCollector,
+    ]
+    assert loaded[0].interval == 120
+    assert loaded[1].devices[0]["device"] == "o"
+
+    with pytest.raises(ValueError, match="nest"):
+        collectors.load_collectors([{"kind": "nest", "name": "nest"}])
+    with pytest.raises(ValueError, match="indigo"):
+        collectors.load_collectors([{"kind": "indigo"}, {"kind": "indigo"}])
+
+
+def test_collectors_from_settings(monkeypatch, tmp_path):
+    """The collectors file replaces the default collectors"""
+    defaults = collectors.collectors_from_settings(utilities.SETTINGS)
+    assert [c.name for c in defaults] == ["netatmo", "indigo"]
+
+    path = tmp_path / "collectors.json"
+    path.write_text(json.dumps([{"kind": "netatmo", "name": "roof"}]))
+    monkeypatch.setattr(utilities.SETTINGS, "collectors_file", str(path))
+    assert [
+        c.name for c in collectors.collectors_from_settings(utilities.SETTINGS)
+    ] == ["roof"]
+
+
+def test_schedule_staggers_collectors():
+    """A collector is due at once, then in its own slot of every interval"""
+    schedule = Schedule()
+    first, second = FakeCollector("first", 300), FakeCollector("second", 300)
+    assert schedule.due([first, second], 1000) == [first, second]
+
+    schedule.ran(first, 1000)
+    schedule.ran(second, 1000)
+    slots = [schedule.next_run(first), schedule.next_run(second)]
+    assert all(1000 < slot <= 1300 for slot in slots)
+    assert slots[0] != slots[1]
+    schedule.ran(first, slots[0])
+    assert schedule.next_run(first) == slots[0] + 300
+    assert schedule.due([first, second], slots[1]) == [second]
+
+
+def test_run_collectors_batches_the_readings(mocker):
+    """The readings of every collector are written in one batch, and a
+    failing collector doesn't stop the others
+    """
+    influx = mocker.patch("home_automation.collectors.InfluxDBClient")
+    outdoor = FakeCollector(
+        "outdoor",
+        readings=[
+            {"device": "Outdoor", "sensor": "temperature", "measurement": 70.0},
+            {
+                "device": "Outdoor",
+                "sensor": "humidity",
+                "measurement": 40,
+                "changed": False,
+            },
+        ],
+    )
+    office = FakeCollector(
+        "office",
+        readings=[
+            {"device": "office", "sensor": "temp", "measurement": "68", "time": 500},
+            {"device": "office", "sensor": "motion", "measurement": "on"},
+        ],
+    )
+    broken = FakeCollector("broken", error=RuntimeError("offline"))
+    schedule = Schedule()
+
+    errors = collectors.run_collectors(
+        [outdoor, office, broken], schedule=schedule, now=1000
+    )
+
+    assert list(errors) == ["broken"]
+    influx.return_value.write_points.assert_called_once()
+    points = influx.return_value.write_points.call_args[0][0]
+    assert sorted(points) == [
+        "temp,device=office,product=fake value=68.0 500000",
+        "temperature,device=Outdoor,product=fake value=70.0 1000000",
+    ]
+    assert outdoor.written_readings[0]["source"] == "outdoor"
+    assert broken.written_readings is None
+    assert set(schedule.last_runs) == {"outdoor", "office"}
+
+    assert collectors.exposition.REGISTRY.get(
+        "fake_humidity", {"device": "Outdoor"}
+    ) == pytest.approx(40)
+    body, _ = collectors.read_api.SNAPSHOT.get("readings")
+    assert json.loads(body)["data"]["office"] == {
+        "office": {"temp": "68", "motion": "on"}
+    }
+    history = RingBufferStore.from_settings(utilities.SETTINGS)
+    assert len(history.buffer("Outdoor", "humidity")) == 0
+    assert history.buffer("office", "temp").latest() == (500, 68.0)
+
+
+def test_run_collectors_only_runs_due_collectors(mocker, monkeypatch):
+    """Collectors that aren't due are skipped, and if every collector that
+    ran failed the run fails
+    """
+    monkeypatch.setattr(utilities.SETTINGS, "metrics_push", False)
+    influx = mocker.patch("home_automation.collectors.InfluxDBClient")
+    waiting = FakeCollector("waiting")
+    broken = FakeCollector("broken", error=RuntimeError("offline"))
+    schedule = Schedule()
+    schedule.ran(waiting, 1000)
+
+    with pytest.raises(RuntimeError, match="broken"):
+        collectors.run_collectors([waiting, broken], schedule=schedule, now=1001)
+    assert waiting.collected == 0
+    assert broken.collected == 1
+    influx.assert_not_called()
+
+    assert collectors.run_collectors([waiting], schedule=schedule, now=1001) == {}
+
+
+def test_statsd_transport(mocker):
+    """Collectors with the statsd transport send their changes as gauges"""
+    influx = mocker.patch("home_automation.collectors.InfluxDBClient")
+    client = mocker.patch("statsd.StatsClient")
+    office = FakeCollector(
+        "office",
+        readings=[
+            {"device": "office", "sensor": "temp", "measurement": "68"},
+            {"device": "hall", "sensor": "temp", "measurement": 70, "changed": False},
+        ],
+    )
+    office.transport = "statsd"
+
+    collectors.run_collectors([office], now=1000)
+
+    influx.assert_not_called()
+    client.return_value.gauge.assert_called_once_with("temp,device=office", 68.0)
+
+
+def test_netatmo_collector_derives_series(mocker, monkeypatch):
+    """The derived series of new readings are written with them"""
+    monkeypatch.setattr(utilities.SETTINGS, "metrics_push", False)
+    mocker.patch("home_automation.netatmo.get_access_token", return_value="token")
+    mocker.patch("home_automation.netatmo.get_stations_data")
+    mocker.patch(
+        "home_automation.netatmo.dashboard_metrics",
+        return_value=[
+            {
+                "device": "Outdoor",
+                "sensor": "Temperature",
+                "measurement": 50.0,
+                "module": "a",
+                "time": 1000,
+            },
+            {
+                "device": "Outdoor",
+                "sensor": "Humidity",
+                "measurement": 60,
+                "module": "a",
+                "time": 1000,
+            },
+        ],
+    )
+    collector = collectors.NetatmoCollector()
+
+    readings = collector.collect(utilities.SETTINGS)
+
+    sensors = {r["sensor"]: r["changed"] for r in readings}
+    assert sensors["DewPoint"] and sensors["HeatIndex"]
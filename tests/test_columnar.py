@@ -0,0 +1,98 @@
+"""Tests for the columnar module"""
+
+import os
+
+import numpy as np
+import pytest
+
+from home_automation import columnar
+from home_automation.columnar import ColumnStore
+
+DAY = 86400
+
+
+@pytest.fixture
+def store(tmp_path):
+    """A store with three days of readings, appended in two batches"""
+    store = ColumnStore(str(tmp_path / "columns"))
+    store.append(
+        "netatmo",
+        {
+            "time": [0, 3600, DAY],
+            "device": ["Outdoor", "Indoor", "Outdoor"],
+            "value": [1.0, 2.0, 3.0],
+        },
+    )
+    store.append(
+        "netatmo",
+        {"time": [2 * DAY], "device": ["Outdoor"], "value": [4.0], "extra": [9.0]},
+    )
+    return store
+
+
+def test_partitioned_by_day(store):
+    """Each day gets its own partition, and a time range prunes whole days"""
+    assert len(store.partitions("netatmo")) == 3
+    assert len(store.partitions("netatmo", start=DAY, end=DAY + 1)) == 1
+    assert store.partitions("missing") == []
+
+
+def test_read_projection_and_range(store):
+    """Only the asked for columns are returned, within the time range"""
+    data = store.read("netatmo", ["value"], start=3600, end=2 * DAY)
+    assert list(data) == ["value"]
+    assert data["value"].tolist() == [2.0, 3.0]
+
+
+def test_read_all_columns_fills_missing(store):
+    """A column added later is NaN for the older rows"""
+    data = store.read("netatmo")
+    assert data["device"].tolist() == ["Outdoor", "Indoor", "Outdoor", "Outdoor"]
+    assert np.isnan(data["extra"][:3]).all() and data["extra"][3] == 9.0
+
+
+def test_read_frame(store):
+    """Frames are indexed by UTC time"""
+    frame = store.read_frame("netatmo", ["device", "value"], start=DAY)
+    assert list(frame.columns) == ["device", "value"]
+    assert str(frame.index[0]) == "1970-01-02 00:00:00+00:00"
+    assert store.read_frame("missing", ["value"]).empty
+
+
+def test_append_validates_columns(store):
+    """Rows need a time column and every column the same length"""
+    with pytest.raises(ValueError):
+        store.append("netatmo", {"value": [1.0]})
+    with pytest.raises(ValueError):
+        store.append("netatmo", {"time": [1, 2], "value": [1.0]})
+
+
+def test_closed_days_are_compacted(store, monkeypatch):
+    """The first rows for a later day merge each earlier day into one part,
+    and the replaced parts are deleted by a later compaction
+    """
+    for value in (5.0, 6.0):
+        store.append("netatmo", {"time": [7200], "device": ["Rain"], "value": [value]})
+    assert len(store.partitions("netatmo", end=1)) == 3
+    before = store.read("netatmo", ["device", "value"])
+
+    store.append("netatmo", {"time": [3 * DAY], "device": ["Outdoor"], "value": [7.0]})
+
+    assert len(store.partitions("netatmo", end=1)) == 1
+    after = store.read("netatmo", ["device", "value"], end=3 * DAY)
+    assert after["value"].tolist() == before["value"].tolist()
+    assert after["device"].tolist() == before["device"].tolist()
+    day = os.path.join(store.directory, "netatmo", "1970-01-01")
+    assert len([name for name in os.listdir(day) if name.startswith("part-")]) == 4
+
+    monkeypatch.setattr(columnar, "REPLACED_GRACE", 0)
+    store.append("netatmo", {"time": [0], "device": ["Rain"], "value": [8.0]})
+    assert store.compact("netatmo") == 1
+    assert len([name for name in os.listdir(day) if name.startswith("part-")]) == 1
+    assert store.read("netatmo", ["value"], end=DAY)["value"].tolist() == [
+        1.0,
+        2.0,
+        5.0,
+        6.0,
+        8.0,
+    ]
@@ -0,0 +1,121 @@
+"""Tests for the derived module"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from home_automation import derived
+from home_automation.ringbuffer import RingBufferStore
+
+
+def batch(*rows) -> pd.DataFrame:
+    """A batch of (time, device, sensor, value) readings"""
+    return pd.DataFrame(rows, columns=derived.COLUMNS).astype(
+        {"time": float, "value": float}
+    )
+
+
+def readings(frame: pd.DataFrame) -> dict:
+    """(device, sensor, time) -> value of derived readings"""
+    return {
+        (device, sensor, taken): value
+        for taken, device, sensor, value in frame.itertuples(index=False)
+    }
+
+
+def test_dew_point():
+    """Matches published values, 100% humidity is the air temperature"""
+    assert derived.dew_point(20, 100) == pytest.approx(20)
+    assert derived.dew_point(25, 60) == pytest.approx(16.7, abs=0.1)
+
+
+def test_heat_index():
+    """Matches the National Weather Service table, mild days use the simple
+    formula
+    """
+    values = derived.heat_index([90, 80, 70], [70, 40, 50])
+    assert values == pytest.approx([106, 80, 69], abs=1)
+
+
+def test_wind_chill():
+    """Matches the National Weather Service table where the formula applies"""
+    values = derived.wind_chill([0, 30, 60, 30], [15, 10, 20, 2])
+    assert values == pytest.approx([-19, 21, 60, 30], abs=1)
+
+
+def test_derive():
+    """Conversions, dew point, heat index, wind chill and the pressure trend
+    are derived from the readings they pair with
+    """
+    frame = derived.derive(
+        batch(
+            (3600, "Outdoor", "Temperature", 77),
+            (3600, "Outdoor", "Humidity", 60),
+            (3700, "Indoor", "Temperature", 70),  # No humidity to pair with
+            (3650, "Wind Gauge", "WindStrength", 16.09344),
+            (3600 * 4, "Indoor", "Pressure", 1010),
+        ),
+        history=batch((3600 - 60, "Indoor", "Pressure", 1013)),
+    )
+
+    values = readings(frame)
+    assert values[("Wind Gauge", "WindStrength_mph", 3650)] == pytest.approx(10)
+    assert values[("Indoor", "Pressure_inHg", 3600 * 4)] == pytest.approx(
+        29.83, abs=0.01
+    )
+    assert values[("Outdoor", "DewPoint", 3600)] == pytest.approx(
+        derived.dew_point(25, 60) * 9 / 5 + 32
+    )
+    assert ("Outdoor", "HeatIndex", 3600) in values
+    assert ("Indoor", "DewPoint", 3700) not in values
+    assert values[("Outdoor", "WindChill", 3600)] == 77  # Too warm for a chill
+    assert values[("Indoor", "PressureTrend", 3600 * 4)] == pytest.approx(-3)
+    assert len(frame) == 6
+
+
+def test_derive_large_batch():
+    """A backfill sized batch derives a value for every pair"""
+    times = np.arange(100_000, dtype=float) * 300
+    frame = derived.derive(
+        pd.concat(
+            [
+                pd.DataFrame(
+                    {
+                        "time": times,
+                        "device": "Outdoor",
+                        "sensor": sensor,
+                        "value": 50.0,
+                    }
+                )
+                for sensor in ("Temperature", "Humidity", "Pressure")
+            ],
+            ignore_index=True,
+        )
+    )
+    counts = frame["sensor"].value_counts()
+    assert counts["DewPoint"] == counts["HeatIndex"] == len(times)
+    assert counts["PressureTrend"] == len(times) - 36  # The first 3 hours
+    assert (frame.loc[frame["sensor"] == "PressureTrend", "value"] == 0).all()
+
+
+def test_derive_metrics_uses_recent_pressure(tmp_path):
+    """The trend of the current pressure is taken from the ring buffer"""
+    store = RingBufferStore(str(tmp_path))
+    store.append("Indoor", "Pressure", 1000, 1015)
+    metrics = [
+        {"device": "Indoor", "sensor": "Pressure", "measurement": 1012, "time": None},
+        {"device": "Indoor", "sensor": "wifi_status", "measurement": "on"},
+    ]
+
+    extra = derived.derive_metrics(metrics, 1000 + derived.TREND_SECONDS, store)
+
+    trend = [m for m in extra if m["sensor"] == "PressureTrend"]
+    assert trend == [
+        {
+            "device": "Indoor",
+            "sensor": "PressureTrend",
+            "measurement": -3,
+            "module": None,
+            "time": 1000 + derived.TREND_SECONDS,
+        }
+    ]
@@ -0,0 +1,61 @@
+"""Tests for the device_mirror module"""
+
+from home_automation.device_mirror import DeviceStateMirror
+
+
+def test_only_changed_versions_are_read():
+    """Devices whose lastChanged hasn't moved are not read again"""
+    mirror = DeviceStateMirror()
+    listing = [
+        {"name": "Humidity", "lastChanged": "10:00"},
+        {"name": "Temperature", "lastChanged": "10:00"},
+    ]
+    states = {"Humidity": 40, "Temperature": 70}
+    fetched = []
+
+    def fetch(device):
+        """Returns the current state and remembers what was read"""
+        fetched.append(device["name"])
+        return states[device["name"]]
+
+    assert mirror.sync(listing, fetch) == 2
+    listing[1]["lastChanged"] = "10:05"
+    states["Temperature"] = 71
+    assert mirror.sync(listing, fetch) == 1
+    assert fetched == ["Humidity", "Temperature", "Temperature"]
+    assert mirror.get("Temperature") == 71
+
+
+def test_max_age_without_versions():
+    """Without versions a device is read again once its copy is too old"""
+    mirror = DeviceStateMirror(max_age=60)
+    mirror.update("Humidity", 40, now=1000)
+    assert not mirror.needs_refresh("Humidity", now=1059)
+    assert mirror.needs_refresh("Humidity", now=1060)
+
+
+def test_diff_returns_only_unseen_changes():
+    """Each consumer sees a change once, and unchanged reads are not changes"""
+    mirror = DeviceStateMirror()
+    mirror.update("Humidity", 40)
+    mirror.update("Temperature", 70)
+    assert mirror.diff("metrics") == {"Humidity": 40, "Temperature": 70}
+
+    mirror.update("Humidity", 40)
+    mirror.update("Temperature", 71)
+    assert mirror.diff("metrics") == {"Temperature": 71}
+    assert mirror.diff("metrics") == {}
+    assert mirror.diff("other") == {"Humidity": 40, "Temperature": 71}
+
+
+def test_mirror_persists(tmp_path):
+    """The states and the consumers' positions survive to the next run"""
+    path = str(tmp_path / "states.json")
+    mirror = DeviceStateMirror(path)
+    mirror.sync([{"name": "Humidity"}], lambda device: 40)
+    mirror.diff("metrics")
+    mirror.save()
+
+    again = DeviceStateMirror(path)
+    assert again.get("Humidity") == 40
+    assert again.diff("metrics") == {}
@@ -0,0 +1,109 @@
+"""Tests for the digest module"""
+
+import pytest
+
+from home_automation import columnar, digest, utilities
+from home_automation.columnar import ColumnStore
+from home_automation.digest import RollupCache
+
+DAY = 86400
+# Midnight UTC, 2024-01-10
+MIDNIGHT = 1704844800
+
+
+@pytest.fixture
+def store(tmp_path) -> ColumnStore:
+    """Two days of readings, forecasts and multipliers"""
+    store = ColumnStore(str(tmp_path / "columns"))
+    for day, (low, high, rain) in enumerate([(10, 20, 2.54), (0, 30, 0)]):
+        start = MIDNIGHT - (2 - day) * DAY
+        store.append(
+            "netatmo",
+            {
+                columnar.TIME: [start + 3600, start + 7200, start + 7200],
+                "device": ["Outdoor", "Outdoor", "Rain"],
+                "sensor": ["Temperature", "Temperature", "sum_rain_24"],
+                "value": [low, high, rain * 10],
+            },
+        )
+        store.append(
+            "indigo",
+            {
+                columnar.TIME: [start + 3600],
+                "device": ["office"],
+                "sensor": ["temp"],
+                "value": [68 + day],
+            },
+        )
+        store.append(
+            "forecast_daily",
+            {
+                columnar.TIME: [start + 6 * 3600, start + 6 * 3600],
+                "issued": [start - DAY, start + 3600],
+                "rainAccumulation": [0.5 + day, 9.0],
+            },
+        )
+        store.append("sprinkler", {columnar.TIME: [start + 3600], "multiplier": [day]})
+    return store
+
+
+def test_day_ranges():
+    """The days before the given time, from local midnight to midnight"""
+    assert digest.day_ranges(MIDNIGHT + 5, 2, "UTC") == [
+        (MIDNIGHT - 2 * DAY, MIDNIGHT - DAY),
+        (MIDNIGHT - DAY, MIDNIGHT),
+    ]
+    denver = digest.day_ranges(MIDNIGHT + DAY, 1)
+    assert denver[0][1] - denver[0][0] == DAY
+    assert denver[0][0] % DAY == 7 * 3600
+
+
+def test_weekly_digest(store):
+    """Days and sensors are summarised over the whole range"""
+    summary = digest.weekly_digest(store, end=MIDNIGHT, days=2, timezone="UTC")
+
+    days = summary["days"]
+    assert list(days["multiplier"]) == [0, 1]
+    assert list(days["forecast_rain"]) == [0.5, 1.5]
+    assert list(days["observed_rain"]) == pytest.approx([1, 0])
+
+    sensors = summary["sensors"]
+    outdoor = sensors.loc[("netatmo", "Outdoor", "Temperature")]
+    assert (outdoor["min"], outdoor["max"], outdoor["mean"]) == (0, 30, 15)
+    assert outdoor["count"] == 4
+    assert sensors.loc[("indigo", "office", "temp"), "mean"] == 68.5
+
+
+def test_rollups_are_cached(mocker, store):
+    """Finished days are read once, a digest overlapping them reuses them"""
+    cache = RollupCache()
+    read = mocker.spy(store, "read_frame")
+    digest.weekly_digest(store, cache, end=MIDNIGHT, days=2, timezone="UTC")
+    reads = read.call_count
+
+    digest.weekly_digest(store, cache, end=MIDNIGHT + DAY, days=3, timezone="UTC")
+
+    assert cache.hits == 2
+    assert read.call_count == reads + reads // 2  # Only the new day was read
+
+
+def test_recent_days_are_not_cached(store):
+    """A day that just ended may still get late readings"""
+    cache = RollupCache()
+    ranges = [(MIDNIGHT - DAY, MIDNIGHT)]
+    digest.rollups(store, cache, ranges, now=MIDNIGHT + 60)
+    assert cache.entry["rollups"] == {}
+    digest.rollups(store, cache, ranges, now=MIDNIGHT + digest.SETTLE_SECONDS)
+    assert list(cache.entry["rollups"]) == [f"{MIDNIGHT - DAY}-{MIDNIGHT}"]
+
+
+def test_run_emails_the_digest(mocker):
+    """The digest is emailed, and the rollups are saved for the next run"""
+    send_email = mocker.patch("home_automation.utilities.send_email")
+
+    digest.run()
+
+    message = send_email.call_args.args[0]
+    assert message["Subject"].startswith("Weekly digest")
+    assert "<table" in message.get_payload()[1].get_content()
+    assert len(RollupCache.from_settings(utilities.SETTINGS).entry["rollups"]) == 7
@@ -0,0 +1,68 @@
+"""Tests for the evapotranspiration module"""
+
+import numpy as np
+import pytest
+
+from home_automation import evapotranspiration
+
+
+def test_hourly_radiation_sums_to_daily():
+    """The hourly Ra over a day matches the FAO-56 daily value (eq 21)"""
+    start = np.datetime64("2023-10-01T00:00", "s").astype("int64")
+    hours = start + np.arange(24) * 3600
+    ra = evapotranspiration.extraterrestrial_radiation(hours, 16.2, -16.25)
+    assert ra.sum() == pytest.approx(34.77, abs=0.1)
+    assert ra[0] == 0  # Midnight
+
+
+def test_reference_et_fao_example():
+    """FAO-56 example 19, N'Diaye Senegal between 14:00 and 15:00"""
+    hour = np.datetime64("2023-10-01T14:00", "s").astype("int64")
+    et0 = evapotranspiration.reference_et(
+        38, 52, 3.3, 2.450 / 0.0036, hour, 16.2, -16.25, 8
+    )
+    assert et0 == pytest.approx(0.63, abs=0.01)
+
+
+def test_reference_et_grid_matches_per_location():
+    """A grid of locations gives the same result as one location at a time"""
+    rng = np.random.default_rng(1)
+    hours = (
+        np.datetime64("2024-07-01T00:00", "s").astype("int64") + np.arange(120) * 3600
+    )
+    shape = (3, 120)
+    temperature = rng.uniform(15, 35, shape)
+    humidity = rng.uniform(10, 90, shape)
+    wind = rng.uniform(0, 8, shape)
+    solar = rng.uniform(0, 900, shape)
+    latitude = np.array([[39.7], [33.4], [47.6]])
+    longitude = np.array([[-105.0], [-112.1], [-122.3]])
+
+    grid = evapotranspiration.reference_et(
+        temperature, humidity, wind, solar, hours, latitude, longitude, 100
+    )
+    assert grid.shape == shape
+    for row in range(3):
+        single = evapotranspiration.reference_et(
+            temperature[row],
+            humidity[row],
+            wind[row],
+            solar[row],
+            hours,
+            latitude[row, 0],
+            longitude[row, 0],
+            100,
+        )
+        np.testing.assert_allclose(grid[row], single)
+
+
+def test_water_deficit_and_multiplier():
+    """Rain offsets the demand and the deficit maps onto the 0-4 scale"""
+    et0 = np.full(48, 0.25)  # 6 mm a day
+    assert evapotranspiration.water_deficit(et0, np.zeros(48)) == pytest.approx(9.6)
+    assert evapotranspiration.water_deficit(et0, np.full(48, 1)) < 0
+
+    assert evapotranspiration.deficit_to_multiplier(-5) == 0
+    assert evapotranspiration.deficit_to_multiplier(2) == 1
+    assert evapotranspiration.deficit_to_multiplier(5) == 3
+    assert evapotranspiration.deficit_to_multiplier(150) == 4
@@ -0,0 +1,54 @@
+"""Tests for the exposition module"""
+
+import urllib.error
+import urllib.request
+
+import pytest
+
+from home_automation import exposition
+
+
+def test_render_format(gauges):
+    """Gauges are rendered sorted, with their help, labels escaped and names
+    made valid
+    """
+    gauges.set("netatmo_Temperature", 71.6, {"device": "Outdoor"})
+    gauges.set("netatmo_temperature", 68, {"device": 'Say "hi"'})
+    gauges.set("sprinkler_multiplier", 1.2, help_text="The multiplier")
+    assert gauges.render().decode("utf-8").splitlines() == [
+        "# TYPE netatmo_temperature gauge",
+        'netatmo_temperature{device="Outdoor"} 71.6',
+        r'netatmo_temperature{device="Say \"hi\""} 68.0',
+        "# HELP sprinkler_multiplier The multiplier",
+        "# TYPE sprinkler_multiplier gauge",
+        "sprinkler_multiplier 1.2",
+    ]
+
+
+def test_render_is_cached_until_a_change(gauges):
+    """Unchanged and non numeric values don't invalidate the rendered page"""
+    assert gauges.set("job_success", True, {"job": "netatmo"})
+    page = gauges.render()
+    assert not gauges.set("job_success", 1.0, {"job": "netatmo"})
+    assert not gauges.set("job_success", "n/a", {"job": "netatmo"})
+    assert gauges.render() is page
+
+    assert gauges.set("job_success", False, {"job": "netatmo"})
+    assert gauges.render() is not page
+    assert gauges.get("job_success", {"job": "netatmo"}) == 0.0
+
+
+def test_server(gauges):
+    """The registry is served on /metrics, and nothing else"""
+    gauges.set("api_budget", 20, {"api": "netatmo"})
+    server = exposition.start_server(0, "127.0.0.1", gauges)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            assert response.headers["Content-Type"] == exposition.CONTENT_TYPE
+            assert b'api_budget{api="netatmo"} 20.0' in response.read()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"{url}/")
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,67 @@
+"""Tests for the forecast_accuracy module"""
+
+import pandas as pd
+import pytest
+
+from home_automation import forecast_accuracy
+from home_automation.columnar import ColumnStore
+
+DAY = 86400
+# 2024-01-15 00:00 America/Denver, in epoch seconds
+MIDNIGHT = int(pd.Timestamp("2024-01-15", tz="America/Denver").timestamp())
+
+
+@pytest.fixture
+def store(tmp_path):
+    """Two observed days, and forecasts for them issued one and two days out"""
+    store = ColumnStore(str(tmp_path / "columns"))
+    hours = [MIDNIGHT + h * 3600 for h in range(48)]
+    store.append(
+        "netatmo",
+        {
+            "time": hours * 2,
+            "device": ["Outdoor"] * 48 + ["Rain"] * 48,
+            "sensor": ["Temperature"] * 48 + ["sum_rain_24"] * 48,
+            # 60F then 70F highs, and 25.4 mm of rain on the first day only
+            "value": [50 + h % 24 / 2.3 for h in range(24)]
+            + [60 + h % 24 / 2.3 for h in range(24)]
+            + [h * 25.4 / 23 for h in range(24)]
+            + [0.0] * 24,
+        },
+    )
+    # Forecast days start at 06:00 local time
+    days = [MIDNIGHT + 6 * 3600, MIDNIGHT + DAY + 6 * 3600]
+    store.append(
+        "forecast_daily",
+        {
+            "time": days + days,
+            "issued": [day - DAY for day in days] + [day - 2 * DAY for day in days],
+            "rainAccumulation": [1.5, 0.0, 0.5, 0.2],
+            "temperature": [62, 68, 58, 75],
+        },
+    )
+    return store
+
+
+def test_observed_daily(store):
+    """Readings roll up to local days of rain in inches and high temperature"""
+    observed = forecast_accuracy.observed_daily(store)
+    assert len(observed) == 2
+    assert observed["observed_rain"].tolist() == pytest.approx([1.0, 0.0])
+    assert observed["observed_temperature"].tolist() == pytest.approx([60, 70])
+
+
+def test_report_per_lead_time(store):
+    """Forecast errors are grouped by how far ahead they were issued"""
+    report = forecast_accuracy.report(store)
+    assert report.index.tolist() == [1, 2]
+    assert report.loc[1, "rain_bias"] == pytest.approx(0.25)
+    assert report.loc[1, "rain_mae"] == pytest.approx(0.25)
+    assert report.loc[2, "temperature_bias"] == pytest.approx(1.5)
+    assert report.loc[2, "temperature_rmse"] == pytest.approx(14.5**0.5)
+    assert report.loc[2, "temperature_count"] == 2
+
+
+def test_report_without_data(tmp_path):
+    """Nothing archived yet gives an empty report"""
+    assert forecast_accuracy.report(ColumnStore(str(tmp_path))).empty
@@ -0,0 +1,174 @@
+"""Tests for the indigo_metrics module"""
+
+import json
+from unittest.mock import Mock
+
+import pytest
+from pydantic import SecretStr
+
+from home_automation import indigo_metrics, utilities
+
+DEVICES = [
+    {"name": "Computer Room Humidity", "restURL": "/devices/computer-humidity.json"},
+    {"name": "Garage Door", "restURL": "/devices/garage-door.json"},
+]
+
+
+@pytest.fixture
+def settings():
+    """Settings with the Indigo credentials the listing needs"""
+    return Mock(
+        indigo_url="http://indigo", indigo_username="u", indigo_password=SecretStr("p")
+    )
+
+
+def response(status_code=200, devices=None, headers=None):
+    """A fake response from the devices listing"""
+    mock = Mock(status_code=status_code, headers=headers or {})
+    mock.iter_content.return_value = [json.dumps(devices).encode("utf-8")]
+    return mock
+
+
+def test_fresh_cache_skips_listing(mocker, settings):
+    """Within the TTL the index is served without asking Indigo"""
+    get = mocker.patch("requests.get", return_value=response(devices=DEVICES))
+    cache = indigo_metrics.DeviceListCache(ttl=3600)
+
+    urls = indigo_metrics.device_urls(["Garage Door"], settings, cache=cache)
+    again = indigo_metrics.device_urls(["Garage Door"], settings, cache=cache)
+
+    assert urls == again == {"Garage Door": "/devices/garage-door.json"}
+    assert get.call_count == 1
+
+
+def test_stale_cache_revalidates(mocker, settings):
+    """After the TTL the ETag is sent back and a 304 keeps the cached list"""
+    get = mocker.patch(
+        "requests.get",
+        side_effect=[
+            response(devices=DEVICES, headers={"ETag": '"v1"'}),
+            response(status_code=304),
+        ],
+    )
+    cache = indigo_metrics.DeviceListCache(ttl=0)
+
+    indigo_metrics.getIndigoDevices(settings, cache=cache)
+    devices = indigo_metrics.getIndigoDevices(settings, cache=cache)
+
+    assert devices == DEVICES
+    assert get.call_args.kwargs["headers"] == {"If-None-Match": '"v1"'}
+
+
+def test_device_urls_and_auth(mocker):
+    """Device paths are joined to the Indigo URL, and without an Indigo user
+    the API key is sent
+    """
+    get = mocker.patch(
+        "requests.get", return_value=Mock(status_code=200, json=lambda: {})
+    )
+    settings = utilities.Settings(indigo_url="http://indigo:8000")
+
+    indigo_metrics.getIndigoDevice("/devices/garage-door.json", settings)
+
+    assert get.call_args.args[0] == "http://indigo:8000/devices/garage-door.json"
+    assert get.call_args.kwargs["headers"]["Authorization"] == "Bearer x"
+    assert "auth" not in get.call_args.kwargs
+
+
+def test_content_hash_without_validators():
+    """Without validators the content hash tells if the inventory changed"""
+    cache = indigo_metrics.DeviceListCache(ttl=0)
+    assert cache.store(DEVICES)
+    assert not cache.store([dict(device) for device in DEVICES])
+    assert cache.store(DEVICES[:1])
+    assert list(cache.entry["index"]) == ["Computer Room Humidity"]
+
+
+def test_unknown_name_refreshes_index(mocker, settings):
+    """A device added since the list was cached is found by revalidating"""
+    mocker.patch(
+        "requests.get",
+        side_effect=[response(devices=DEVICES[:1]), response(devices=DEVICES)],
+    )
+    cache = indigo_metrics.DeviceListCache(ttl=3600)
+    indigo_metrics.getIndigoDevices(settings, cache=cache)
+
+    urls = indigo_metrics.device_urls(["Garage Door", "Missing"], settings, cache=cache)
+
+    assert urls == {"Garage Door": "/devices/garage-door.json"}
+
+
+def test_cache_persists(tmp_path, mocker, settings):
+    """A new cache on the same file, like the next job run, is warm"""
+    get = mocker.patch("requests.get", return_value=response(devices=DEVICES))
+    path = str(tmp_path / "devices.json")
+    indigo_metrics.getIndigoDevices(
+        settings, cache=indigo_metrics.DeviceListCache(path)
+    )
+
+    devices = indigo_metrics.getIndigoDevices(
+        settings, cache=indigo_metrics.DeviceListCache(path)
+    )
+
+    assert devices == DEVICES
+    assert get.call_count == 1
+
+
+@pytest.fixture
+def indigo_device(mocker, monkeypatch):
+    """One logged device, its state and version, and the mocked requests.get"""
+    monkeypatch.setattr(utilities.SETTINGS, "metrics_push", False)
+    monkeypatch.setattr(
+        indigo_metrics,
+        "INDIGO_DEVICES",
+        [{"name": "Computer Room Humidity", "metric": "humidity", "device": "room"}],
+    )
+    state = {"value": 70, "version": "v1"}
+
+    def get(url, **kwargs):
+        """Serve the device list and the device's current state"""
+        if url.endswith("devices.json"):
+            listing = [dict(DEVICES[0], lastChanged=state["version"])]
+            return response(devices=listing)
+        return Mock(status_code=200, json=lambda: {"displayRawState": state["value"]})
+
+    return state, mocker.patch("requests.get", side_effect=get)
+
+
+def device_reads(get) -> int:
+    """The number of GETs of a single device"""
+    return sum(not call.args[0].endswith("devices.json") for call in get.call_args_list)
+
+
+def test_unchanged_run_reads_no_devices(indigo_device):
+    """With the default settings a run within the device list TTL trusts the
+    mirrored states, it makes no request per device
+    """
+    _, get = indigo_device
+    indigo_metrics.run()
+    assert device_reads(get) == 1
+
+    indigo_metrics.run()
+
+    assert device_reads(get) == 1
+
+
+def test_change_within_ttl_is_read(indigo_device, mocker):
+    """A device that changes while the device list is cached is read again
+    once its mirrored state is indigo_state_max_age old, the cached
+    lastChanged can't tell that it changed
+    """
+    state, _ = indigo_device
+    clock = mocker.patch("time.time", return_value=1700000000.0)
+    indigo_metrics.run()
+    state.update(value=75, version="v2")
+    clock.return_value += utilities.SETTINGS.indigo_state_max_age
+
+    indigo_metrics.run()
+
+    assert (
+        indigo_metrics.mirror_from_settings(utilities.SETTINGS).get(
+            "Computer Room Humidity"
+        )
+        == 75
+    )
@@ -0,0 +1,66 @@
+"""Tests for the indigo_variables module"""
+
+from unittest.mock import Mock
+
+from home_automation.indigo_variables import VariableResolver
+
+VARIABLES = [
+    {"id": 101, "name": "Netatmo_Outside_Temp", "value": "71.2"},
+    {"id": 102, "name": "sprinklerDurationMultiplier", "value": "2"},
+]
+
+
+def test_names_resolve_with_one_fetch():
+    """Names cost one fetch, then dict lookups, and ids pass straight through"""
+    fetch = Mock(return_value=VARIABLES)
+    resolver = VariableResolver(fetch)
+
+    assert resolver.resolve("Netatmo_Outside_Temp") == 101
+    assert resolver.resolve("sprinklerDurationMultiplier") == 102
+    assert resolver.resolve(7) == 7
+    assert resolver.resolve("8") == 8
+    assert fetch.call_count == 1
+
+
+def test_miss_refreshes_once():
+    """An unknown name refetches the list, and is remembered as missing"""
+    fetch = Mock(side_effect=[VARIABLES[:1], VARIABLES, VARIABLES])
+    resolver = VariableResolver(fetch)
+
+    assert resolver.resolve("Netatmo_Outside_Temp", now=1000) == 101
+    assert resolver.resolve("sprinklerDurationMultiplier", now=1000) == 102
+    assert resolver.resolve("typo", now=1000) is None
+    assert resolver.resolve("typo", now=1000) is None
+    assert fetch.call_count == 3
+
+
+def test_ttl_and_invalidate():
+    """The index is fetched again after the TTL or when invalidated"""
+    fetch = Mock(return_value=VARIABLES)
+    resolver = VariableResolver(fetch, ttl=60)
+
+    resolver.resolve("Netatmo_Outside_Temp", now=1000)
+    resolver.resolve("Netatmo_Outside_Temp", now=1059)
+    assert fetch.call_count == 1
+    resolver.resolve("Netatmo_Outside_Temp", now=1060)
+    assert fetch.call_count == 2
+    resolver.invalidate()
+    resolver.resolve("Netatmo_Outside_Temp", now=1061)
+    assert fetch.call_count == 3
+
+
+def test_index_persists(tmp_path):
+    """The next run resolves names from the file without fetching"""
+    path = str(tmp_path / "variables.json")
+    VariableResolver(Mock(return_value=VARIABLES), path).resolve("x")
+    fetch = Mock(return_value=VARIABLES)
+    assert VariableResolver(fetch, path).resolve("Netatmo_Outside_Temp") == 101
+    assert fetch.call_count == 0
+
+
+def test_unreachable_indigo_keeps_index():
+    """A failed fetch keeps the old index"""
+    fetch = Mock(side_effect=[VARIABLES, None])
+    resolver = VariableResolver(fetch, ttl=60)
+    resolver.resolve("Netatmo_Outside_Temp", now=1000)
+    assert resolver.resolve("Netatmo_Outside_Temp", now=2000) == 101
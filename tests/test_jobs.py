@@ -0,0 +1,158 @@
+"""Tests for the jobs module"""
+
+import http.client
+import json
+import subprocess
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+from home_automation import jobs, utilities
+
+
+@pytest.fixture
+def fake_jobs(monkeypatch):
+    """Two slow jobs and a failing one, registered as importable modules"""
+    calls = {}
+
+    def make_job(name, seconds=0.0, fail=False):
+        """A module whose run() sleeps, or exits like a job with a fatal error"""
+
+        def run(settings=None, session=None, processes=None):
+            """Records its arguments"""
+            calls[name] = (settings, session, processes)
+            time.sleep(seconds)
+            if fail:
+                sys.exit(255)
+
+        module = types.ModuleType(f"fake_jobs.{name}")
+        module.run = run
+        monkeypatch.setitem(sys.modules, module.__name__, module)
+        return module.__name__
+
+    monkeypatch.setattr(
+        jobs,
+        "JOBS",
+        {
+            "slow": make_job("slow", 0.3),
+            "slower": make_job("slower", 0.3),
+            "broken": make_job("broken", fail=True),
+        },
+    )
+    monkeypatch.setattr(jobs, "PROCESS_JOBS", {"slow"})
+    return calls
+
+
+def test_run_all_is_concurrent(fake_jobs):
+    """Jobs overlap, so the run takes about as long as the slowest job"""
+    start = time.perf_counter()
+    results = jobs.run_all(["slow", "slower"])
+    assert time.perf_counter() - start < 0.55
+    assert results["slow"][0] is None and results["slower"][0] is None
+
+
+def test_run_all_shares_settings_and_session(fake_jobs):
+    """Every job gets the same settings and session, the process pool only
+    goes to jobs that use one
+    """
+    jobs.run_all()
+    slow_settings, slow_session, processes = fake_jobs["slow"]
+    slower_settings, slower_session, no_processes = fake_jobs["slower"]
+    assert slow_settings is slower_settings
+    assert slow_session is slower_session
+    assert processes is not None and no_processes is None
+
+
+def test_run_all_isolates_failures(fake_jobs):
+    """A job exiting doesn't stop the others, and the exit status says so"""
+    results = jobs.run_all(["broken", "slow"])
+    assert isinstance(results["broken"][0], SystemExit)
+    assert results["slow"][0] is None
+    assert jobs.main(["run-all", "broken"]) == 1
+
+
+def test_main_rejects_unknown_jobs(fake_jobs):
+    """Typos are reported instead of silently running nothing"""
+    with pytest.raises(SystemExit):
+        jobs.main(["run-all", "slwo"])
+
+
+def test_main_runs_all_jobs(fake_jobs, monkeypatch):
+    """all runs every job, the optional ones too"""
+    monkeypatch.setattr(jobs, "OPTIONAL_JOBS", {"slower"})
+    assert jobs.main(["run-all", "all"]) == 1
+    assert set(fake_jobs) == {"slow", "slower", "broken"}
+
+
+def test_serve_exposes_job_timings(fake_jobs, gauges, mocker):
+    """Each run's timings are recorded, and serving stops when asked to"""
+    stop = threading.Event()
+    server = mocker.patch("home_automation.exposition.start_server")
+    api_server = mocker.patch("home_automation.read_api.start_server")
+    original = jobs.run_all
+
+    def run_once(*args, **kwargs):
+        """Stops the loop after the first run"""
+        stop.set()
+        return original(*args, **kwargs)
+
+    mocker.patch("home_automation.jobs.run_all", side_effect=run_once)
+    jobs.serve(["slow", "broken"], interval=60, port=0, stop=stop)
+    server.return_value.shutdown.assert_called_once()
+    api_server.return_value.shutdown.assert_called_once()
+    assert gauges.get("job_success", {"job": "slow"}) == 1.0
+    assert gauges.get("job_success", {"job": "broken"}) == 0.0
+    assert gauges.get("job_duration_seconds", {"job": "slow"}) >= 0.3
+
+
+def test_serve_leaves_out_the_sprinkler(mocker):
+    """The sprinkler emails every run, serve only runs it when named"""
+    stop = threading.Event()
+    mocker.patch("home_automation.exposition.start_server")
+    mocker.patch("home_automation.read_api.start_server")
+    run_all = mocker.patch(
+        "home_automation.jobs.run_all", side_effect=lambda *args: stop.set()
+    )
+    jobs.serve(interval=0, port=0, stop=stop)
+    names = run_all.call_args.args[0]
+    assert "sprinkler" not in names and "netatmo" in names
+    assert not set(names) & jobs.OPTIONAL_JOBS
+
+
+def test_serve_publishes_what_another_process_persisted(tmp_path, gauges, mocker):
+    """The multiplier a separate sprinkler run saved is served by the API"""
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys\n"
+            "from home_automation import read_api\n"
+            "read_api.persist(sys.argv[1], {'multiplier': {'multiplier': 3}}, 100)",
+            str(tmp_path),
+        ],
+        check=True,
+    )
+    settings = utilities.SETTINGS.model_copy(
+        update={"state_dir": str(tmp_path), "api_port": 0}
+    )
+    mocker.patch("home_automation.exposition.start_server")
+    api_server = mocker.spy(jobs.read_api, "start_server")
+    stop = threading.Event()
+    served = []
+
+    def fetch_once(*args):
+        """Requests the multiplier from the running API, then stops"""
+        port = api_server.spy_return.server_address[1]
+        connection = http.client.HTTPConnection("127.0.0.1", port)
+        connection.request("GET", "/api/multiplier")
+        served.append(json.loads(connection.getresponse().read()))
+        connection.close()
+        stop.set()
+
+    mocker.patch("home_automation.jobs.run_all", side_effect=fetch_once)
+    jobs.serve(["netatmo"], interval=0, port=0, settings=settings, stop=stop)
+    assert served == [{"updated": 100, "data": {"multiplier": 3}}]
+    assert gauges.get("sprinkler_multiplier") == 3
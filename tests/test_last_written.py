@@ -0,0 +1,48 @@
+"""Tests for the last_written module"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from home_automation.last_written import LastWrittenStore
+
+
+def test_first_write_is_needed():
+    """Nothing has been written yet, so any value should be written"""
+    store = LastWrittenStore()
+    assert store.should_write(1, "72.5")
+
+
+def test_unchanged_value_is_skipped():
+    """Writing the same value again is skipped until the refresh interval"""
+    store = LastWrittenStore(refresh_seconds=60)
+    store.record(1, "on", now=1000)
+    assert not store.should_write(1, "on", now=1030)
+    assert store.should_write(1, "off", now=1030)
+    assert store.should_write(1, "on", now=1060)
+
+
+def test_numeric_deadband():
+    """Numeric values within the deadband count as unchanged"""
+    store = LastWrittenStore(deadband=0.5)
+    store.record(1, 72.0, now=1000)
+    assert not store.should_write(1, "72", now=1001)
+    assert not store.should_write(1, 72.4, now=1001)
+    assert store.should_write(1, 72.6, now=1001)
+    assert store.should_write(1, 72.4, deadband=0, now=1001)
+
+
+def test_persisted_between_instances(tmp_path):
+    """Values recorded by one store are seen by the next run's store"""
+    path = str(tmp_path / "writes.json")
+    LastWrittenStore(path=path).record(1, 3)
+    assert not LastWrittenStore(path=path).should_write(1, 3)
+
+
+def test_concurrent_records_are_all_persisted(tmp_path):
+    """Records made from several threads all reach the file"""
+    path = str(tmp_path / "last_written.json")
+    store = LastWrittenStore(path)
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda key: store.record(key, key, now=1000), range(200)))
+
+    reloaded = LastWrittenStore(path)
+    assert len(reloaded.values) == 200
@@ -0,0 +1,130 @@
+"""Tests for the magic_mirror module"""
+
+import json
+from unittest.mock import Mock
+
+from home_automation import magic_mirror
+
+
+def test_debouncer_coalesces_changes():
+    """Only the value that settles for the window is released"""
+    debouncer = magic_mirror.Debouncer(window=1.0)
+    debouncer.offer(70, now=0)
+    debouncer.offer(71, now=0.5)
+    assert debouncer.due(now=1.0) == (False, None)
+    assert debouncer.timeout(now=1.0) == 0.5
+    assert debouncer.due(now=1.5) == (True, 71)
+
+
+def test_debouncer_skips_value_already_sent():
+    """A value equal to the last one pushed is not released again"""
+    debouncer = magic_mirror.Debouncer(window=0)
+    debouncer.sent(71)
+    debouncer.offer(71, now=0)
+    assert debouncer.timeout() is None
+    debouncer.offer(72, now=0)
+    debouncer.offer(71, now=0)
+    assert debouncer.due(now=0) == (False, None)
+
+
+def test_variable_value_messages():
+    """Values are found in update, refresh and patch messages"""
+    update = {"message": "update", "objectDict": {"id": 5, "value": "71"}}
+    refresh = {"message": "refresh", "list": [{"name": "office", "value": "72"}]}
+    patch = {
+        "message": "patch",
+        "objectId": 5,
+        "patch": [["change", "value", ["71", "73"]]],
+    }
+    other = {"message": "update", "objectDict": {"id": 6, "value": "1"}}
+
+    assert magic_mirror.variable_value(update, 5) == (True, "71")
+    assert magic_mirror.variable_value(refresh, "office") == (True, "72")
+    assert magic_mirror.variable_value(patch, 5) == (True, "73")
+    assert magic_mirror.variable_value(other, 5) == (False, None)
+
+
+def test_poll_pushes_only_changes(mocker):
+    """Polling the same value repeatedly results in a single push"""
+    mocker.patch("time.sleep")
+    mocker.patch(
+        "home_automation.utilities.get_indigo_variable",
+        side_effect=["70", "70", "70", "71"],
+    )
+    push = mocker.patch(
+        "home_automation.utilities.update_magicmirror_internal_temperature",
+        return_value=True,
+    )
+    pusher = magic_mirror.MirrorPusher("office", debounce=0, session=Mock())
+    calls = iter(range(5))
+
+    pusher.poll(lambda: next(calls) == 4)
+
+    assert [call.args[0] for call in push.call_args_list] == ["70", "71"]
+    assert pusher.pushes == 2
+
+
+def test_variable_followed_by_name(mocker, indigo_variables):
+    """Patches only carry the object id, a variable followed by name is
+    resolved to it
+    """
+    indigo_variables.fetch = lambda: [{"id": 5, "name": "office", "value": "70"}]
+    patch = {
+        "message": "patch",
+        "objectId": 5,
+        "patch": [["change", "value", ["70", "74"]]],
+    }
+    feed = mocker.Mock()
+    feed.recv.return_value = json.dumps(patch)
+    websocket = mocker.patch("home_automation.magic_mirror.websocket")
+    websocket.create_connection.return_value = feed
+    push = mocker.patch(
+        "home_automation.utilities.update_magicmirror_internal_temperature",
+        return_value=True,
+    )
+    pusher = magic_mirror.MirrorPusher("office", debounce=0, session=Mock())
+    calls = iter(range(5))
+
+    pusher.follow_feed(lambda: pusher.pushes > 0 or next(calls) == 4)
+
+    assert magic_mirror.variable_value(patch, "office") == (False, None)
+    push.assert_called_once_with("74", session=pusher.session)
+
+
+def test_run_reloads_settings_between_cycles(mocker):
+    """Rotated credentials are picked up before polling again"""
+    mocker.patch("home_automation.magic_mirror.websocket", None)
+    reload = mocker.patch("home_automation.utilities.SETTINGS_LOADER.reload_if_changed")
+    pusher = magic_mirror.MirrorPusher("office", session=Mock())
+    poll = mocker.patch.object(pusher, "poll")
+    calls = iter(range(5))
+
+    pusher.run(lambda: next(calls) == 2)
+
+    assert reload.call_count == 2
+    assert poll.call_count == 2
+
+
+def test_failed_push_is_retried(mocker):
+    """A value the mirror didn't accept is pushed again after the retry delay,
+    even though the variable didn't change again
+    """
+    push = mocker.patch(
+        "home_automation.utilities.update_magicmirror_internal_temperature",
+        side_effect=[False, True],
+    )
+    pusher = magic_mirror.MirrorPusher(
+        "office", debounce=0, poll_interval=5, session=Mock()
+    )
+    pusher.debouncer.offer("70", now=0)
+
+    pusher.flush(now=0)
+    assert pusher.pushes == 0
+    assert pusher.debouncer.timeout(now=1) == 4
+    pusher.flush(now=1)
+    assert push.call_count == 1
+
+    pusher.flush(now=5)
+    assert [call.args[0] for call in push.call_args_list] == ["70", "70"]
+    assert pusher.pushes == 1
+    assert pusher.debouncer.timeout() is None
@@ -0,0 +1,257 @@
+"""Tests for the netatmo module"""
+
+import json
+from unittest.mock import Mock
+
+import pytest
+
+from home_automation import netatmo
+
+
+@pytest.fixture
+def stations_data():
+    """A trimmed down getstationsdata body with one station and one module"""
+    return {
+        "devices": [
+            {
+                "_id": "70:ee:50:00:00:01",
+                "module_name": "Indoor",
+                "data_type": ["Temperature", "CO2"],
+                "modules": [
+                    {
+                        "_id": "06:00:00:00:00:01",
+                        "module_name": "Wind Gauge",
+                        "data_type": ["Wind"],
+                    }
+                ],
+            }
+        ]
+    }
+
+
+@pytest.fixture
+def no_throttle(mocker):
+    """Don't wait between requests in tests"""
+    mocker.patch("home_automation.netatmo._throttle")
+
+
+def test_convert_celsius_to_fahrenheit():
+    """Known values convert correctly"""
+    assert netatmo.convert_celsius_to_fahrenheit(0) == 32
+    assert netatmo.convert_celsius_to_fahrenheit(100) == 212
+
+
+def test_line_protocol_escapes_device():
+    """Spaces in module names are escaped for the line protocol"""
+    line = netatmo.line_protocol("WindStrength", "Wind Gauge", 3, 1000)
+    assert line == r"WindStrength,device=Wind\ Gauge,product=netatmo value=3 1000"
+
+
+def test_iter_sensors(stations_data):
+    """Wind modules expand to their four sensors"""
+    sensors = list(netatmo.iter_sensors(stations_data))
+    assert sensors == [
+        ("70:ee:50:00:00:01", None, "Indoor", ["Temperature", "CO2"]),
+        (
+            "70:ee:50:00:00:01",
+            "06:00:00:00:00:01",
+            "Wind Gauge",
+            ["WindStrength", "WindAngle", "GustStrength", "GustAngle"],
+        ),
+    ]
+
+
+def test_api_request_backs_off_when_rate_limited(mocker, no_throttle):
+    """A 429 is retried after the Retry-After delay"""
+    limited = Mock(status_code=429, headers={"Retry-After": "1"})
+    ok = Mock(status_code=200)
+    ok.json.return_value = {"body": {"devices": []}}
+    mock_post = mocker.patch("requests.post", side_effect=[limited, ok])
+    mock_sleep = mocker.patch("time.sleep")
+
+    assert netatmo.api_request("getstationsdata", {}) == {"devices": []}
+    assert mock_post.call_count == 2
+    mock_sleep.assert_called_once_with(1.0)
+
+
+def test_iter_measurements_pages(mocker):
+    """Each page starts just after the last timestamp of the previous one"""
+    api_request = mocker.patch(
+        "home_automation.netatmo.api_request",
+        side_effect=[
+            {"200": [2], "100": [1]},
+            {"300": [3]},
+            {},
+        ],
+    )
+    pages = list(netatmo.iter_measurements("token", "dev", None, ["CO2"], 0, 1000))
+
+    assert pages == [[(100, [1]), (200, [2])], [(300, [3])]]
+    begins = [call.args[1]["date_begin"] for call in api_request.call_args_list]
+    assert begins == [0, 201, 301]
+
+
+def test_backfill_resumes_from_checkpoint(mocker, tmp_path, stations_data):
+    """Temperatures are converted, batches written with the derived series
+    and a second run only requests what is newer than the checkpoint.
+    """
+    history = {
+        None: [[(100, [20.0, 400]), (200, [None, 410])]],
+        "06:00:00:00:00:01": [[(100, [1, 2, 3, 4])]],
+    }
+
+    def fake_measurements(token, device_id, module_id, sensors, begin, end, scale):
+        """Serve the fake history newer than begin"""
+        for page in history[module_id]:
+            page = [row for row in page if row[0] >= begin]
+            if page:
+                yield page
+
+    mocker.patch(
+        "home_automation.netatmo.iter_measurements", side_effect=fake_measurements
+    )
+    checkpoint = str(tmp_path / "checkpoint.json")
+    batches = []
+
+    written = netatmo.backfill(
+        "token", stations_data, 0, 1000, batches.append, checkpoint, batch_size=2
+    )
+    assert written == 9  # The wind and gusts in mph as well
+    assert "Temperature,device=Indoor,product=netatmo value=68.0 100000" in batches[0]
+    assert any(point.startswith("GustStrength_mph,") for b in batches for point in b)
+
+    batches.clear()
+    assert (
+        netatmo.backfill("token", stations_data, 0, 1000, batches.append, checkpoint)
+        == 0
+    )
+    assert batches == []
+
+
+def test_backfill_earlier_range_after_later_one(mocker, tmp_path, stations_data):
+    """A completed backfill of a later range doesn't stop an earlier one"""
+    history = [(100, [20.0, 400]), (600, [21.0, 410])]
+
+    def fake_measurements(token, device_id, module_id, sensors, begin, end, scale):
+        """Serve the station's history between begin and end"""
+        if module_id is None:
+            page = [row for row in history if begin <= row[0] <= end]
+            if page:
+                yield page
+
+    mocker.patch(
+        "home_automation.netatmo.iter_measurements", side_effect=fake_measurements
+    )
+    checkpoint = str(tmp_path / "checkpoint.json")
+    batches = []
+    assert netatmo.backfill(
+        "token", stations_data, 500, 1000, batches.append, checkpoint
+    )
+
+    batches.clear()
+    assert netatmo.backfill("token", stations_data, 0, 400, batches.append, checkpoint)
+    assert all(point.endswith(" 100000") for batch in batches for point in batch)
+
+
+def test_dashboard_metrics(stations_data):
+    """Current readings are flattened, with wind expanded and temperatures in
+    fahrenheit
+    """
+    stations_data["devices"][0]["dashboard_data"] = {
+        "time_utc": 1700000000,
+        "Temperature": 20,
+        "CO2": 450,
+    }
+    stations_data["devices"][0]["wifi_status"] = 56
+    stations_data["devices"][0]["modules"][0]["dashboard_data"] = {
+        "WindStrength": 3,
+        "WindAngle": 90,
+        "GustStrength": 8,
+        "GustAngle": 100,
+    }
+
+    metrics = netatmo.dashboard_metrics(stations_data)
+
+    readings = {(m["device"], m["sensor"]): m["measurement"] for m in metrics}
+    assert readings[("Indoor", "Temperature")] == 68
+    assert readings[("Indoor", "wifi_status")] == 56
+    assert readings[("Wind Gauge", "GustStrength")] == 8
+    assert len(metrics) == 7
+    assert metrics[0]["module"] == "70:ee:50:00:00:01"
+    assert metrics[0]["time"] == 1700000000
+    assert metrics[-1]["time"] is None
+
+
+def test_get_stations_data_streams_devices(mocker, no_throttle, stations_data):
+    """The devices are streamed out of the body, keeping the fields we use"""
+    stations_data["devices"][0]["firmware"] = 180
+    body = json.dumps({"status": "ok", "body": stations_data, "time_exec": 0.1})
+    ok = Mock(status_code=200)
+    ok.iter_content.return_value = [body.encode("utf-8")]
+    mock_post = mocker.patch("requests.post", return_value=ok)
+
+    data = netatmo.get_stations_data("token", "70:ee:50:00:00:01")
+
+    assert mock_post.call_args.kwargs["stream"] is True
+    assert data["devices"][0]["module_name"] == "Indoor"
+    assert "firmware" not in data["devices"][0]
+
+
+def test_line_protocol_adds_tags():
+    """Extra tags are escaped and sorted in with the device and product"""
+    point = netatmo.line_protocol("Temperature", "Outdoor", 70.0, 1, {"account": "a b"})
+    assert (
+        point == r"Temperature,account=a\ b,device=Outdoor,product=netatmo value=70.0 1"
+    )
+
+
+def test_upload_tracker():
+    """Readings of an upload are only kept once, and the next poll is due
+    just after the next upload
+    """
+    tracker = netatmo.UploadTracker(interval=600, margin=30)
+    metrics = [
+        {"module": "a", "sensor": "Temperature", "time": 1000},
+        {"module": "b", "sensor": "Humidity", "time": 1010},
+        {"module": "b", "sensor": "rf_status", "time": None},
+    ]
+    assert tracker.due(0)
+    assert tracker.record(metrics, now=1100) == metrics
+    assert not tracker.due(1100)
+    assert tracker.due(1640)
+
+    metrics[1]["time"] = 1610
+    assert tracker.record(metrics, now=1650) == metrics[1:]
+
+    # The station missed its upload, look again soon
+    assert tracker.record(metrics, now=5000) == metrics[2:]
+    assert tracker.entry["next_poll"] == 5000 + netatmo.OVERDUE_RETRY
+
+
+def test_run_polls_when_an_upload_is_due(mocker, stations_data):
+    """Points are stamped with the upload, and the API isn't asked again until
+    the next upload is due
+    """
+    stations_data["devices"][0]["dashboard_data"] = {
+        "time_utc": 1700000000,
+        "Temperature": 20,
+        "CO2": 450,
+    }
+    stations_data["devices"][0]["modules"] = []
+    mocker.patch("home_automation.netatmo.get_access_token", return_value="token")
+    get_stations_data = mocker.patch(
+        "home_automation.netatmo.get_stations_data", return_value=stations_data
+    )
+    influx = mocker.patch("home_automation.collectors.InfluxDBClient")
+    mocker.patch("time.time", return_value=1700000100)
+
+    netatmo.run()
+    points = influx.return_value.write_points.call_args[0][0]
+    assert points[0].endswith(" 1700000000000")
+
+    netatmo.run()
+    assert get_stations_data.call_count == 1
+
+    netatmo.run(force=True)
+    assert get_stations_data.call_count == 2
+    assert influx.return_value.write_points.call_count == 1
@@ -0,0 +1,179 @@
+"""Tests for the netatmo_accounts module"""
+
+import json
+import time
+from unittest.mock import Mock
+
+import pytest
+import requests
+
+from home_automation import columnar, netatmo_accounts, utilities
+from home_automation.netatmo_accounts import NetatmoAccount, TokenCache
+
+
+def make_account(name: str, **kwargs) -> NetatmoAccount:
+    """An account with made up credentials"""
+    values = {
+        "name": name,
+        "username": f"{name}@example.com",
+        "password": "password",
+        "client_id": "client",
+        "client_secret": "secret",
+    }
+    return NetatmoAccount(**dict(values, **kwargs))
+
+
+def stations(*names) -> dict:
+    """A getstationsdata body with an outdoor module on each named station"""
+    return {
+        "devices": [
+            {
+                "_id": name,
+                "module_name": "Indoor",
+                "data_type": [],
+                "modules": [
+                    {
+                        "_id": f"{name}-outdoor",
+                        "module_name": "Outdoor",
+                        "data_type": ["Temperature"],
+                        "dashboard_data": {
+                            "Temperature": 20.0,
+                            "time_utc": 1700000000,
+                        },
+                    }
+                ],
+            }
+            for name in names
+        ]
+    }
+
+
+def rejected_token() -> requests.HTTPError:
+    """The error Netatmo answers an expired access token with"""
+    response = Mock(status_code=403)
+    response.json.return_value = {"error": {"code": 3, "message": "Expired"}}
+    return requests.HTTPError("403", response=response)
+
+
+def test_load_accounts(tmp_path):
+    """Accounts are read from the file, and names must be unique"""
+    path = tmp_path / "accounts.json"
+    path.write_text(json.dumps([make_account("a").model_dump(mode="json")]))
+    accounts = netatmo_accounts.load_accounts(str(path))
+    assert [account.name for account in accounts] == ["a"]
+
+    entries = [
+        dict(make_account("a").model_dump(mode="json"), password="x") for _ in range(2)
+    ]
+    path.write_text(json.dumps(entries))
+    with pytest.raises(ValueError, match="a"):
+        netatmo_accounts.load_accounts(str(path))
+
+
+def test_token_cache_reuses_and_refreshes(mocker, tmp_path):
+    """A token is reused until it expires, then renewed with the refresh
+    token, and the password is only sent when that fails
+    """
+    request_token = mocker.patch(
+        "home_automation.netatmo.request_token",
+        side_effect=[
+            {"access_token": "one", "refresh_token": "r1", "expires_in": 3600},
+            {"access_token": "two", "refresh_token": "r2", "expires_in": 3600},
+            requests.HTTPError("400"),
+            {"access_token": "three", "refresh_token": "r3", "expires_in": 3600},
+        ],
+    )
+    account = make_account("a")
+    cache = TokenCache(str(tmp_path / "tokens.json"))
+    assert cache.token(account, now=0) == "one"
+    assert cache.token(account, now=1000) == "one"
+    assert request_token.call_count == 1
+
+    assert cache.token(account, now=3590) == "two"
+    assert request_token.call_args[0][0]["grant_type"] == "refresh_token"
+    assert request_token.call_args[0][0]["refresh_token"] == "r1"
+    assert request_token.call_args[0][1] == "client/a@example.com"
+
+    cache.save()
+    reloaded = TokenCache(str(tmp_path / "tokens.json"))
+    assert reloaded.token(account, now=3600) == "two"
+    assert reloaded.token(account, now=8000) == "three"
+    assert request_token.call_args[0][0]["grant_type"] == "password"
+
+
+def test_poll_account_renews_a_rejected_token(mocker):
+    """A revoked token is replaced once, and only the listed stations are kept"""
+    tokens = TokenCache()
+    mocker.patch.object(tokens, "token", side_effect=["old", "new"])
+    get_stations_data = mocker.patch(
+        "home_automation.netatmo.get_stations_data",
+        side_effect=[rejected_token(), stations("s1", "s2")],
+    )
+    account = make_account("a", device_ids=["s2"])
+    metrics = netatmo_accounts.poll_account(account, tokens)
+    assert get_stations_data.call_args[0][0] == "new"
+    assert get_stations_data.call_args.kwargs["budget_key"] == account.budget_key
+    assert [(m["account"], m["device"]) for m in metrics] == [("a", "Outdoor")]
+
+
+def test_collect_isolates_failing_accounts(mocker):
+    """A failing or slow account doesn't hold up the others"""
+
+    def poll(account, tokens, session=None):
+        """One account fails, the others take a while"""
+        if account.name == "broken":
+            raise requests.ConnectionError("down")
+        time.sleep(0.2)
+        return [{"account": account.name}]
+
+    mocker.patch("home_automation.netatmo_accounts.poll_account", side_effect=poll)
+    accounts = [make_account(name) for name in ["a", "b", "broken", "c"]]
+    start = time.perf_counter()
+    metrics, errors = netatmo_accounts.collect(accounts, TokenCache(), workers=4)
+    assert time.perf_counter() - start < 0.5
+    assert sorted(m["account"] for m in metrics) == ["a", "b", "c"]
+    assert list(errors) == ["broken"]
+
+
+def test_run_writes_one_batch(mocker, tmp_path, monkeypatch):
+    """Every account's readings go to InfluxDB in one write, tagged with it
+    and stamped with the upload they came in"""
+    path = tmp_path / "accounts.json"
+    path.write_text(json.dumps([make_account(n).model_dump(mode="json") for n in "ab"]))
+    monkeypatch.setattr(utilities.SETTINGS, "netatmo_accounts_file", str(path))
+    mocker.patch(
+        "home_automation.netatmo.request_token",
+        return_value={"access_token": "t", "refresh_token": "r", "expires_in": 1},
+    )
+    mocker.patch(
+        "home_automation.netatmo.get_stations_data", return_value=stations("s1")
+    )
+    influx = mocker.patch("home_automation.netatmo_accounts.InfluxDBClient")
+
+    assert netatmo_accounts.run() == {}
+    influx.return_value.write_points.assert_called_once()
+    points = influx.return_value.write_points.call_args[0][0]
+    assert sorted(p.split(" ")[0] for p in points) == [
+        "Temperature,account=a,device=Outdoor,product=netatmo",
+        "Temperature,account=b,device=Outdoor,product=netatmo",
+    ]
+    assert all(p.endswith(" 1700000000000") for p in points)
+    archived = columnar.ColumnStore.from_settings(utilities.SETTINGS).read(
+        netatmo_accounts.TABLE, ["device"]
+    )
+    assert sorted(archived["device"]) == ["a/Outdoor", "b/Outdoor"]
+
+
+def test_run_fails_when_no_account_can_be_read(mocker, tmp_path, monkeypatch):
+    """The job is reported as failed only if every account failed"""
+    path = tmp_path / "accounts.json"
+    path.write_text(json.dumps([make_account("a").model_dump(mode="json")]))
+    monkeypatch.setattr(utilities.SETTINGS, "netatmo_accounts_file", str(path))
+    mocker.patch(
+        "home_automation.netatmo.request_token",
+        side_effect=requests.ConnectionError("down"),
+    )
+    influx = mocker.patch("home_automation.netatmo_accounts.InfluxDBClient")
+    with pytest.raises(RuntimeError):
+        netatmo_accounts.run()
+    influx.return_value.write_points.assert_not_called()
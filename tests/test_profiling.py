@@ -0,0 +1,133 @@
+"""Tests for the profiling module"""
+
+import os
+import pstats
+import subprocess
+import sys
+import threading
+
+from home_automation import profiling
+
+
+def test_phase_without_profiler():
+    """A phase is a plain no-op when profiling is off"""
+    assert profiling._profiler is None
+    with profiling.phase("fetch"):
+        value = 1
+    assert value == 1
+
+
+def test_start_stop_writes_results(tmp_path, capsys):
+    """Profiling a couple of phases writes the pstats and summary files and
+    prints a table of the phases.
+    """
+    settings = profiling.ProfileSettings(profile_dir=str(tmp_path), profile_top=5)
+    profiling.start(name="job", settings=settings)
+    with profiling.phase("fetch"):
+        sum(range(1000))
+    with profiling.phase("fetch"):
+        sum(range(1000))
+    with profiling.phase("write"):
+        pass
+    phases = profiling._profiler.phases
+    profiling.stop()
+
+    assert profiling._profiler is None
+    assert list(phases) == ["fetch", "write", "total"]
+    files = sorted(os.listdir(tmp_path))
+    assert len(files) == 2
+    assert files[0].endswith(".pstats")
+    assert files[1].endswith(".txt")
+    output = capsys.readouterr().out
+    assert "fetch" in output
+    assert "Peak mem (MiB)" in output
+
+
+def test_concurrent_phases_have_no_peak(tmp_path):
+    """The memory peak is process wide, so phases that overlap don't report
+    one, while a phase that ran alone does.
+    """
+    settings = profiling.ProfileSettings(profile_dir=str(tmp_path), profile_memory=True)
+    profiling.start(name="job", settings=settings)
+    started = threading.Barrier(2)
+
+    def overlapping(name):
+        """A phase that waits until the other has started"""
+        with profiling.phase(name):
+            started.wait()
+
+    workers = [threading.Thread(target=overlapping, args=(n,)) for n in "ab"]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    with profiling.phase("alone"):
+        bytearray(2**20)
+    phases = profiling._profiler.phases
+    profiling.stop()
+
+    assert phases["a"][2] is None and phases["b"][2] is None
+    assert phases["alone"][2] >= 2**20
+    assert phases["total"][2] > 0
+
+
+def test_main_runs_script(tmp_path, capsys):
+    """The wrapper runs a script as __main__ with the profiler switched on"""
+    script = tmp_path / "job.py"
+    script.write_text(
+        "from home_automation import profiling\n"
+        "with profiling.phase('compute'):\n"
+        "    print('ran', __name__)\n"
+    )
+    profiling.main(
+        ["--profile", "--memory", "--profile-dir", str(tmp_path), str(script)]
+    )
+
+    output = capsys.readouterr().out
+    assert "ran __main__" in output
+    assert "compute" in output
+    assert any(name.endswith(".pstats") for name in os.listdir(tmp_path))
+
+
+def test_worker_threads_are_profiled(tmp_path):
+    """Work done on threads started while profiling is in the results"""
+
+    def busy_worker():
+        """Something to find in the stats"""
+        return sum(range(1000))
+
+    settings = profiling.ProfileSettings(profile_dir=str(tmp_path))
+    profiling.start(name="job", settings=settings)
+    worker = threading.Thread(target=busy_worker)
+    worker.start()
+    worker.join()
+    profiling.stop()
+
+    (path,) = [name for name in os.listdir(tmp_path) if name.endswith(".pstats")]
+    stats = pstats.Stats(str(tmp_path / path))
+    assert any(function == "busy_worker" for _, _, function in stats.stats)
+
+
+def test_command_line_options_with_autostart(tmp_path):
+    """With profile_enabled set the command line options still apply, the
+    session isn't started on import
+    """
+    script = tmp_path / "job.py"
+    script.write_text("print('ran')\n")
+    profiles = tmp_path / "profiles"
+    subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "home_automation.profiling",
+            "--profile-dir",
+            str(profiles),
+            "--top",
+            "3",
+            str(script),
+        ],
+        check=True,
+        env=dict(os.environ, profile_enabled="true", profile_dir=str(tmp_path)),
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    assert any(name.endswith(".pstats") for name in os.listdir(profiles))
@@ -0,0 +1,61 @@
+"""Tests for the ratelimit module"""
+
+from home_automation.ratelimit import TokenBucketLimiter
+
+
+def test_bucket_spends_and_refills(tmp_path, mocker):
+    """Tokens run out and come back at the refill rate"""
+    clock = mocker.patch("time.time", return_value=1000)
+    limiter = TokenBucketLimiter(str(tmp_path / "limits.sqlite"), {"api": (2, 1)})
+
+    assert limiter.acquire("api", "key", max_wait=0)
+    assert limiter.acquire("api", "key", max_wait=0)
+    assert not limiter.acquire("api", "key", max_wait=0)
+
+    clock.return_value = 1001
+    assert limiter.remaining("api", "key") == 1
+
+
+def test_buckets_shared_between_instances(tmp_path, mocker):
+    """A second limiter on the same file, like another process, sees the
+    tokens the first one took, while other API keys have their own bucket.
+    """
+    mocker.patch("time.time", return_value=1000)
+    path = str(tmp_path / "limits.sqlite")
+    TokenBucketLimiter(path, {"api": (1, 0.01)}).acquire("api", "key")
+    other = TokenBucketLimiter(path, {"api": (1, 0.01)})
+
+    assert not other.acquire("api", "key", max_wait=0)
+    assert other.acquire("api", "another key", max_wait=0)
+
+
+def test_acquire_waits_and_reports(tmp_path, mocker):
+    """When the budget is spent the request waits for it to refill, and the
+    remaining budget is reported once it is granted.
+    """
+    clock = mocker.patch("time.time", return_value=1000)
+    mocker.patch(
+        "time.sleep", side_effect=lambda s: setattr(clock, "return_value", 1000 + s)
+    )
+    report = mocker.Mock()
+    limiter = TokenBucketLimiter(
+        str(tmp_path / "limits.sqlite"), {"api": (1, 0.5)}, report=report
+    )
+
+    assert limiter.acquire("api", "key")
+    assert limiter.acquire("api", "key")
+    assert report.call_args_list == [mocker.call("api", 0), mocker.call("api", 0)]
+
+
+def test_bucket_without_refill_is_not_waited_for(tmp_path, mocker):
+    """A rate of 0 never refills, so a spent budget is refused without
+    waiting, even when the caller would wait as long as needed
+    """
+    mocker.patch("time.time", return_value=1000)
+    sleep = mocker.patch("time.sleep")
+    limiter = TokenBucketLimiter(str(tmp_path / "limits.sqlite"), {"api": (1, 0)})
+
+    assert limiter.acquire("api", "key")
+    assert not limiter.acquire("api", "key")
+    assert not limiter.acquire("api", "key", max_wait=60)
+    sleep.assert_not_called()
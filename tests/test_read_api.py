@@ -0,0 +1,113 @@
+"""Tests for the read_api module"""
+
+import http.client
+import json
+import threading
+
+import pytest
+
+from home_automation import read_api
+
+
+@pytest.fixture
+def server(snapshot):
+    """The API serving the test's snapshot on a free port"""
+    running = read_api.start_server(0, "127.0.0.1", snapshot)
+    yield running
+    running.shutdown()
+    running.server_close()
+
+
+def request(server, method: str, path: str, headers=None):
+    """Sends a request to the server, returns the response and its body"""
+    connection = http.client.HTTPConnection("127.0.0.1", server.server_address[1])
+    connection.request(method, path, headers=headers or {})
+    response = connection.getresponse()
+    body = response.read()
+    connection.close()
+    return response, body
+
+
+def test_update_keeps_etag_of_unchanged_content(snapshot):
+    """Publishing the same content again changes neither the ETag nor when
+    it was updated
+    """
+    assert snapshot.update("multiplier", {"multiplier": 1}, now=1)
+    body, etag = snapshot.get("multiplier")
+    assert json.loads(body) == {"updated": 1, "data": {"multiplier": 1}}
+    assert not snapshot.update("multiplier", {"multiplier": 1}, now=2)
+    assert snapshot.get("multiplier") == (body, etag)
+    assert snapshot.update("multiplier", {"multiplier": 2}, now=3)
+    assert snapshot.get("multiplier")[1] != etag
+
+
+def test_merge_keeps_other_parts(snapshot):
+    """Each job publishes its own part of the readings"""
+    snapshot.merge("readings", "netatmo", {"Outdoor": {"Temperature": 70}})
+    snapshot.merge("readings", "indigo", {"office": {"temp": 68}})
+    body, _ = snapshot.get("readings")
+    assert json.loads(body)["data"] == {
+        "indigo": {"office": {"temp": 68}},
+        "netatmo": {"Outdoor": {"Temperature": 70}},
+    }
+
+
+def test_persisted_sections_are_loaded(tmp_path, snapshot):
+    """Sections persisted by one job are published with when they were made,
+    and persisting one section keeps the others"""
+    read_api.persist(str(tmp_path), {"multiplier": {"multiplier": 2}}, now=10)
+    read_api.persist(str(tmp_path), {"forecast": [{"Temp": 70}]}, now=20)
+
+    loaded = snapshot.load(str(tmp_path / read_api.PERSISTED_FILE))
+    assert loaded == {"multiplier": {"multiplier": 2}, "forecast": [{"Temp": 70}]}
+    body, _ = snapshot.get("multiplier")
+    assert json.loads(body) == {"updated": 10, "data": {"multiplier": 2}}
+    assert snapshot.load(str(tmp_path / "missing.json")) == {}
+
+
+def test_concurrent_merges_are_kept(snapshot):
+    """Jobs merging their parts at the same time don't lose each other's"""
+    start = threading.Barrier(8)
+
+    def publish(job: int):
+        """Merges many parts of one job"""
+        start.wait()
+        for part in range(50):
+            snapshot.merge("readings", f"{job}-{part}", part)
+
+    threads = [threading.Thread(target=publish, args=(job,)) for job in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    body, _ = snapshot.get("readings")
+    assert len(json.loads(body)["data"]) == 400
+
+
+def test_server_revalidates(server, snapshot):
+    """Sections are served with an ETag, and a matching If-None-Match gets a
+    304 without a body
+    """
+    snapshot.update("multiplier", {"multiplier": 3})
+    response, body = request(server, "GET", "/api/multiplier")
+    assert response.status == 200
+    assert response.getheader("Content-Type") == read_api.CONTENT_TYPE
+    assert json.loads(body)["data"] == {"multiplier": 3}
+
+    etag = response.getheader("ETag")
+    response, body = request(server, "GET", "/api/multiplier", {"If-None-Match": etag})
+    assert response.status == 304 and body == b""
+
+    response, body = request(server, "HEAD", "/api/multiplier")
+    assert response.status == 200 and body == b""
+
+
+def test_server_index_and_missing_sections(server, snapshot):
+    """The index lists the sections, unknown ones are not found"""
+    snapshot.update("forecast", [])
+    response, body = request(server, "GET", "/api")
+    assert list(json.loads(body)["sections"]) == ["forecast"]
+    response, _ = request(server, "GET", "/api/readings")
+    assert response.status == 404
+    response, _ = request(server, "GET", "/metrics")
+    assert response.status == 404
@@ -0,0 +1,92 @@
+"""Tests for the resilience module"""
+
+from unittest.mock import Mock
+
+import pytest
+import requests
+
+from home_automation import resilience, utilities
+
+
+def test_breaker_opens_and_probes():
+    """The breaker opens at the threshold and lets one probe through later"""
+    breaker = resilience.CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    breaker.record_failure(now=0)
+    assert breaker.allow(now=1)
+    breaker.record_failure(now=1)
+    assert breaker.is_open
+    assert not breaker.allow(now=5)
+    assert breaker.allow(now=11)  # The probe
+    assert not breaker.allow(now=12)
+    breaker.record_success()
+    assert breaker.allow(now=12)
+
+
+def test_call_adds_endpoint_timeout():
+    """A call gets the endpoint's timeout unless it brings its own"""
+    func = Mock(return_value=Mock(status_code=200))
+    resilience.call("indigo", func, "http://indigo")
+    func.assert_called_once_with("http://indigo", timeout=(3.05, 10))
+
+    resilience.call("indigo", func, "http://indigo", timeout=1)
+    assert func.call_args.kwargs["timeout"] == 1
+
+
+def test_call_fails_fast_when_open(tmp_path):
+    """Repeated errors open the breaker, which is persisted for the next run"""
+    path = str(tmp_path / "breakers.json")
+    resilience.BREAKERS = resilience.BreakerRegistry(path, failure_threshold=2)
+    func = Mock(side_effect=requests.exceptions.ConnectTimeout)
+
+    for _ in range(2):
+        with pytest.raises(requests.exceptions.ConnectTimeout):
+            resilience.call("netatmo", func)
+    with pytest.raises(resilience.CircuitOpenError):
+        resilience.call("netatmo", func)
+    assert func.call_count == 2
+
+    assert resilience.BreakerRegistry(path).get("netatmo").is_open
+
+
+def test_processes_keep_each_others_breakers(tmp_path):
+    """Two registries on one file, like two Jobs, each save only the
+    breakers they changed"""
+    path = str(tmp_path / "breakers.json")
+    first = resilience.BreakerRegistry(path, failure_threshold=1)
+    second = resilience.BreakerRegistry(path, failure_threshold=1)
+    first.get("netatmo")
+    second.get("indigo")
+
+    first.get("netatmo").record_failure(now=1000)
+    first.save("netatmo")
+    second.get("indigo").record_failure(now=1001)
+    second.save("indigo")
+
+    reloaded = resilience.BreakerRegistry(path)
+    assert reloaded.get("netatmo").opened_at == 1000
+    assert reloaded.get("indigo").opened_at == 1001
+
+
+def test_server_errors_count_as_failures():
+    """5xx responses are returned but still count against the breaker"""
+    func = Mock(return_value=Mock(status_code=503))
+    for _ in range(3):
+        assert resilience.call("indigo", func).status_code == 503
+    assert resilience.BREAKERS.get("indigo").is_open
+
+
+def test_deadline_limits_timeouts(mocker):
+    """Calls inherit what is left of the job's deadline"""
+    mocker.patch("time.monotonic", return_value=100)
+    resilience.start_deadline(4)
+    assert resilience.timeout_for("tomorrow_io") == (3.05, 4)
+
+    mocker.patch("time.monotonic", return_value=105)
+    with pytest.raises(resilience.DeadlineExceeded):
+        resilience.timeout_for("tomorrow_io")
+
+
+def test_indigo_update_degrades_gracefully(mocker):
+    """An unreachable Indigo server makes the update return False"""
+    mocker.patch("requests.post", side_effect=requests.exceptions.ReadTimeout)
+    assert utilities.update_indigo_variable(1, "value") is False
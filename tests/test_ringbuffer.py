@@ -0,0 +1,60 @@
+"""Tests for the ringbuffer module"""
+
+import numpy as np
+import pytest
+
+from home_automation.ringbuffer import RingBuffer, RingBufferStore, dew_point
+
+
+def test_append_wraps_around(tmp_path):
+    """Once full the oldest readings are replaced"""
+    buffer = RingBuffer(str(tmp_path / "sensor"), capacity=3)
+    for second in range(5):
+        buffer.append(second, second * 10)
+
+    assert len(buffer) == 3
+    assert buffer.latest() == (4.0, 40.0)
+    times, values = buffer.window(10, now=4)
+    assert list(times) == [2, 3, 4]
+    assert list(values) == [20, 30, 40]
+
+
+def test_aggregates(tmp_path):
+    """Statistics only cover readings inside the window"""
+    buffer = RingBuffer(str(tmp_path / "sensor"), capacity=10)
+    for second, value in enumerate([5, 1, 7, 3]):
+        buffer.append(second, value)
+
+    assert buffer.aggregate("max", 10, now=3) == 7
+    assert buffer.aggregate("min", 2, now=3) == 3
+    assert buffer.aggregate("sum", 10, now=3) == 16
+    assert buffer.aggregate("mean", 10, now=3) == 4
+    assert buffer.aggregate("mean", 10, now=100) is None
+
+
+def test_persisted_between_instances(tmp_path):
+    """A reopened buffer sees earlier readings"""
+    RingBuffer(str(tmp_path / "sensor"), capacity=3).append(1, 2)
+    buffer = RingBuffer(str(tmp_path / "sensor"), capacity=100)
+    assert buffer.capacity == 3
+    assert buffer.latest() == (1.0, 2.0)
+
+
+def test_store_ignores_non_numeric(tmp_path):
+    """Values like 'on' can't be aggregated and are skipped"""
+    store = RingBufferStore(str(tmp_path))
+    assert store.append("Outdoor", "Temperature", 1, "72.5")
+    assert not store.append("Outdoor", "Temperature", 2, "on")
+    assert store.aggregate("Outdoor", "Temperature", "max", 10, now=2) == 72.5
+
+
+def test_store_dew_point(tmp_path):
+    """Temperature and humidity readings are paired by timestamp"""
+    store = RingBufferStore(str(tmp_path))
+    store.append("Outdoor", "Temperature", 1, 68)
+    store.append("Outdoor", "Temperature", 2, 77)
+    store.append("Outdoor", "Humidity", 2, 60)
+
+    times, points = store.dew_point("Outdoor", 10, now=2)
+    assert list(times) == [2]
+    assert points[0] == pytest.approx(np.asarray(dew_point(25, 60)) * 9 / 5 + 32)
@@ -1,6 +1,7 @@
 """Tests for the sprinkler multiplier module"""
 
 import smtplib
+import time
 from datetime import datetime
 from unittest.mock import Mock, patch
 
@@ -8,7 +9,7 @@ import matplotlib.pyplot as plt
 import pandas
 import pytest
 
-from home_automation import sprinkler_multiplier, utilities
+from home_automation import columnar, read_api, sprinkler_multiplier, utilities
 
 
 @pytest.fixture
@@ -238,6 +239,55 @@ def test_high_temp_loop(mocker, get_good_api_response):
     my_class.calc_multiplier()
 
 
+def test_calc_multiplier_et_engine(mocker, get_good_api_response):
+    """
+    Test case for the evapotranspiration engine: the hourly forecast is
+    requested and the multiplier comes from the water deficit.
+
+    Args:
+        mocker: The mocker object used for mocking the requests.request function.
+        get_good_api_response: The daily API response data used for testing.
+
+    Returns:
+        None
+    """
+    hourly_response = {
+        "data": {
+            "timelines": [
+                {
+                    "timestep": "1h",
+                    "intervals": [
+                        {
+                            "startTime": f"2024-07-01T{hour:02d}:00:00Z",
+                            "values": {
+                                "temperature": 32,
+                                "humidity": 15,
+                                "windSpeed": 5,
+                                "solarGHI": 800 if 13 <= hour <= 23 else 0,
+                                "rainAccumulation": 0,
+                            },
+                        }
+                        for hour in range(24)
+                    ],
+                }
+            ]
+        }
+    }
+    daily = Mock(ok=True)
+    daily.json.return_value = get_good_api_response
+    hourly = Mock(ok=True)
+    hourly.json.return_value = hourly_response
+    mock_request = mocker.patch("requests.request", side_effect=[daily, hourly])
+
+    my_class = sprinkler_multiplier.sprinkler_multiplier(engine="et")
+    my_class.calc_multiplier()
+
+    assert mock_request.call_count == 2
+    assert my_class.water_deficit > 6  # Hot, dry and windy
+    assert my_class.value == 4
+    assert "Water deficit" in my_class.text_report()
+
+
 def test_text_report(my_class):
     """
     Test the text_report method of MyClass.
@@ -503,3 +553,98 @@ def test_update_magicmirror_internal_temperature_not_ok(mock_post):
 
     # Assert that the function returned False
     assert result is False
+
+
+def test_forecast_archived(mocker, tmp_path, get_good_api_response):
+    """Every fetched forecast is kept with its issue time, along with the
+    multiplier, in the store of the settings the job was run with
+
+    Parameters
+    ----------
+    mocker : pytest_mock.MockerFixture
+        Patches the forecast, chart, Indigo and email
+    tmp_path : pathlib.Path
+        State directory of the settings passed to the job
+    get_good_api_response : dict
+        The forecast served to the job
+    """
+    mock_response = Mock(ok=True)
+    mock_response.json.return_value = get_good_api_response
+    mocker.patch("requests.request", return_value=mock_response)
+    mocker.patch.object(sprinkler_multiplier.sprinkler_multiplier, "get_chart")
+    mocker.patch.object(sprinkler_multiplier.sprinkler_multiplier, "get_email_message")
+    mocker.patch("home_automation.utilities.update_indigo_variable")
+    mocker.patch("home_automation.utilities.send_email")
+    settings = sprinkler_multiplier.settings.model_copy(
+        update={"state_dir": str(tmp_path)}
+    )
+
+    sprinkler_multiplier.run(settings)
+    store = columnar.ColumnStore.from_settings(settings)
+    data = store.read("forecast_daily", ["temperature", "issued"])
+    assert data["temperature"][0] == 27.28
+    assert len(data["issued"]) == 6
+    assert len(store.read("sprinkler", ["multiplier"])["multiplier"]) == 1
+    persisted = read_api.Snapshot().load(str(tmp_path / read_api.PERSISTED_FILE))
+    assert persisted["forecast"][0]["Temp"] == 27.28
+
+
+def test_summary(my_class):
+    """The summary is plain JSON ready data with the forecast it came from
+
+    Parameters
+    ----------
+    my_class : sprinkler_multiplier.sprinkler_multiplier
+        The pytest fixture in which the tests will be performed
+    """
+    summary = my_class.summary()
+    assert summary["multiplier"] == my_class.value
+    assert summary["rain"] == pytest.approx(0.02)
+    assert summary["average_temperature"] == pytest.approx(32.996)
+    assert summary["forecast"][0] == {
+        "Date": "2024-01-15",
+        "Rain (in)": 0,
+        "Temp": 27.28,
+    }
+
+
+def test_run_updates_indigo_without_waiting_for_the_report(
+    mocker, get_good_api_response
+):
+    """Indigo is updated while the chart is still rendering, and the email
+    goes out once the chart is done
+
+    Parameters
+    ----------
+    mocker : pytest_mock.MockerFixture
+        Patches the forecast, chart, Indigo and email
+    get_good_api_response : dict
+        The forecast served to the job
+    """
+    mock_response = Mock(ok=True)
+    mock_response.json.return_value = get_good_api_response
+    mocker.patch("requests.request", return_value=mock_response)
+    events = []
+    mocker.patch.object(
+        sprinkler_multiplier.sprinkler_multiplier,
+        "get_chart",
+        lambda self, executor=None: time.sleep(0.2) or events.append("chart"),
+    )
+    mocker.patch.object(
+        sprinkler_multiplier.sprinkler_multiplier,
+        "get_email_message",
+        lambda self: "message",
+    )
+    mocker.patch(
+        "home_automation.utilities.update_indigo_variable",
+        side_effect=lambda *args, **kwargs: events.append("indigo") or True,
+    )
+    send_email = mocker.patch(
+        "home_automation.utilities.send_email",
+        side_effect=lambda message: events.append("email"),
+    )
+
+    sprinkler = sprinkler_multiplier.run()
+    assert events == ["indigo", "chart", "email"]
+    send_email.assert_called_once_with("message")
+    assert sprinkler.value >= 0
@@ -0,0 +1,52 @@
+"""Tests for the stages module"""
+
+import threading
+import time
+
+import pytest
+
+from home_automation.stages import StageGraph
+
+
+def test_independent_stages_overlap(gauges):
+    """Stages after the same stage run at once, and each is timed"""
+    graph = StageGraph("job")
+    graph.add("fetch", lambda: 1)
+    graph.add("slow", lambda: time.sleep(0.3) or "slow", after=("fetch",))
+    graph.add("slower", lambda: time.sleep(0.3) or "slower", after=("fetch",))
+    start = time.perf_counter()
+    results = graph.run()
+    assert time.perf_counter() - start < 0.55
+    assert results == {"fetch": 1, "slow": "slow", "slower": "slower"}
+    assert graph.timings["slow"] >= 0.3
+    assert gauges.get("job_stage_seconds", {"job": "job", "stage": "slow"}) >= 0.3
+
+
+def test_stage_waits_for_what_it_comes_after():
+    """A stage starts once every stage before it has finished"""
+    done = threading.Event()
+    graph = StageGraph("job")
+    graph.add("first", lambda: time.sleep(0.1) or done.set())
+    graph.add("second", done.is_set, after=("first",))
+    assert graph.run()["second"] is True
+
+
+def test_failure_skips_later_stages():
+    """The stages after a failed one are skipped, the rest carry on, and the
+    failure is raised at the end
+    """
+    ran = []
+    graph = StageGraph("job")
+    graph.add("fetch", lambda: ran.append("fetch"))
+    graph.add("broken", lambda: 1 / 0, after=("fetch",))
+    graph.add("after_broken", lambda: ran.append("after"), after=("broken",))
+    graph.add("other", lambda: ran.append("other"), after=("fetch",))
+    with pytest.raises(ZeroDivisionError):
+        graph.run()
+    assert sorted(ran) == ["fetch", "other"]
+
+
+def test_unknown_dependency():
+    """Stages have to be added after the stages they wait for"""
+    with pytest.raises(ValueError):
+        StageGraph("job").add("email", print, after=("chart",))
@@ -0,0 +1,80 @@
+"""Tests for the streaming_json module"""
+
+import json
+from unittest.mock import Mock
+
+import pytest
+
+from home_automation import streaming_json
+
+BODY = {
+    "status": "ok",
+    "body": {
+        "user": {"mail": "someone@example.com", "units": [0, 1]},
+        "devices": [
+            {"_id": "a", "module_name": "Indoor", "dashboard_data": {"CO2": 450}},
+            {"_id": "b", "module_name": "Café", "reachable": True, "big": [1] * 50},
+        ],
+    },
+    "time_server": 1700000000,
+}
+
+
+def chunked(document, size: int) -> list:
+    """Splits the encoded document into chunks of size bytes"""
+    data = json.dumps(document, ensure_ascii=False).encode("utf-8")
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("size", [1, 7, 4096])
+def test_items_at_path(size):
+    """Items are found behind sibling values, whatever the chunk boundaries,
+    including multibyte characters split between chunks
+    """
+    items = list(
+        streaming_json.iter_chunk_items(
+            chunked(BODY, size), "body.devices", ["_id", "module_name"]
+        )
+    )
+    assert items == [
+        {"_id": "a", "module_name": "Indoor"},
+        {"_id": "b", "module_name": "Café"},
+    ]
+
+
+def test_top_level_array_and_numbers():
+    """A top level array streams, numbers split between chunks stay whole"""
+    chunks = [b"[12", b"34, 5.", b"5 , {}]"]
+    assert list(streaming_json.iter_chunk_items(chunks)) == [1234, 5.5, {}]
+    assert list(streaming_json.iter_chunk_items([b" [ ] "])) == []
+
+
+def test_items_are_lazy():
+    """The first item is available before the rest of the body is read"""
+    read = []
+
+    def chunks():
+        """Records how far the body has been read"""
+        for chunk in chunked([{"n": 1}, {"n": 2}], 4):
+            read.append(chunk)
+            yield chunk
+
+    items = streaming_json.iter_chunk_items(chunks())
+    assert next(items) == {"n": 1}
+    assert len(read) < len(chunked([{"n": 1}, {"n": 2}], 4))
+
+
+def test_missing_path():
+    """A path that isn't in the document is an error"""
+    with pytest.raises(KeyError):
+        list(streaming_json.iter_chunk_items(chunked(BODY, 64), "body.modules"))
+
+
+def test_iter_items_reads_response(mocker):
+    """Responses are read in chunks when ijson is not installed"""
+    mocker.patch.object(streaming_json, "ijson", None)
+    response = Mock()
+    response.iter_content.return_value = chunked(BODY, 16)
+    items = list(streaming_json.iter_items(response, "body.devices", ["_id"]))
+    assert items == [{"_id": "a"}, {"_id": "b"}]
+    response.iter_content.assert_called_once_with(65536)
@@ -1,10 +1,12 @@
 """Tests for the utilities module"""
 
+import os
 import random
 
 import pytest
 
 from home_automation import utilities
+from home_automation.write_behind import WriteBehindBuffer
 
 
 # Test updating a variable in indigo
@@ -18,3 +20,83 @@ def test_update_indigo_var():
     assert utilities.update_indigo_variable(object_id=object_id, value=random_number)
     return_value = utilities.get_indigo_variable(object_id=object_id)
     assert str(random_number) == return_value
+
+
+def test_update_indigo_variable_skips_unchanged(mocker):
+    """The second write of the same value does not reach Indigo, unless forced"""
+    mock_post = mocker.patch("requests.post")
+    mock_post.return_value.ok = True
+
+    assert utilities.update_indigo_variable(1, 2)
+    assert utilities.update_indigo_variable(1, 2)
+    assert mock_post.call_count == 1
+
+    assert utilities.update_indigo_variable(1, 2, force=True)
+    assert mock_post.call_count == 2
+
+
+def test_update_indigo_variable_failure_not_recorded(mocker):
+    """A failed write is retried on the next call"""
+    mock_post = mocker.patch("requests.post")
+    mock_post.return_value.ok = False
+
+    assert not utilities.update_indigo_variable(1, 2)
+    assert not utilities.update_indigo_variable(1, 2)
+    assert mock_post.call_count == 2
+
+
+def test_update_indigo_variable_by_name(mocker, indigo_variables):
+    """Names are resolved to the object id the API takes"""
+    indigo_variables.fetch = lambda: [{"id": 42, "name": "Netatmo_Outside_Temp"}]
+    mock_post = mocker.patch("requests.post")
+    mock_post.return_value.ok = True
+
+    assert utilities.update_indigo_variable("Netatmo_Outside_Temp", 71)
+    assert '"objectId": 42' in mock_post.call_args.kwargs["data"]
+    assert not utilities.update_indigo_variable("Unknown", 71)
+    assert mock_post.call_count == 1
+
+
+def test_update_indigo_variable_write_behind(mocker, monkeypatch):
+    """With a write interval a burst of updates is sent as one write"""
+    monkeypatch.setattr(utilities.SETTINGS, "indigo_write_interval", 60)
+    buffer = WriteBehindBuffer(utilities._write_indigo_variable, interval=60)
+    monkeypatch.setattr(utilities, "INDIGO_WRITE_BUFFER", buffer)
+    mock_post = mocker.patch("requests.post")
+    mock_post.return_value.ok = True
+
+    for value in (70, 71, 72):
+        assert utilities.update_indigo_variable(42, value)
+    mock_post.assert_not_called()
+    buffer.close()
+    mock_post.assert_called_once()
+    assert '"value": "72"' in mock_post.call_args.kwargs["data"]
+    assert buffer.counts["coalesced"] == 2
+
+
+def test_settings_loader_reloads_changed_secrets(tmp_path):
+    """The Settings are built once, and re-read into the same instance only
+    when a secret file changes
+    """
+    secret = tmp_path / "indigo_password"
+    secret.write_text("one")
+    loader = utilities.SettingsLoader(str(tmp_path))
+
+    settings = loader.get()
+    assert loader.get() is settings
+    assert settings.indigo_password.get_secret_value() == "one"
+    assert not loader.reload_if_changed()
+
+    secret.write_text("two")
+    os.utime(secret, ns=(0, secret.stat().st_mtime_ns + 1))
+    assert loader.reload_if_changed()
+    assert loader.get() is settings
+    assert settings.indigo_password.get_secret_value() == "two"
+    assert not loader.reload_if_changed()
+
+
+def test_settings_loader_without_secrets():
+    """A missing secrets directory is ignored"""
+    loader = utilities.SettingsLoader("/nonexistent/secrets")
+    assert loader.get().indigo_password is None
+    assert not loader.reload_if_changed()
@@ -0,0 +1,63 @@
+"""Tests for the write_behind module"""
+
+import threading
+import time
+
+from home_automation.write_behind import WriteBehindBuffer
+
+
+def test_coalesces_and_drains():
+    """Only the latest value of each key is written, when the buffer closes"""
+    writes = []
+    reports = []
+    buffer = WriteBehindBuffer(
+        lambda key, value, **options: writes.append((key, value, options)) or True,
+        interval=60,
+        report=reports.append,
+    )
+    for value in range(5):
+        buffer.put("a", value, force=value == 4)
+    buffer.put("b", "x")
+    assert buffer.pending == 2 and writes == []
+
+    buffer.close()
+    assert writes == [("a", 4, {"force": True}), ("b", "x", {})]
+    assert buffer.counts == {"queued": 6, "coalesced": 4, "written": 2, "failed": 0}
+    assert reports[-1] == buffer.counts
+
+
+def test_flushes_on_interval_and_size():
+    """Writes go out after the interval, or as soon as the buffer is full"""
+    written = threading.Event()
+    buffer = WriteBehindBuffer(
+        lambda key, value: written.set() or True, interval=0.05, max_pending=100
+    )
+    buffer.put("a", 1)
+    assert written.wait(1)
+
+    written.clear()
+    buffer.interval = 60
+    buffer.close()
+    buffer.max_pending = 2
+    start = time.monotonic()
+    buffer.put("a", 1)
+    buffer.put("b", 2)
+    assert written.wait(1) and time.monotonic() - start < 1
+    buffer.close()
+
+
+def test_failed_writes_are_counted():
+    """A failing write doesn't stop the others"""
+
+    def write(key, value):
+        """Fails for one key"""
+        if key == "bad":
+            raise ValueError("nope")
+        return True
+
+    buffer = WriteBehindBuffer(write, interval=60)
+    buffer.put("bad", 1)
+    buffer.put("good", 2)
+    assert buffer.flush() == 1
+    assert buffer.counts["failed"] == 1 and buffer.counts["written"] == 1
+    buffer.close()
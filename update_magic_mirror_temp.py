@@ -1,12 +1,28 @@
 """Updates the magic mirror indoor temperature setting based on the
-   office_temperature variable, which is set by a scheduled task named:
-   'Update Office Temperature'
+office_temperature variable, which is set by a scheduled task named:
+'Update Office Temperature'
+
+Run with --push to keep running and forward every change as it happens.
 """
 
-from home_automation import utilities
+import argparse
+
+from home_automation import profiling
 
-variable = "office_temperature"
+with profiling.phase("imports"):
+    from home_automation import magic_mirror, resilience, utilities
 
-indoor_temperature = utilities.get_indigo_variable(variable)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update the MagicMirror temperature")
+    parser.add_argument(
+        "--push", action="store_true", help="Follow the variable and push changes"
+    )
+    parser.add_argument("--debounce", type=float, default=0.5)
+    parser.add_argument("--poll-interval", type=float, default=5.0)
+    args = parser.parse_args()
 
-utilities.update_magicmirror_internal_temperature(indoor_temperature)
+    if not args.push:
+        resilience.start_deadline(utilities.SETTINGS.job_deadline)
+    magic_mirror.run(
+        push=args.push, debounce=args.debounce, poll_interval=args.poll_interval
+    )
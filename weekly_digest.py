@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""Emails a digest of the multipliers, the rain and the sensors of the last week"""
+
+import argparse
+
+from home_automation import profiling
+
+with profiling.phase("imports"):
+    from home_automation import digest
+
+
+def main(argv=None):
+    """Parses the command line and sends, or prints, the digest"""
+    parser = argparse.ArgumentParser(description="Weekly digest")
+    parser.add_argument("--days", type=int, default=7, help="How many days to cover")
+    parser.add_argument(
+        "--print-only",
+        action="store_true",
+        help="Print the digest without emailing it",
+    )
+    args = parser.parse_args(argv)
+
+    digest.run(days=args.days, send=not args.print_only)
+
+
+if __name__ == "__main__":
+    main()